@@ -1,3 +1,4 @@
+import atexit
 import json
 import os
 import platform
@@ -5,6 +6,7 @@ import queue as pyqueue
 import re
 import shlex
 import shutil
+import sqlite3
 import subprocess
 import sys
 import threading
@@ -13,7 +15,7 @@ import zipfile
 import io
 import base64
 from pathlib import Path
-from tkinter import BOTH, LEFT, RIGHT, TOP, BOTTOM, X, Y, NSEW, END, DISABLED, NORMAL, StringVar, IntVar, BooleanVar, HORIZONTAL, TclError
+from tkinter import BOTH, LEFT, RIGHT, TOP, BOTTOM, X, Y, NSEW, END, DISABLED, NORMAL, StringVar, IntVar, DoubleVar, BooleanVar, HORIZONTAL, TclError
 from tkinter import filedialog
 from urllib.parse import urlparse
 import ttkbootstrap as tb
@@ -22,10 +24,26 @@ from ttkbootstrap.scrolled import ScrolledFrame, ScrolledText
 import webbrowser
 import warnings
 import copy
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time as dtime
 
-from runner import Runner, Task
+from runner import Runner, Task, DomainScheduler, BandwidthGovernor, processing_stage
 from presets import list_presets, preset_args
+from probes import ProbeCache
+from infocache import InfoJsonCache
+from queueitem import QueueItem, summarize
+from fragments import FragmentTuner
+from metrics import MetricsRecorder
+from profiling import Profiler, profiling_requested
+from tasklog import TaskLogStore, read_tail
+from library import MediaLibrary
+from dedupe import Deduper
+from sidecars import ingest_files, scan_folder
+from formats import FormatPlan, choose, expand_formats, format_size, split_option
+from diskspace import DiskBudget
+import procstats
+from procstats import ResourceMonitor
+from scratch import cleanup_orphans, paths_args, temp_dir
+from jobstore import ArchiveMirror, JobStore, NodeWorker, archive_key, job_args, split_local
 
 try:
     from PIL import Image, ImageTk, __version__ as pil_ver
@@ -48,6 +66,25 @@ USER_PROFILE_URL = "https://github.com/connoisseurofdrpepper"
 ORIGINAL_REPO_URL = "https://github.com/ErrorFlynn/ytdlp-interface"
 GHOSTY_REPO_URL = "https://github.com/TheFrenchGhosty/TheFrenchGhostys-Ultimate-YouTube-DL-Scripts-Collection"
 
+# Format URLs in extracted data expire (YouTube: ~6 hours); older data is re-extracted
+INFO_JSON_MAX_AGE = 4 * 3600
+
+CONSOLE_FLUSH_MS = 50
+# With "Limited buffer size" the console keeps this many lines; full output is in the task logs
+CONSOLE_MAX_LINES = 5000
+LOG_VIEW_MAX_BYTES = 2 * 1024 * 1024
+# One pass over newly added console text; group names are the highlight tags
+CONSOLE_HIGHLIGHT_RE = re.compile(
+    r"(?P<error>\bERROR\b.*$)"
+    r"|(?P<warning>\bWARNING\b.*$)"
+    r"|(?P<download>\[download\])"
+    r"|(?P<postprocess>\[(?:Merger|ExtractAudio|EmbedThumbnail|EmbedSubtitle|Metadata|FFmpeg\w*|VideoConvertor|"
+    r"VideoRemuxer|SplitChapters|ModifyChapters|SponsorBlock|Fixup\w*)\])"
+    r"|(?P<runner>\[(?:RUN|END|QUEUE|RETRY|RATE|PREEMPT|PAUSE|RESUME|CANCEL|ERROR)\])"
+    r"|(?P<percent>\b\d{1,3}(?:\.\d+)?%)",
+    re.M,
+)
+
 # Base64 encoded 16x16 YouTube favicon
 YOUTUBE_FAVICON_B64 = "iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAAl0lEQVQ4jWNkoBAwUqifYdQABgYGBkYVAz9//mRkZGRkYGBgYGBg+P//PwMDAwMDw48fP/5//vxlsbKy/g+2z8DAwMAA5YQBw/8/s/9//s/A8O/v/z8DAwMDwz8/f/5/9v/f//8ZGBgYGBgYGBh+//37/+/79+/+v3z58v/v37//Z2BgYGBgYGBg+Pfv3/9/f//+//v37//v37//Z2BgYAAA7B8Uqf4lA80AAAAASUVORK5CYII="
 
@@ -68,6 +105,9 @@ class Config(dict):
             "show_format_note_col": True,
             "show_ext_col": True,
             "show_filesize_col": True,
+            "show_cpu_time_col": False,
+            "show_peak_ram_col": False,
+            "show_disk_traffic_col": False,
             "show_website_favicon_col": False,
             "show_website_text_col": False,
             "finish_action": "none",
@@ -82,7 +122,31 @@ class Config(dict):
             "queue_max_concurrent": 1,
             "queue_max_data_instances": 4,
             "queue_start_on_lengthy": True,
+            "queue_max_postprocessing": 2,
+            "pipeline_split": False,
+            "pipeline_cpu_workers": 0,
+            "adaptive_fragments": False,
+            "adaptive_fragments_max": 16,
+            "disk_admission": True,
+            "disk_reserve_mb": 1024,
+            "resource_accounting": True,
+            "resource_max_ram_mb": 0,
+            "resource_max_cpu_cores": 0,
+            "queue_metrics_export": True,
+            "task_logs": True,
+            "task_logs_keep_days": 30,
+            "queue_reuse_info_json": True,
+            "library_index": True,
+            "library_skip_existing": False,
+            "dedupe_mode": "report",
+            "dedupe_workers": 1,
+            "jobstore_path": "",
+            "jobstore_work": False,
+            "debug_profiling": False,
+            "debug_lag_threshold_ms": 200,
             "queue_autostart_on_stop": False,
+            "queue_preempt": False,
+            "queue_pause_mode": "suspend",
             "queue_item_has_own_options": True,
             "queue_autostart_on_launch": False,
             "queue_save_error_items": False,
@@ -90,6 +154,9 @@ class Config(dict):
             "queue_paste_on_activate": False,
             "queue_retry": 2,
             "queue_retry_sleep": 5,
+            "sched_domain_max_concurrent": 2,
+            "sched_domain_starts_per_min": 6,
+            "sched_domain_burst": 2,
             "upd_check_on_start": False,
             "upd_only_extract_exe": True,
             "upd_ytdlp_channel": "stable",
@@ -103,9 +170,13 @@ class Config(dict):
             "force_keyframes": False,
             "rate_limit_value": "",
             "rate_limit_unit": "MB/s",
+            "rate_limit_global": True,
+            "rate_limit_hours": "",
             "output_template": "%(title)s [%(id)s].%(ext)s",
             "custom_args": "",
             "download_folder": str(Path.home() / "Downloads"),
+            "scratch_folder": "",
+            "scratch_orphan_hours": 24,
             "file_mod_write_time": True,
             "ffmpeg_path": "",
             "ytdlp_path": "",
@@ -192,6 +263,23 @@ def perform_finish_action(action: str):
     except Exception as e:
         Messagebox.show_error(f"Failed to perform '{action}': {e}", title="When finished")
 
+def global_rate_limit(cfg: Config):
+    """Aggregate rate limit in bytes/s and the optional (start, end) hours it applies to."""
+    if not cfg.get("rate_limit_global", True):
+        return 0, None
+    try:
+        value = float(cfg.get("rate_limit_value", "").strip() or 0)
+    except ValueError:
+        return 0, None
+    factor = {'KB/s': 1024, 'MB/s': 1024 * 1024}.get(cfg.get("rate_limit_unit", "MB/s"), 1)
+    hours = None
+    m = re.fullmatch(r"\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*", cfg.get("rate_limit_hours", ""))
+    if m:
+        h1, m1, h2, m2 = (int(g) for g in m.groups())
+        if h1 < 24 and h2 < 24 and m1 < 60 and m2 < 60:
+            hours = (dtime(h1, m1), dtime(h2, m2))
+    return int(value * factor), hours
+
 def build_sponsorblock_flags(cfg: Config):
     flags = []
     if cfg.get("sb_enable", False):
@@ -206,7 +294,8 @@ def build_yt_dlp_cmd(cfg: Config, url: str, preset_args: list = None):
     if cfg.get("ytdlp_path") and Path(cfg["ytdlp_path"]).exists():
         ytdlp_exe = cfg["ytdlp_path"]
     
-    cmd = [ytdlp_exe, url]
+    # Piped, yt-dlp would write in the Windows code page; the runner reads UTF-8
+    cmd = [ytdlp_exe, url, "--encoding", "utf-8"]
 
     if preset_args:
         cmd.extend(preset_args)
@@ -251,13 +340,18 @@ def build_yt_dlp_cmd(cfg: Config, url: str, preset_args: list = None):
         except ValueError:
             pass # No -o flag in preset, which is fine
     
-    cmd += ["-o", str(Path(outdir) / template)]
+    scratch = cfg.get("scratch_folder", "").strip()
+    if scratch and Path(scratch).is_dir():
+        # Partial files and merges stay in the scratch folder; yt-dlp moves finished files to outdir
+        cmd += paths_args(outdir, scratch) + ["-o", template]
+    else:
+        cmd += ["-o", str(Path(outdir) / template)]
 
     if is_windows():
         cmd.append("--windows-filenames")
 
     rate_value = cfg.get("rate_limit_value", "").strip()
-    if rate_value:
+    if rate_value and not cfg.get("rate_limit_global", True):
         rate_unit = cfg.get("rate_limit_unit", "MB/s")
         suffix = {'KB/s': 'K', 'MB/s': 'M'}.get(rate_unit, '')
         cmd += ["--limit-rate", f"{rate_value}{suffix}"]
@@ -301,9 +395,131 @@ def build_yt_dlp_cmd(cfg: Config, url: str, preset_args: list = None):
         
     return cmd
 
+def node_local_args(cfg: Config) -> list:
+    """This machine's folder, scratch, ffmpeg and cookies options, added to jobs it runs from the shared store."""
+    outdir = cfg.get("download_folder", str(Path.home() / "Downloads"))
+    scratch = cfg.get("scratch_folder", "").strip()
+    args = paths_args(outdir, scratch) if scratch and Path(scratch).is_dir() else ["-P", f"home:{outdir}"]
+    local = split_local(build_yt_dlp_cmd(cfg, "")[1:])[1]
+    return args + _strip_flags(local, {"-o": True, "--output": True, "-P": True, "--paths": True})
+
+# Post-processing options and whether they take a value. Merging stays with the
+# download: it is a stream copy and yt-dlp cannot defer it.
+POSTPROCESS_FLAGS = {
+    "--embed-thumbnail": False, "--embed-subs": False, "--embed-metadata": False, "--add-metadata": False,
+    "--embed-chapters": False, "--add-chapters": False, "--split-chapters": False, "--embed-info-json": False,
+    "--force-keyframes-at-cuts": False, "-x": False, "--extract-audio": False, "--xattrs": False,
+    "--audio-format": True, "--audio-quality": True, "--remux-video": True, "--recode-video": True,
+    "--sponsorblock-mark": True, "--sponsorblock-remove": True, "--convert-thumbnails": True, "--convert-subs": True,
+}
+# Options that only matter while fetching media, dropped from the processing run
+DOWNLOAD_ONLY_FLAGS = {
+    "--check-formats": False, "--sleep-requests": True, "--sleep-interval": True, "--max-sleep-interval": True,
+    "--limit-rate": True, "--throttled-rate": True, "--concurrent-fragments": True,
+}
+
+def _strip_flags(cmd: list, flags: dict):
+    out, i = [], 0
+    while i < len(cmd):
+        if cmd[i] in flags:
+            i += 2 if flags[cmd[i]] else 1
+            continue
+        out.append(cmd[i])
+        i += 1
+    return out
+
+def split_postprocessing(cmd: list, url: str, info_json: str):
+    """Split a download command into a download-only run and a processing run.
+
+    The processing run loads the saved info JSON, finds the media already on disk
+    and only runs the post-processors. It also takes over --download-archive so an
+    item is recorded only once fully processed. Returns None if there is nothing to split.
+    """
+    if not any(a in POSTPROCESS_FLAGS for a in cmd) or url not in cmd:
+        return None
+    download_cmd = _strip_flags(cmd, dict(POSTPROCESS_FLAGS, **{"--download-archive": True}))
+    # Without -x yt-dlp would default to video; keep the selection the full command makes
+    download_cmd = with_format(download_cmd, FormatPlan(cmd).spec)
+    process_cmd = _strip_flags(cmd, DOWNLOAD_ONLY_FLAGS)
+    i = process_cmd.index(url)
+    process_cmd[i:i + 1] = ["--load-info-json", info_json]
+    return download_cmd, process_cmd
+
+# Options that change what the extraction sees (session, IP, client); format URLs are tied to them
+NETWORK_FLAGS = {
+    "--cookies": True, "--cookies-from-browser": True, "--proxy": True, "--geo-verification-proxy": True,
+    "--source-address": True, "-4": False, "-6": False, "--force-ipv4": False, "--force-ipv6": False,
+    "--youtube-client": True, "--extractor-args": True, "--user-agent": True, "--add-header": True,
+    "--impersonate": True, "--username": True, "--password": True, "--netrc": False,
+}
+
+def network_args(cmd: list) -> list:
+    """The NETWORK_FLAGS options in cmd, with their values, in order."""
+    out, i = [], 0
+    while i < len(cmd):
+        if cmd[i] in NETWORK_FLAGS:
+            n = 2 if NETWORK_FLAGS[cmd[i]] else 1
+            out += cmd[i:i + n]
+            i += n
+            continue
+        i += 1
+    return out
+
+def with_info_json(cmd: list, url: str, info_json: str) -> list:
+    """Return cmd reading the item from a saved info JSON instead of extracting the URL again."""
+    if url not in cmd:
+        return cmd
+    out = list(cmd)
+    i = out.index(url)
+    out[i:i + 1] = ["--load-info-json", info_json]
+    return out
+
+def with_format(cmd: list, spec: str) -> list:
+    """Return cmd selecting `spec` instead of any -f/--format it had."""
+    out, i = [], 0
+    while i < len(cmd):
+        flag, value = split_option(cmd[i])
+        if flag in ("-f", "--format"):
+            i += 1 if value is not None else 2
+            continue
+        out.append(cmd[i])
+        i += 1
+    return out + ["-f", spec]
+
+# Hosts that serve a site under another registrable name
+_SITE_ALIASES = {"youtu.be": "youtube.com", "youtube-nocookie.com": "youtube.com"}
+
+def site_key(url: str) -> str:
+    """One scheduling key per site: the registrable host of url ("m.youtube.com" -> "youtube.com")."""
+    host = (urlparse(url).hostname or "").lower().rstrip(".")
+    parts = host.split(".")
+    if not host or host.replace(".", "").isdigit() or ":" in host:
+        return host
+    # Two-letter country domains with a short second level, like example.co.uk
+    n = 3 if len(parts) > 2 and len(parts[-1]) == 2 and len(parts[-2]) <= 3 else 2
+    key = ".".join(parts[-n:])
+    return _SITE_ALIASES.get(key, key)
+
+def format_filesize(size, exact: bool = True) -> str:
+    if not size:
+        return ""
+    prefix = "" if exact else "~"
+    if size > 1024*1024*1024:
+        return f"{prefix}{size / (1024*1024*1024):.2f} GB"
+    if size > 1024*1024:
+        return f"{prefix}{size / (1024*1024):.2f} MB"
+    return f"{prefix}{size / 1024:.2f} KB"
+
+def format_cpu_time(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
 class FFmpegUpdater:
-    def __init__(self, cfg: Config):
+    def __init__(self, cfg: Config, probe_cache: ProbeCache = None):
         self.cfg = cfg
+        self.probe_cache = probe_cache or ProbeCache(cfg.path.parent / "probes.json")
         self.progress_callback = None
         
     def set_progress_callback(self, callback):
@@ -313,24 +529,21 @@ class FFmpegUpdater:
         if self.progress_callback:
             self.progress_callback(message)
     
+    @staticmethod
+    def _parse_ffmpeg_version(output):
+        first_line = output.split('\n')[0]
+        if 'version' in first_line:
+            parts = first_line.split()
+            for i, part in enumerate(parts):
+                if part == 'version' and i + 1 < len(parts):
+                    return parts[i + 1].strip('-gpl').strip('-git')
+        return first_line
+
     def get_ffmpeg_version(self, ffmpeg_path=None):
         exe_path = "ffmpeg"
         if ffmpeg_path:
             exe_path = str(Path(ffmpeg_path) / "ffmpeg")
-        
-        try:
-            proc = subprocess.run([exe_path, "-version"], capture_output=True, text=True, timeout=10, creationflags=subprocess.CREATE_NO_WINDOW if is_windows() else 0)
-            if proc.returncode == 0:
-                first_line = proc.stdout.split('\n')[0]
-                if 'version' in first_line:
-                    parts = first_line.split()
-                    for i, part in enumerate(parts):
-                        if part == 'version' and i + 1 < len(parts):
-                            return parts[i + 1].strip('-gpl').strip('-git')
-                return first_line
-        except Exception:
-            pass
-        return None
+        return self.probe_cache.version(exe_path, "-version", self._parse_ffmpeg_version)
     
     def get_latest_ffmpeg_version(self):
         if not requests:
@@ -485,14 +698,15 @@ class FFmpegUpdater:
             return True
 
 class SettingsWindow(tb.Toplevel):
-    def __init__(self, master, cfg: Config, theme_apply_cb=None):
+    def __init__(self, master, cfg: Config, theme_apply_cb=None, probe_cache: ProbeCache = None):
         super().__init__(master)
         self.title(f"{APP_NAME} Settings")
         self.geometry("800x600")
         self.minsize(750, 550)
         self.cfg = cfg
         self.theme_apply_cb = theme_apply_cb
-        self.ffmpeg_updater = FFmpegUpdater(cfg)
+        self.probe_cache = probe_cache or ProbeCache(cfg.path.parent / "probes.json")
+        self.ffmpeg_updater = FFmpegUpdater(cfg, self.probe_cache)
         self.master_window = master
         self.bind("<Escape>", lambda e: self.destroy())
         
@@ -534,10 +748,10 @@ class SettingsWindow(tb.Toplevel):
         var_res = StringVar(value=self.cfg.get("preferred_resolution", "none"))
         dd_res = tb.Combobox(frame, textvariable=var_res, values=res_opts, state="readonly", width=10)
         dd_res.grid(row=0, column=1, sticky="w", padx=8, pady=6)
-        dd_res.bind("<<ComboboxSelected>>", lambda e: self._save("preferred_resolution", var_res.get()))
+        dd_res.bind("<<ComboboxSelected>>", lambda e: self._save_format_pref("preferred_resolution", var_res.get()))
 
         v_fps = BooleanVar(value=self.cfg.get("prefer_higher_framerate", False))
-        tb.Checkbutton(frame, text="Prefer a higher framerate", variable=v_fps, command=lambda: self._save("prefer_higher_framerate", v_fps.get())) \
+        tb.Checkbutton(frame, text="Prefer a higher framerate", variable=v_fps, command=lambda: self._save_format_pref("prefer_higher_framerate", v_fps.get())) \
             .grid(row=0, column=2, columnspan=2, sticky="w", padx=8, pady=6)
 
         tb.Label(frame, text="Preferred video container:").grid(row=1, column=0, sticky="w", padx=8, pady=6)
@@ -545,28 +759,28 @@ class SettingsWindow(tb.Toplevel):
         var_v_cont = StringVar(value=self.cfg.get("preferred_video_container", "none"))
         dd_v_cont = tb.Combobox(frame, textvariable=var_v_cont, values=container_opts, state="readonly", width=10)
         dd_v_cont.grid(row=1, column=1, sticky="w", padx=8, pady=6)
-        dd_v_cont.bind("<<ComboboxSelected>>", lambda e: self._save("preferred_video_container", var_v_cont.get()))
+        dd_v_cont.bind("<<ComboboxSelected>>", lambda e: self._save_format_pref("preferred_video_container", var_v_cont.get()))
 
         tb.Label(frame, text="Preferred audio container:").grid(row=1, column=2, sticky="e", padx=8, pady=6)
         audio_container_opts = ["none", "m4a", "webm", "mp3", "opus", "flac", "wav"]
         var_a_cont = StringVar(value=self.cfg.get("preferred_audio_container", "none"))
         dd_a_cont = tb.Combobox(frame, textvariable=var_a_cont, values=audio_container_opts, state="readonly", width=10)
         dd_a_cont.grid(row=1, column=3, sticky="w", padx=8, pady=6)
-        dd_a_cont.bind("<<ComboboxSelected>>", lambda e: self._save("preferred_audio_container", var_a_cont.get()))
+        dd_a_cont.bind("<<ComboboxSelected>>", lambda e: self._save_format_pref("preferred_audio_container", var_a_cont.get()))
         
         tb.Label(frame, text="Preferred video codec:").grid(row=2, column=0, sticky="w", padx=8, pady=6)
         vcodec_opts = ["none", "av01", "vp9", "h264"]
         var_v_codec = StringVar(value=self.cfg.get("preferred_video_codec", "none"))
         dd_v_codec = tb.Combobox(frame, textvariable=var_v_codec, values=vcodec_opts, state="readonly", width=10)
         dd_v_codec.grid(row=2, column=1, sticky="w", padx=8, pady=6)
-        dd_v_codec.bind("<<ComboboxSelected>>", lambda e: self._save("preferred_video_codec", var_v_codec.get()))
+        dd_v_codec.bind("<<ComboboxSelected>>", lambda e: self._save_format_pref("preferred_video_codec", var_v_codec.get()))
 
         tb.Label(frame, text="Preferred audio codec:").grid(row=2, column=2, sticky="e", padx=8, pady=6)
         acodec_opts = ["none", "opus", "aac", "vorbis"]
         var_a_codec = StringVar(value=self.cfg.get("preferred_audio_codec", "none"))
         dd_a_codec = tb.Combobox(frame, textvariable=var_a_codec, values=acodec_opts, state="readonly", width=10)
         dd_a_codec.grid(row=2, column=3, sticky="w", padx=8, pady=6)
-        dd_a_codec.bind("<<ComboboxSelected>>", lambda e: self._save("preferred_audio_codec", var_a_codec.get()))
+        dd_a_codec.bind("<<ComboboxSelected>>", lambda e: self._save_format_pref("preferred_audio_codec", var_a_codec.get()))
         
         v_android = BooleanVar(value=self.cfg.get("youtube_android_client", False))
         tb.Checkbutton(frame, text="[YouTube] Use the Android player client for video extraction", variable=v_android, command=lambda: self._save("youtube_android_client", v_android.get())) \
@@ -617,6 +831,20 @@ class SettingsWindow(tb.Toplevel):
         ent_ffmpeg.bind("<Button-1>", lambda e: self._select_folder(var_ffmpeg, "ffmpeg_path", "Select FFmpeg Folder"))
         row += 1
 
+        tb.Label(frame, text="Scratch folder:").grid(row=row, column=0, sticky="w", padx=8, pady=6)
+        var_scratch = StringVar(value=self.cfg.get("scratch_folder", ""))
+        ent_scratch = tb.Entry(frame, textvariable=var_scratch, state="readonly")
+        ent_scratch.grid(row=row, column=1, columnspan=2, sticky="ew", padx=8, pady=6)
+        ent_scratch.bind("<Button-1>", lambda e: self._select_folder(var_scratch, "scratch_folder", "Select a fast folder for partial files and merging"))
+        def _clear_scratch():
+            var_scratch.set("")
+            self._save("scratch_folder", "")
+        tb.Button(frame, text="Don't use", command=_clear_scratch, bootstyle="secondary").grid(row=row, column=3, padx=8)
+        row += 1
+        tb.Label(frame, text="Partial files, fragments and merges are written to the scratch folder (e.g. a local SSD); only finished files are moved to the download folder.",
+                 wraplength=600).grid(row=row, column=0, columnspan=4, sticky="w", padx=8)
+        row += 1
+
         tb.Separator(frame).grid(row=row, column=0, columnspan=4, sticky="ew", padx=8, pady=10)
         row += 1
 
@@ -645,7 +873,7 @@ class SettingsWindow(tb.Toplevel):
         row += 1
 
         v_keep = BooleanVar(value=self.cfg.get("keep_video", True))
-        tb.Checkbutton(frame, text="Keep video (if remuxing)", variable=v_keep, command=lambda: self._save("keep_video", v_keep.get())).grid(row=row, column=0, sticky="w", padx=8)
+        tb.Checkbutton(frame, text="Keep video (if remuxing)", variable=v_keep, command=lambda: self._save_format_pref("keep_video", v_keep.get())).grid(row=row, column=0, sticky="w", padx=8)
         row += 1
 
     def _select_folder(self, var, key, title):
@@ -758,7 +986,12 @@ class SettingsWindow(tb.Toplevel):
         sb_con.bind("<FocusOut>", lambda e: self._save("queue_max_concurrent", var_con.get()))
         
         v_start_len = BooleanVar(value=self.cfg.get("queue_start_on_lengthy", True))
-        tb.Checkbutton(f_max_dl, text="Start next item on lengthy processing", variable=v_start_len, command=lambda: self._save("queue_start_on_lengthy", v_start_len.get())).pack(side=LEFT, padx=10)
+        tb.Checkbutton(f_max_dl, text="Start next item on lengthy processing, up to", variable=v_start_len, command=lambda: self._save("queue_start_on_lengthy", v_start_len.get())).pack(side=LEFT, padx=(10, 0))
+        var_pp = IntVar(value=self.cfg.get("queue_max_postprocessing", 2))
+        sb_pp = tb.Spinbox(f_max_dl, from_=1, to=32, textvariable=var_pp, width=4, command=lambda: self._save("queue_max_postprocessing", var_pp.get()))
+        sb_pp.pack(side=LEFT, padx=6)
+        sb_pp.bind("<FocusOut>", lambda e: self._save("queue_max_postprocessing", var_pp.get()))
+        tb.Label(f_max_dl, text="processing at once").pack(side=LEFT)
         row += 1
 
         f_max_data = tb.Frame(frame)
@@ -770,6 +1003,70 @@ class SettingsWindow(tb.Toplevel):
         sb_data.bind("<FocusOut>", lambda e: self._save("queue_max_data_instances", var_data.get()))
         row += 1
 
+        v_preempt = BooleanVar(value=self.cfg.get("queue_preempt", False))
+        tb.Checkbutton(frame, text="Urgent items pause the lowest-priority running download when all slots are busy", variable=v_preempt, command=lambda: self._save("queue_preempt", v_preempt.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        row += 1
+
+        f_pause = tb.Frame(frame)
+        f_pause.grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        tb.Label(f_pause, text="Pausing a running item:").pack(side=LEFT, anchor="w")
+        var_pause = StringVar(value=self.cfg.get("queue_pause_mode", "suspend"))
+        tb.Radiobutton(f_pause, text="Suspend the process", value="suspend", variable=var_pause, command=lambda: self._save("queue_pause_mode", var_pause.get())).pack(side=LEFT, padx=6)
+        tb.Radiobutton(f_pause, text="Stop it and resume from the partial file", value="stop", variable=var_pause, command=lambda: self._save("queue_pause_mode", var_pause.get())).pack(side=LEFT, padx=6)
+        row += 1
+
+        f_split = tb.Frame(frame)
+        f_split.grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        v_split = BooleanVar(value=self.cfg.get("pipeline_split", False))
+        tb.Checkbutton(f_split, text="Run post-processing (embedding, conversion, splitting) in a separate pool of", variable=v_split, command=lambda: self._save("pipeline_split", v_split.get())).pack(side=LEFT)
+        var_cpu = IntVar(value=self.cfg.get("pipeline_cpu_workers", 0))
+        sb_cpu = tb.Spinbox(f_split, from_=0, to=64, textvariable=var_cpu, width=4, command=lambda: self._save("pipeline_cpu_workers", var_cpu.get()))
+        sb_cpu.pack(side=LEFT, padx=6)
+        sb_cpu.bind("<FocusOut>", lambda e: self._save("pipeline_cpu_workers", var_cpu.get()))
+        tb.Label(f_split, text="jobs (0 = one per CPU core)").pack(side=LEFT)
+        row += 1
+
+        f_disk = tb.Frame(frame)
+        f_disk.grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        v_disk = BooleanVar(value=self.cfg.get("disk_admission", True))
+        tb.Checkbutton(f_disk, text="Only start a download when its estimated size fits on the disk, keeping", variable=v_disk, command=lambda: self._save("disk_admission", v_disk.get())).pack(side=LEFT)
+        var_reserve = IntVar(value=self.cfg.get("disk_reserve_mb", 1024))
+        sb_reserve = tb.Spinbox(f_disk, from_=0, to=1024 * 1024, increment=256, textvariable=var_reserve, width=7, command=lambda: self._save("disk_reserve_mb", var_reserve.get()))
+        sb_reserve.pack(side=LEFT, padx=6)
+        sb_reserve.bind("<FocusOut>", lambda e: self._save("disk_reserve_mb", var_reserve.get()))
+        tb.Label(f_disk, text="MB free").pack(side=LEFT)
+        row += 1
+
+        f_res = tb.Frame(frame)
+        f_res.grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        v_res = BooleanVar(value=self.cfg.get("resource_accounting", True))
+        cb_res = tb.Checkbutton(f_res, text="Measure CPU, memory and disk use of each download; stop one above", variable=v_res, command=lambda: self._save("resource_accounting", v_res.get()))
+        cb_res.pack(side=LEFT)
+        var_ram = IntVar(value=self.cfg.get("resource_max_ram_mb", 0))
+        sb_ram = tb.Spinbox(f_res, from_=0, to=1024 * 1024, increment=256, textvariable=var_ram, width=7, command=lambda: self._save("resource_max_ram_mb", var_ram.get()))
+        sb_ram.pack(side=LEFT, padx=6)
+        sb_ram.bind("<FocusOut>", lambda e: self._save("resource_max_ram_mb", var_ram.get()))
+        tb.Label(f_res, text="MB, hold one to").pack(side=LEFT)
+        var_cores = DoubleVar(value=self.cfg.get("resource_max_cpu_cores", 0))
+        sb_cores = tb.Spinbox(f_res, from_=0, to=256, increment=0.5, textvariable=var_cores, width=5, command=lambda: self._save("resource_max_cpu_cores", var_cores.get()))
+        sb_cores.pack(side=LEFT, padx=6)
+        sb_cores.bind("<FocusOut>", lambda e: self._save("resource_max_cpu_cores", var_cores.get()))
+        tb.Label(f_res, text="cores (0 = no limit)").pack(side=LEFT)
+        if not procstats.AVAILABLE:
+            for w in (cb_res, sb_ram, sb_cores):
+                w.configure(state=DISABLED)
+        row += 1
+
+        f_frag = tb.Frame(frame)
+        f_frag.grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        v_frag = BooleanVar(value=self.cfg.get("adaptive_fragments", False))
+        tb.Checkbutton(f_frag, text="Tune concurrent fragments per website from measured speed, up to", variable=v_frag, command=lambda: self._save("adaptive_fragments", v_frag.get())).pack(side=LEFT)
+        var_frag = IntVar(value=self.cfg.get("adaptive_fragments_max", 16))
+        sb_frag = tb.Spinbox(f_frag, from_=1, to=64, textvariable=var_frag, width=4, command=lambda: self._save("adaptive_fragments_max", var_frag.get()))
+        sb_frag.pack(side=LEFT, padx=6)
+        sb_frag.bind("<FocusOut>", lambda e: self._save("adaptive_fragments_max", var_frag.get()))
+        row += 1
+
         v_autostart_stop = BooleanVar(value=self.cfg.get("queue_autostart_on_stop", False))
         tb.Checkbutton(frame, text="When stopping a queue item, automatically start the next one", variable=v_autostart_stop, command=lambda: self._save("queue_autostart_on_stop", v_autostart_stop.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
         row += 1
@@ -790,6 +1087,55 @@ class SettingsWindow(tb.Toplevel):
         tb.Checkbutton(frame, text='Automatically remove completed items (with "done" status)', variable=v_remove_done, command=lambda: self._save("queue_remove_done_items", v_remove_done.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
         row += 1
 
+        v_metrics = BooleanVar(value=self.cfg.get("queue_metrics_export", True))
+        tb.Checkbutton(frame, text="Keep timing and speed metrics of finished items (metrics.json / metrics.prom in the settings folder)", variable=v_metrics, command=lambda: self._save("queue_metrics_export", v_metrics.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        row += 1
+
+        f_logs = tb.Frame(frame)
+        f_logs.grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        v_logs = BooleanVar(value=self.cfg.get("task_logs", True))
+        tb.Checkbutton(f_logs, text="Save the output of each item to its own log file, kept for", variable=v_logs, command=lambda: self._save("task_logs", v_logs.get())).pack(side=LEFT)
+        var_log_days = IntVar(value=self.cfg.get("task_logs_keep_days", 30))
+        sb_log_days = tb.Spinbox(f_logs, from_=0, to=3650, textvariable=var_log_days, width=5, command=lambda: self._save("task_logs_keep_days", var_log_days.get()))
+        sb_log_days.pack(side=LEFT, padx=6)
+        sb_log_days.bind("<FocusOut>", lambda e: self._save("task_logs_keep_days", var_log_days.get()))
+        tb.Label(f_logs, text="days (0 = forever)").pack(side=LEFT)
+        row += 1
+
+        v_reuse = BooleanVar(value=self.cfg.get("queue_reuse_info_json", True))
+        tb.Checkbutton(frame, text=f"Download from the data fetched for the queue if it is less than {INFO_JSON_MAX_AGE // 3600} hours old (no second extraction)", variable=v_reuse, command=lambda: self._save("queue_reuse_info_json", v_reuse.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        row += 1
+
+        v_library = BooleanVar(value=self.cfg.get("library_index", True))
+        tb.Checkbutton(frame, text="Record downloaded files in the library index (Ctrl+L to search)", variable=v_library, command=lambda: self._save("library_index", v_library.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        row += 1
+
+        v_lib_skip = BooleanVar(value=self.cfg.get("library_skip_existing", False))
+        tb.Checkbutton(frame, text="Do not download items whose video is already in the library", variable=v_lib_skip, command=lambda: self._save("library_skip_existing", v_lib_skip.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        row += 1
+
+        f_dedupe = tb.Frame(frame)
+        f_dedupe.grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        tb.Label(f_dedupe, text="Duplicate downloads (see dedupe.log):").pack(side=LEFT, anchor="w")
+        var_dedupe = StringVar(value=self.cfg.get("dedupe_mode", "report"))
+        for value, text in (("off", "Ignore"), ("report", "Report"), ("hardlink", "Replace with hardlinks"), ("reflink", "Replace with reflinks")):
+            tb.Radiobutton(f_dedupe, text=text, value=value, variable=var_dedupe, command=lambda: self._save("dedupe_mode", var_dedupe.get())).pack(side=LEFT, padx=6)
+        row += 1
+
+        f_jobs = tb.Frame(frame)
+        f_jobs.grid(row=row, column=0, columnspan=2, sticky="ew", padx=8, pady=4)
+        tb.Label(f_jobs, text="Shared job store file:").pack(side=LEFT, anchor="w")
+        var_jobs = StringVar(value=self.cfg.get("jobstore_path", ""))
+        ent_jobs = tb.Entry(f_jobs, textvariable=var_jobs)
+        ent_jobs.pack(side=LEFT, fill=X, expand=True, padx=6)
+        ent_jobs.bind("<FocusOut>", lambda e: self._save("jobstore_path", var_jobs.get().strip()))
+        v_jobs_work = BooleanVar(value=self.cfg.get("jobstore_work", False))
+        tb.Checkbutton(f_jobs, text="Download jobs from it too", variable=v_jobs_work, command=lambda: self._save("jobstore_work", v_jobs_work.get())).pack(side=LEFT)
+        row += 1
+        tb.Label(frame, text="Several instances (or headless nodes: python jobstore.py FILE work) can share one job store on a shared volume. Applies after a restart.",
+                 wraplength=600).grid(row=row, column=0, columnspan=2, sticky="w", padx=8)
+        row += 1
+
         v_paste_activate = BooleanVar(value=self.cfg.get("queue_paste_on_activate", False))
         tb.Checkbutton(frame, text="When the main window is activated, automatically add the URL from clipboard", variable=v_paste_activate, command=lambda: self._save("queue_paste_on_activate", v_paste_activate.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
         row += 1
@@ -809,6 +1155,28 @@ class SettingsWindow(tb.Toplevel):
         ent_slp = tb.Entry(frame, textvariable=var_slp, width=10)
         ent_slp.grid(row=row+1, column=1, sticky="w", padx=8, pady=8)
         ent_slp.bind("<FocusOut>", lambda e: self._save("queue_retry_sleep", max(0, int(var_slp.get() or "0"))))
+        row += 2
+
+        tb.Separator(frame).grid(row=row, column=0, columnspan=2, sticky="ew", padx=8, pady=10)
+        row += 1
+
+        f_domain = tb.Frame(frame)
+        f_domain.grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=8)
+        tb.Label(f_domain, text="Per website (0 = unlimited):  max concurrent").pack(side=LEFT, anchor="w")
+        var_dom_con = IntVar(value=self.cfg.get("sched_domain_max_concurrent", 2))
+        sb_dom_con = tb.Spinbox(f_domain, from_=0, to=10, textvariable=var_dom_con, width=4, command=lambda: self._save("sched_domain_max_concurrent", var_dom_con.get()))
+        sb_dom_con.pack(side=LEFT, padx=6)
+        sb_dom_con.bind("<FocusOut>", lambda e: self._save("sched_domain_max_concurrent", var_dom_con.get()))
+        tb.Label(f_domain, text="starts per minute").pack(side=LEFT, anchor="w")
+        var_dom_rate = IntVar(value=self.cfg.get("sched_domain_starts_per_min", 6))
+        sb_dom_rate = tb.Spinbox(f_domain, from_=0, to=600, textvariable=var_dom_rate, width=4, command=lambda: self._save("sched_domain_starts_per_min", var_dom_rate.get()))
+        sb_dom_rate.pack(side=LEFT, padx=6)
+        sb_dom_rate.bind("<FocusOut>", lambda e: self._save("sched_domain_starts_per_min", var_dom_rate.get()))
+        tb.Label(f_domain, text="burst").pack(side=LEFT, anchor="w")
+        var_dom_burst = IntVar(value=self.cfg.get("sched_domain_burst", 2))
+        sb_dom_burst = tb.Spinbox(f_domain, from_=1, to=50, textvariable=var_dom_burst, width=4, command=lambda: self._save("sched_domain_burst", var_dom_burst.get()))
+        sb_dom_burst.pack(side=LEFT, padx=6)
+        sb_dom_burst.bind("<FocusOut>", lambda e: self._save("sched_domain_burst", var_dom_burst.get()))
 
     def _build_interface(self, frame):
         frame.columnconfigure(1, weight=1)
@@ -846,6 +1214,10 @@ class SettingsWindow(tb.Toplevel):
         tb.Checkbutton(frame, text="Formats window: display file sizes with exact byte value", variable=v_exact_fs, command=lambda: self._save("ui_exact_filesize", v_exact_fs.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
         row += 1
 
+        v_profile = BooleanVar(value=self.cfg.get("debug_profiling", False))
+        tb.Checkbutton(frame, text='Profile the interface and log main-loop stalls to the "profile" settings folder (after restart)', variable=v_profile, command=lambda: self._save("debug_profiling", v_profile.get())).grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=4)
+        row += 1
+
         browse_frame = tb.Frame(frame)
         browse_frame.grid(row=row, column=0, columnspan=2, sticky="w", padx=8, pady=8)
         tb.Label(browse_frame, text="When browsing for the output folder, start in:").pack(side=LEFT, anchor="w")
@@ -931,6 +1303,7 @@ class SettingsWindow(tb.Toplevel):
         try:
             current = self._get_yt_dlp_version()
             current_str = f"current = {current}" if current else "current = not present"
+            self.ytdlp_version_var.set(f"Latest yt-dlp version: checking... ({current_str})")
             
             resp = requests.get("https://api.github.com/repos/yt-dlp/yt-dlp/releases/latest", timeout=10)
             if resp.status_code == 200:
@@ -945,8 +1318,9 @@ class SettingsWindow(tb.Toplevel):
         if not requests: return
         self.ffmpeg_version_var.set("Latest ffmpeg version: checking...")
         try:
-            current = self.ffmpeg_updater.get_ffmpeg_version()
+            current = self.ffmpeg_updater.get_ffmpeg_version(self.cfg.get("ffmpeg_path", "").strip() or None)
             current_str = f"current = {current}" if current else "current = not present"
+            self.ffmpeg_version_var.set(f"Latest ffmpeg version: checking... ({current_str})")
 
             latest = self.ffmpeg_updater.get_latest_ffmpeg_version()
             if latest:
@@ -1029,6 +1403,10 @@ class SettingsWindow(tb.Toplevel):
         self.cfg[key] = value
         self.cfg.save()
 
+    def _save_format_pref(self, key, value):
+        self._save(key, value)
+        self.master_window.refresh_format_choices()
+
     def _toggle_in_list(self, key, item, enabled: bool):
         lst = list(self.cfg.get(key, []))
         if enabled and item not in lst:
@@ -1044,14 +1422,8 @@ class SettingsWindow(tb.Toplevel):
             pass
 
     def _get_yt_dlp_version(self):
-        try:
-            ytdlp_exe = self.cfg.get("ytdlp_path") or "yt-dlp"
-            proc = subprocess.run([ytdlp_exe, "--version"], capture_output=True, text=True, timeout=5, creationflags=subprocess.CREATE_NO_WINDOW if is_windows() else 0)
-            if proc.returncode == 0:
-                return proc.stdout.strip()
-        except Exception:
-            pass
-        return None
+        ytdlp_exe = self.cfg.get("ytdlp_path") or "yt-dlp"
+        return self.probe_cache.version(ytdlp_exe, "--version", lambda out: out.strip(), timeout=5)
 
     def _update_yt_dlp(self):
         try:
@@ -1061,6 +1433,7 @@ class SettingsWindow(tb.Toplevel):
                 cmd.append("--nightly")
             
             proc = subprocess.run(cmd, capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW if is_windows() else 0)
+            self.probe_cache.invalidate(ytdlp_exe)
             if proc.returncode == 0:
                 Messagebox.show_info(proc.stdout or "yt-dlp updated successfully.", title="Update yt-dlp", parent=self)
             else:
@@ -1122,6 +1495,10 @@ class App(tb.Window):
         self.cfg = cfg
         super().__init__(themename=get_theme_name(self.cfg.get("ui_theme", "system")))
         
+        self.profiler = None
+        if profiling_requested(self.cfg):
+            self._setup_profiling()
+
         self._auto_detect_dependencies()
         
         self.title(APP_NAME)
@@ -1137,7 +1514,44 @@ class App(tb.Window):
         self.last_clipboard_content = ""
         self.view_mode = 'queue'
         
-        self.runner = Runner(on_log=self._on_runner_log, on_task=self._on_runner_task)
+        self.runner = Runner(on_log=self._on_runner_log, on_task=self._on_runner_task, scheduler=DomainScheduler(), governor=BandwidthGovernor())
+        self.fragment_tuner = FragmentTuner()
+        self.metrics = MetricsRecorder(self.cfg.path.parent)
+        self.task_logs = TaskLogStore(self.cfg.path.parent / "logs")
+        self.disk_budget = DiskBudget()
+        self.resource_monitor = ResourceMonitor()
+        self.library = None
+        if self.cfg.get("library_index", True):
+            try:
+                self.library = MediaLibrary(self.cfg.path.parent / "library.sqlite3")
+            except sqlite3.Error as e:
+                print(f"Could not open the library index: {e}")
+        self.deduper = None
+        if self.library:
+            self.deduper = Deduper(self.library, self.cfg.path.parent / "dedupe.log",
+                                   workers=int(self.cfg.get("dedupe_workers", 1)))
+        self._apply_runner_settings()
+        self.job_store = None
+        self.node_worker = None
+        if self.cfg.get("jobstore_path", "").strip():
+            try:
+                self.job_store = JobStore(Path(self.cfg["jobstore_path"].strip()))
+            except sqlite3.Error as e:
+                print(f"Could not open the shared job store: {e}")
+        if self.job_store and self.cfg.get("jobstore_work", False):
+            self.node_worker = NodeWorker(self.job_store, self.runner, ytdlp=self.cfg.get("ytdlp_path") or "yt-dlp",
+                                          archive=ArchiveMirror(self.job_store, self.cfg.path.parent / "shared-archive.txt"),
+                                          max_retries=int(self.cfg.get("queue_retry", 2)),
+                                          retry_sleep=float(self.cfg.get("queue_retry_sleep", 5)),
+                                          local_args=node_local_args(self.cfg))
+            self.node_worker.start()
+            atexit.register(self.node_worker.stop)
+        self.probe_cache = ProbeCache(self.cfg.path.parent / "probes.json")
+        self.info_cache = InfoJsonCache(self.cfg.path.parent / "info")
+        threading.Thread(target=self.info_cache.prune, args=(INFO_JSON_MAX_AGE,), daemon=True).start()
+        threading.Thread(target=self.task_logs.prune, daemon=True).start()
+        if self.cfg.get("scratch_folder", "").strip():
+            threading.Thread(target=self._cleanup_scratch, daemon=True).start()
 
         self.style.configure("Custom.Treeview.Heading", borderwidth=1, relief="solid", padding=(4, 8))
         self.tree_style_name = "Custom.Treeview"
@@ -1147,13 +1561,14 @@ class App(tb.Window):
         self.main_view_frame = tb.Frame(self)
         self.main_view_frame.pack(side=TOP, fill=BOTH, expand=True, padx=8, pady=(8, 4))
 
-        columns = ["#", "|", "Website", "Media title", "Status", "Format", "Format note", "Ext", "Filesize"]
+        columns = ["#", "|", "Website", "Media title", "Status", "Format", "Format note", "Ext", "Filesize", "CPU time", "Peak RAM", "Disk traffic"]
         self.tree = tb.Treeview(self.main_view_frame, columns=columns, show="headings", height=14, style=self.tree_style_name)
         
         self.tree.tag_configure('oddrow', background=self.style.colors.get('bg'))
         self.tree.tag_configure('evenrow', background=self.style.colors.get('light'))
 
-        self.column_widths = {"#": 40, "|": 30, "Website": 120, "Status": 160, "Format": 120, "Format note": 140, "Ext": 70, "Filesize": 90}
+        self.column_widths = {"#": 40, "|": 30, "Website": 120, "Status": 160, "Format": 120, "Format note": 140, "Ext": 70, "Filesize": 90,
+                              "CPU time": 80, "Peak RAM": 90, "Disk traffic": 130}
         
         for col, w in self.column_widths.items():
             self.tree.column(col, width=w, stretch=False, anchor="w")
@@ -1163,6 +1578,7 @@ class App(tb.Window):
         self.tree.column("|", anchor="center")
 
         self._apply_column_visibility()
+        self.after(2000, self._refresh_usage)
 
         placeholder_color = self.style.colors.get("primary")
         placeholder_text = "output from yt-dlp.exe appears here\n\nright-click for options\n\ndouble-click to show queue"
@@ -1172,6 +1588,13 @@ class App(tb.Window):
         self.output_console = ScrolledText(self.main_view_frame, autohide=True, wrap="word")
         self.output_console.text.config(state=DISABLED)
         self.output_console.text.bind("<Double-Button-1>", self._switch_view)
+        colors = self.style.colors
+        for tag, color in (("error", colors.danger), ("warning", colors.warning), ("download", colors.info),
+                           ("postprocess", colors.primary), ("runner", colors.secondary), ("percent", colors.success)):
+            self.output_console.text.tag_configure(f"hl_{tag}", foreground=color)
+        self._console_lock = threading.Lock()
+        self._console_pending = []
+        self._console_flush_scheduled = False
 
         self.tree.pack(fill=BOTH, expand=True)
 
@@ -1245,11 +1668,21 @@ class App(tb.Window):
         ent_rate.pack(side=LEFT)
         dd_unit = tb.Combobox(rate_frame, values=["KB/s", "MB/s"], textvariable=self.rateunit, width=5, state="readonly")
         dd_unit.pack(side=LEFT, padx=4)
+        self.v_rate_global = BooleanVar(value=self.cfg.get("rate_limit_global", True))
+        tb.Checkbutton(rate_frame, text="shared by all downloads, between", variable=self.v_rate_global).pack(side=LEFT, padx=4)
+        self.ratehours = StringVar(value=self.cfg.get("rate_limit_hours", ""))
+        ent_hours = tb.Entry(rate_frame, textvariable=self.ratehours, width=12)
+        ent_hours.pack(side=LEFT)
         def _update_rate(*_):
             self._save("rate_limit_value", self.rateval.get())
             self._save("rate_limit_unit", self.rateunit.get())
+            self._save("rate_limit_global", self.v_rate_global.get())
+            self._save("rate_limit_hours", self.ratehours.get().strip())
+            self._apply_runner_settings()
         ent_rate.bind("<FocusOut>", _update_rate)
         dd_unit.bind("<<ComboboxSelected>>", _update_rate)
+        ent_hours.bind("<FocusOut>", _update_rate)
+        self.v_rate_global.trace_add("write", _update_rate)
 
         self.v_mod = BooleanVar(value=self.cfg.get("file_mod_write_time"))
         tb.Checkbutton(tab_basic, text="File modification time = time of writing", variable=self.v_mod, command=lambda: self._save("file_mod_write_time", self.v_mod.get())).grid(row=1, column=2, columnspan=2, sticky="w", padx=4)
@@ -1277,14 +1710,14 @@ class App(tb.Window):
         tb.Checkbutton(tab_basic, text="Embed thumbnail", variable=self.v_thumb, command=lambda: self._save("embed_thumbnail", self.v_thumb.get())).grid(row=2, column=3, sticky="w", padx=4)
 
         self.v_mp3 = BooleanVar(value=self.cfg.get("convert_to_mp3"))
-        tb.Checkbutton(tab_basic, text="Convert audio to MP3", variable=self.v_mp3, command=lambda: self._save("convert_to_mp3", self.v_mp3.get())).grid(row=2, column=4, sticky="w", padx=4)
+        tb.Checkbutton(tab_basic, text="Convert audio to MP3", variable=self.v_mp3, command=lambda: self._save_format_pref("convert_to_mp3", self.v_mp3.get())).grid(row=2, column=4, sticky="w", padx=4)
 
         self.v_custom = BooleanVar(value=bool(self.cfg.get("custom_args")))
         tb.Checkbutton(tab_basic, text="Custom arguments:", variable=self.v_custom).grid(row=3, column=0, sticky="w", padx=(8,0), pady=4)
         self.var_args = StringVar(value=self.cfg.get("custom_args"))
         ent_args = tb.Entry(tab_basic, textvariable=self.var_args)
         ent_args.grid(row=3, column=1, columnspan=5, sticky="ew", padx=8, pady=4)
-        ent_args.bind("<FocusOut>", lambda e: self._save("custom_args", self.var_args.get()))
+        ent_args.bind("<FocusOut>", lambda e: self._save_format_pref("custom_args", self.var_args.get()))
 
         for i in range(6): tab_basic.columnconfigure(i, weight=1)
         tab_basic.columnconfigure(0, weight=2)
@@ -1336,6 +1769,9 @@ class App(tb.Window):
         self.actions_frame.pack(side=BOTTOM, fill=X, padx=8, pady=8)
         self.btn_toggle_view = tb.Button(self.actions_frame, text="Show output", command=self._switch_view)
         self.btn_toggle_view.pack(side=RIGHT, padx=6)
+        self.lbl_totals = tb.Label(self.actions_frame, text="")
+        self.lbl_totals.pack(side=LEFT, padx=6)
+        self._totals_pending = False
 
         self.bind("<Control-v>", self._paste_and_add)
         self.bind("<Control-V>", self._paste_and_add)
@@ -1343,22 +1779,37 @@ class App(tb.Window):
         self.bind("<Control-s>", lambda e: self._open_settings())
         self.bind("<Control-S>", lambda e: self._open_settings())
         self.bind("<Delete>", self._delete_selected_items)
-        self.bind("<Control-f>", self._show_formats_placeholder)
-        self.bind("<Control-F>", self._show_formats_placeholder)
+        self.bind("<Control-f>", self._show_formats)
+        self.bind("<Control-F>", self._show_formats)
         self.bind("<F2>", self._edit_queue_item_placeholder)
         self.bind("<Control-Tab>", self._switch_view)
+        self.bind("<Control-l>", self._open_library_search)
+        self.bind("<Control-L>", self._open_library_search)
         self.bind("<Control-Key-0>", self._reset_window_geometry)
         self.bind("<Control-KP_0>", self._reset_window_geometry)
         self.bind("<Configure>", self._on_resize)
         self.tree.bind("<Button-1>", self._prevent_column_resize)
         self.tree.bind("<Motion>", self._prevent_resize_cursor)
         self.tree.bind("<<TreeviewSelect>>", self._update_queue_actions_menu)
+        self.tree.bind("<<TreeviewSelect>>", self._schedule_totals, add="+")
         self.tree.bind("<Button-3>", self._show_queue_context_menu)
 
 
         if self.cfg.get("upd_check_on_start", False):
             self.after(1000, self._check_ffmpeg_on_startup)
 
+    def _setup_profiling(self):
+        # Wrap before anything binds these methods, so callbacks go through the profiler
+        self.profiler = Profiler(self.cfg.path.parent / "profile",
+                                 lag_threshold_ms=int(self.cfg.get("debug_lag_threshold_ms", 200)))
+        for name in ("_append_to_console", "_update_row_value", "_fetch_metadata", "_start_download"):
+            self.profiler.wrap(self, name)
+        self.profiler.start_lag_monitor(self)
+        self.bind("<Control-Alt-m>", lambda e: self.profiler.snapshot_memory())
+        self.bind("<Control-Alt-p>", lambda e: self.profiler.dump())
+        atexit.register(self.profiler.dump)
+        print(f"Profiling enabled, writing to {self.profiler.folder} (Ctrl+Alt+P: dump profile, Ctrl+Alt+M: memory snapshot)")
+
     def _auto_detect_dependencies(self):
         config_changed = False
         
@@ -1408,18 +1859,65 @@ class App(tb.Window):
             self.adv_source_var.set(path)
 
     def _on_runner_log(self, log_line: str):
-        self.after(0, self._append_to_console, log_line)
+        # Lines from all download threads are batched into one console update per flush
+        with self._console_lock:
+            self._console_pending.append(log_line)
+            if self._console_flush_scheduled:
+                return
+            self._console_flush_scheduled = True
+        self.after(CONSOLE_FLUSH_MS, self._flush_console)
+
+    def _flush_console(self):
+        with self._console_lock:
+            text = "".join(self._console_pending)
+            self._console_pending.clear()
+            self._console_flush_scheduled = False
+        if text:
+            self._append_to_console(text)
 
     def _on_runner_task(self, task: Task):
         gui_id = getattr(task, 'gui_id', None)
         if gui_id:
+            item = self.queue_data.get(gui_id)
+            if item is not None:
+                if task.status not in ("downloaded",):
+                    item.task = task
+                if task.log and task.log not in item.logs:
+                    item.logs.append(task.log)
+            error_class = f"{task.error_class}, " if task.error_class else ""
+            if task.phase == "postprocess":
+                running_text = "Processing..."
+            elif task.attempts:
+                running_text = f"Downloading (retry {task.attempts})..."
+            else:
+                running_text = "Downloading..."
             status_map = {
-                "running": "Downloading...",
+                "running": running_text,
+                "queued": "Processing (queued)" if task.stage == 2 else ("Queued (waiting for disk space)" if task.disk_held else "Queued"),
+                "downloaded": "Downloaded",
+                "retrying": f"Retrying ({task.error_class}) {task.attempts}/{task.max_retries}",
+                "preempted": "Paused (preempted)",
+                "paused": "Paused",
+                "stopped": "Stopped",
+                "cancelled": "Cancelled",
                 "done": "Done",
-                "error": f"Failed (rc={task.returncode})"
+                "error": f"Failed ({error_class}rc={task.returncode})"
             }
+            if task.status == "done" and task.results and self.library:
+                try:
+                    self.library.add(task.results)
+                except sqlite3.Error as e:
+                    self.after(0, self._append_to_console, f"[LIBRARY] Could not record {task.label}: {e}\n")
+                if self.deduper:
+                    for r in task.results:
+                        self.deduper.submit(r["filepath"])
+                if "--write-info-json" in task.cmd:
+                    sidecars = [os.path.splitext(r["filepath"])[0] + ".info.json" for r in task.results]
+                    threading.Thread(target=ingest_files, args=(self.library, [p for p in sidecars if os.path.exists(p)]), daemon=True).start()
             status_text = status_map.get(task.status, task.status)
             self.after(0, self._update_row_value, gui_id, "Status", status_text)
+            if task.status == "done":
+                self.after(0, self._schedule_totals)
             
             if task.status == "done" and self.cfg.get("queue_remove_done_items", False):
                 self.after(3000, lambda: self.tree.delete(gui_id))
@@ -1526,17 +2024,39 @@ class App(tb.Window):
         if queue_has_items:
             state = NORMAL if item_selected else DISABLED
             item_num_str = self.tree.item(selection[0], "values")[0] if item_selected else "#"
-
-            self._menu.add_command(label=f"Start item {item_num_str}", state=state)
+            is_paused = item_selected and self.tree.item(selection[0], "values")[4].startswith("Paused")
+
+            self._menu.add_command(label=f"Start item {item_num_str}", state=state, command=self._start_download)
+            self._menu.add_command(label=f"Start item {item_num_str} now (urgent)", state=state, command=self._start_selected_urgent)
+            self._menu.add_command(label=f"Resume item {item_num_str}" if is_paused else f"Pause item {item_num_str}", state=state, command=self._toggle_pause_selected)
+            self._menu.add_command(label=f"Stop item {item_num_str}", state=state, command=self._stop_selected)
+            self._menu.add_command(label="Move up", state=state, command=lambda: self._move_selected(-1))
+            self._menu.add_command(label="Move down", state=state, command=lambda: self._move_selected(1))
+            self._menu.add_command(label="Move to top", state=state, command=self._move_selected_to_top)
+            self._menu.add_separator()
             self._menu.add_command(label=f"Remove item {item_num_str}", state=state, command=self._delete_selected_items)
-            self._menu.add_command(label=f"Open folder of item {item_num_str}", state=state)
+            self._menu.add_command(label=f"Open folder of item {item_num_str}", state=state, command=self._open_selected_folder)
             self._menu.add_command(label=f"Set file name of item {item_num_str}", state=state)
             self._menu.add_separator()
+            self._menu.add_command(label=f"Formats of item {item_num_str}...", state=state, command=self._show_formats)
             self._menu.add_command(label="Download sections", state=state)
-            self._menu.add_command(label="View JSON data", state=state)
+            self._menu.add_command(label="View JSON data", state=state, command=self._view_selected_json)
+            self._menu.add_command(label=f"View full log of item {item_num_str}", state=state, command=self._view_selected_log)
             self._menu.add_command(label="Refresh (reacquire data)", state=state)
             self._menu.add_command(label="Do not download", state=state)
             self._menu.add_separator()
+            if self.runner.is_active:
+                self._menu.add_command(label="Stop queue", command=self._stop_queue)
+            else:
+                self._menu.add_command(label="Restart queue", command=self._restart_queue)
+            self._menu.add_command(label="Clear queued (not running) items", command=self._clear_pending)
+            if self.job_store:
+                self._menu.add_command(label="Send selected items to the shared queue", state=state, command=self._send_to_job_store)
+            self._menu.add_separator()
+        if self.library:
+            self._menu.add_command(label="Search library...", command=self._open_library_search)
+            self._menu.add_command(label="Index info.json files in download folder", command=self._index_sidecars)
+            self._menu.add_separator()
         
         extra_cols_menu = tb.Menu(self._menu, tearoff=False)
         self.extra_col_vars = {
@@ -1544,6 +2064,9 @@ class App(tb.Window):
             "Format note": BooleanVar(value=self.cfg.get("show_format_note_col")),
             "Ext": BooleanVar(value=self.cfg.get("show_ext_col")),
             "Filesize": BooleanVar(value=self.cfg.get("show_filesize_col")),
+            "CPU time": BooleanVar(value=self.cfg.get("show_cpu_time_col")),
+            "Peak RAM": BooleanVar(value=self.cfg.get("show_peak_ram_col")),
+            "Disk traffic": BooleanVar(value=self.cfg.get("show_disk_traffic_col")),
         }
         for name, var in self.extra_col_vars.items():
             key = f"show_{name.lower().replace(' ', '_')}_col"
@@ -1568,6 +2091,143 @@ class App(tb.Window):
             finish_menu.add_radiobutton(label=lbl, value=key, variable=self.finish_action, command=self._save_finish_action)
         self._menu.add_cascade(label="When finished", menu=finish_menu)
 
+    def _open_selected_folder(self):
+        """Open the folder of the item's file: the one it downloaded, else its copy already in the library, else the download folder."""
+        selection = self.tree.selection()
+        item = self.queue_data.get(selection[0]) if selection else None
+        if item is None:
+            return
+        path = None
+        if item.task is not None and item.task.results:
+            path = item.task.results[-1].get("filepath")
+        path = path or item.in_library
+        folder = Path(path).parent if path else Path(self.var_folder.get())
+        if folder.is_dir():
+            webbrowser.open(folder.as_uri())
+        else:
+            self._show_temp_message(f"Folder not found: {folder}")
+
+    def _view_selected_json(self):
+        selection = self.tree.selection()
+        if not selection:
+            return
+        iid = selection[0]
+        item = self.queue_data.get(iid)
+        if item is None or not item.has_info:
+            Messagebox.show_info("This item has no data yet. It is fetched when the item is added to the queue.", "View JSON data", parent=self)
+            return
+        item_num = self.tree.item(iid, "values")[0]
+
+        win = tb.Toplevel(self)
+        win.title(f"JSON data of queue item {item_num}")
+        win.geometry("900x600")
+        viewer = ScrolledText(win, autohide=True, wrap="none")
+        viewer.pack(fill=BOTH, expand=True, padx=8, pady=8)
+
+        def load():
+            # The full document stays in the info cache; it is only read for this window
+            data = item.load_info(self.info_cache)
+            text = json.dumps(data, indent=2, ensure_ascii=False) if data is not None else "The saved data is no longer in the cache."
+            self.after(0, show, text)
+
+        def show(text):
+            if not win.winfo_exists():
+                return
+            viewer.insert(END, text)
+            viewer.text.config(state=DISABLED)
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def _view_selected_log(self):
+        selection = self.tree.selection()
+        if not selection:
+            return
+        iid = selection[0]
+        item = self.queue_data.get(iid)
+        logs = item.logs if item else []
+        if not logs:
+            Messagebox.show_info("This item has no log yet. Logs are written once an item starts downloading.", "View log", parent=self)
+            return
+        item_num = self.tree.item(iid, "values")[0]
+
+        win = tb.Toplevel(self)
+        win.title(f"Log of queue item {item_num}")
+        win.geometry("900x600")
+        info = tb.Label(win, text="Loading...")
+        info.pack(side=TOP, fill=X, padx=8, pady=(8, 4))
+        viewer = ScrolledText(win, autohide=True, wrap="none")
+        viewer.pack(fill=BOTH, expand=True, padx=8, pady=(0, 8))
+
+        def load():
+            parts = [p for log in logs for p in log.parts()]
+            text = read_tail(parts, LOG_VIEW_MAX_BYTES)
+            self.after(0, show, parts, text)
+
+        def show(parts, text):
+            if not win.winfo_exists():
+                return
+            files = ", ".join(p.name for p in parts) or "(missing)"
+            suffix = f" (last {LOG_VIEW_MAX_BYTES // 1024 // 1024} MiB shown)" if len(text.encode("utf-8", "replace")) >= LOG_VIEW_MAX_BYTES else ""
+            info.config(text=f"{self.task_logs.folder}: {files}{suffix}")
+            viewer.insert(END, text)
+            viewer.see(END)
+            viewer.text.config(state=DISABLED)
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def _index_sidecars(self):
+        folder = self.var_folder.get()
+        if not folder or not Path(folder).is_dir():
+            Messagebox.show_warning("The download folder does not exist.", "Index info.json files", parent=self)
+            return
+
+        def run():
+            self.after(0, self._append_to_console, f"[LIBRARY] Indexing info.json files in {folder}\n")
+            progress = lambda done, total: self.after(0, self._append_to_console, f"[LIBRARY] {done}/{total} changed files parsed\n")
+            try:
+                count = scan_folder(self.library, folder, progress)
+                self.after(0, self._append_to_console, f"[LIBRARY] {count} info.json file(s) indexed\n")
+            except sqlite3.Error as e:
+                self.after(0, self._append_to_console, f"[LIBRARY] Indexing failed: {e}\n")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _open_library_search(self, event=None):
+        if not self.library:
+            Messagebox.show_info("The library index is turned off in the Queueing settings.", "Library", parent=self)
+            return
+        win = tb.Toplevel(self)
+        win.title("Library")
+        win.geometry("1000x550")
+        var_query = StringVar()
+        entry = tb.Entry(win, textvariable=var_query)
+        entry.pack(side=TOP, fill=X, padx=8, pady=8)
+        columns = ["Title", "Uploader", "Size", "File"]
+        results = tb.Treeview(win, columns=columns, show="headings")
+        for col, width in zip(columns, (320, 160, 90, 400)):
+            results.heading(col, text=col)
+            results.column(col, width=width, stretch=col in ("Title", "File"))
+        results.pack(fill=BOTH, expand=True, padx=8, pady=(0, 8))
+        status = tb.Label(win, text="")
+        status.pack(side=BOTTOM, fill=X, padx=8, pady=(0, 8))
+
+        def refresh(*_):
+            try:
+                rows = self.library.search(var_query.get())
+            except sqlite3.Error as e:
+                status.config(text=f"Search failed: {e}")
+                return
+            results.delete(*results.get_children())
+            for r in rows:
+                size = r["filesize"] or 0
+                size_str = f"{size / (1024*1024*1024):.2f} GB" if size > 1024*1024*1024 else f"{size / (1024*1024):.1f} MB"
+                results.insert("", END, values=(r["title"] or "", r["uploader"] or "", size_str, r["filepath"]))
+            status.config(text=f"{len(rows)} result(s)")
+
+        var_query.trace_add("write", refresh)
+        entry.focus_set()
+        refresh()
+
     def _show_queue_context_menu(self, event):
         self._setup_queue_actions_menu()
         self._menu.post(event.x_root, event.y_root)
@@ -1594,8 +2254,84 @@ class App(tb.Window):
         center_y = (screen_height // 2) - (default_height // 2)
         self.geometry(f'{default_width}x{default_height}+{center_x}+{center_y}')
 
-    def _show_formats_placeholder(self, event=None):
-        Messagebox.show_info("Not Implemented", "The formats window is not yet available.")
+    def _show_formats(self, event=None):
+        selection = self.tree.selection()
+        if not selection:
+            return
+        iid = selection[0]
+        item = self.queue_data.get(iid)
+        if not item or not item.formats:
+            Messagebox.show_info("The formats of this item are not known yet. They are read when its metadata is fetched.", "Formats", parent=self)
+            return
+        item_num = self.tree.item(iid, "values")[0]
+
+        win = tb.Toplevel(self)
+        win.title(f"Formats of queue item {item_num}")
+        win.geometry("1000x550")
+        win.bind("<Escape>", lambda e: win.destroy())
+        tb.Label(win, text=item.title or item.url).pack(side=TOP, fill=X, padx=8, pady=(8, 4))
+        columns = ["ID", "Ext", "Resolution", "FPS", "Video codec", "Audio codec", "Bitrate", "Size", "Note"]
+        table = tb.Treeview(win, columns=columns, show="headings")
+        for col, width in zip(columns, (70, 60, 100, 50, 130, 130, 80, 110, 200)):
+            table.heading(col, text=col)
+            table.column(col, width=width, stretch=col == "Note")
+        table.tag_configure("chosen", foreground=self.style.colors.success)
+        exact_bytes = self.cfg.get("ui_exact_filesize", False)
+        # Best first; tree ids are positions, since format ids are not guaranteed unique
+        fmts = expand_formats(item.formats)
+        for i in range(len(fmts) - 1, -1, -1):
+            f = fmts[i]
+            size, exact = format_size(f, item.duration)
+            size_str = f"{size:,} B" if exact_bytes and size and exact else format_filesize(size, exact)
+            if f.get("vcodec") == "none":
+                res = "audio only"
+            elif f.get("width") and f.get("height"):
+                res = f"{f['width']}x{f['height']}"
+            else:
+                res = f"{f['height']}p" if f.get("height") else ""
+            table.insert("", END, iid=str(i), values=(
+                f.get("format_id") or "", f.get("ext") or "", res, f"{f['fps']:g}" if f.get("fps") else "",
+                f.get("vcodec") or "", f.get("acodec") or "", f"{f['tbr']:g}k" if f.get("tbr") else "", size_str,
+                f.get("format_note") or "",
+            ))
+        table.pack(fill=BOTH, expand=True, padx=8)
+        status = tb.Label(win, text="")
+        status.pack(side=TOP, fill=X, padx=8, pady=4)
+        buttons = tb.Frame(win)
+        buttons.pack(side=BOTTOM, fill=X, padx=8, pady=(0, 8))
+
+        def show_choice():
+            chosen = set((item.choice.format_id if item.choice else "").replace(",", "+").split("+"))
+            for row in table.get_children():
+                table.item(row, tags=("chosen",) if table.set(row, "ID") in chosen else ())
+            source = f"custom selector {item.format_override}" if item.format_override else "the download options"
+            if item.choice:
+                size = format_filesize(item.choice.size, item.choice.exact and not item.choice.approximate) or "unknown size"
+                status.config(text=f"With {source}: {item.choice.format_id} -> {item.choice.ext or '?'}, {size}")
+            else:
+                status.config(text=f"With {source}: {self.tree.set(iid, 'Format note') or 'nothing is selected'}")
+
+        def apply(spec):
+            if not self.tree.exists(iid):
+                win.destroy()
+                return
+            item.format_override = spec
+            self._evaluate_format(iid)
+            self._schedule_totals()
+            show_choice()
+
+        def use_selected():
+            rows = [fmts[int(row)] for row in table.selection()]
+            if rows:
+                # Video first, as yt-dlp expects when merging
+                rows.sort(key=lambda f: f.get("vcodec") == "none")
+                apply("+".join(str(f.get("format_id")) for f in rows))
+
+        tb.Button(buttons, text="Close", command=win.destroy).pack(side=RIGHT, padx=(6, 0))
+        tb.Button(buttons, text="Use download options", command=lambda: apply(None), bootstyle="secondary").pack(side=RIGHT, padx=6)
+        tb.Button(buttons, text="Use selected formats", command=use_selected, bootstyle="success").pack(side=RIGHT, padx=6)
+        table.bind("<Double-1>", lambda e: use_selected())
+        show_choice()
         
     def _edit_queue_item_placeholder(self, event=None):
         Messagebox.show_info("Not Implemented", "Editing queue items with F2 is not yet available.")
@@ -1637,10 +2373,35 @@ class App(tb.Window):
             self.placeholder_label.pack_forget()
             self.output_console.pack(fill=BOTH, expand=True)
 
-        self.output_console.text.config(state=NORMAL)
-        self.output_console.insert(END, text)
-        self.output_console.see(END)
-        self.output_console.text.config(state=DISABLED)
+        widget = self.output_console.text
+        widget.config(state=NORMAL)
+        start = widget.index("end-1c")
+        widget.insert(END, text)
+        if self.v_highlight.get():
+            self._highlight_console(start, text)
+        if self.v_limit_buffer.get():
+            lines = int(widget.index("end-1c").split(".")[0])
+            if lines > CONSOLE_MAX_LINES * 1.1:
+                widget.delete("1.0", f"{lines - CONSOLE_MAX_LINES}.0")
+        widget.see(END)
+        widget.config(state=DISABLED)
+
+    def _highlight_console(self, start, text):
+        """Tag keyword matches in text, which was just inserted at index start."""
+        line, col = map(int, start.split("."))
+        ranges = {}
+        pos = 0
+        for m in CONSOLE_HIGHLIGHT_RE.finditer(text):
+            newlines = text.count("\n", pos, m.start())
+            if newlines:
+                line += newlines
+                col = m.start() - text.rfind("\n", pos, m.start()) - 1
+            else:
+                col += m.start() - pos
+            pos = m.start()
+            ranges.setdefault(m.lastgroup, []).extend((f"{line}.{col}", f"{line}.{col + m.end() - m.start()}"))
+        for tag, indices in ranges.items():
+            self.output_console.text.tag_add(f"hl_{tag}", *indices)
 
     def _handle_focus_in(self, event=None):
         if self.cfg.get("queue_paste_on_activate", False):
@@ -1650,8 +2411,8 @@ class App(tb.Window):
         def check_ffmpeg():
             try:
                 if not requests: return
-                updater = FFmpegUpdater(self.cfg)
-                if not updater.get_ffmpeg_version():
+                updater = FFmpegUpdater(self.cfg, self.probe_cache)
+                if not updater.get_ffmpeg_version(self.cfg.get("ffmpeg_path", "").strip() or None):
                     updater.check_and_update_ffmpeg()
             except Exception:
                 pass
@@ -1679,6 +2440,9 @@ class App(tb.Window):
         if self.cfg.get("show_format_note_col"): columns.append("Format note")
         if self.cfg.get("show_ext_col"): columns.append("Ext")
         if self.cfg.get("show_filesize_col"): columns.append("Filesize")
+        if self.cfg.get("show_cpu_time_col"): columns.append("CPU time")
+        if self.cfg.get("show_peak_ram_col"): columns.append("Peak RAM")
+        if self.cfg.get("show_disk_traffic_col"): columns.append("Disk traffic")
         self.tree["displaycolumns"] = columns
         self.after(50, self._adjust_column_widths)
 
@@ -1690,7 +2454,7 @@ class App(tb.Window):
         self.style.theme_use(get_theme_name(pref))
 
     def _open_settings(self):
-        SettingsWindow(self, self.cfg, theme_apply_cb=self._apply_theme)
+        SettingsWindow(self, self.cfg, theme_apply_cb=self._apply_theme, probe_cache=self.probe_cache)
 
     def _set_placeholder(self, event=None):
         if not self.url_var.get():
@@ -1719,8 +2483,8 @@ class App(tb.Window):
             self.after(50, lambda: self._show_temp_message("The clipboard does not contain any text."))
             return
 
-        for item_id, item_data in self.queue_data.items():
-            if item_data['url'] == url and self.tree.exists(item_id):
+        for item_id, item in self.queue_data.items():
+            if item.url == url and self.tree.exists(item_id):
                 item_num = self.tree.item(item_id, "values")[0]
                 self._show_temp_message(f"The URL in the clipboard is already added (queue item #{item_num}).")
                 return
@@ -1733,11 +2497,11 @@ class App(tb.Window):
     def _add_url_to_queue(self, url, preset_args=None, metadata=None):
         idx = len(self.tree.get_children()) + 1
         domain = urlparse(url).netloc
-        values = [idx, "", domain, url, "Fetching data...", "", "", "", ""]
+        values = [idx, "", domain, url, "Fetching data...", "", "", "", "", "", "", ""]
         
         tag = 'oddrow' if idx % 2 == 1 else 'evenrow'
         iid = self.tree.insert("", "end", values=values, tags=(tag,))
-        self.queue_data[iid] = {'url': url, 'json_data': None, 'preset_args': preset_args}
+        self.queue_data[iid] = QueueItem(url, preset_args)
         
         if self.cfg.get("show_website_favicon_col"):
             self._fetch_and_set_favicon(iid, domain)
@@ -1752,7 +2516,10 @@ class App(tb.Window):
 
     def _fetch_metadata(self, iid, url):
         ytdlp_exe = self.cfg.get("ytdlp_path") or "yt-dlp"
-        cmd = [ytdlp_exe, url, "--dump-json", "--no-warnings", "--no-playlist"]
+        item = self.queue_data.get(iid)
+        # Extract as the download will, so the format URLs in the saved info JSON stay usable
+        net = network_args(build_yt_dlp_cmd(self.cfg, url, item.preset_args if item else None))
+        cmd = [ytdlp_exe, url, "--dump-json", "--no-warnings", "--no-playlist", "--encoding", "utf-8"] + net
         
         is_first_video = True
         try:
@@ -1761,13 +2528,18 @@ class App(tb.Window):
             for line in process.stdout:
                 try:
                     json_data = json.loads(line)
+                    # Only a summary goes to the UI thread; the full document is spilled to the info cache
+                    summary = summarize(json_data, url, self.info_cache)
+                    summary["fetch_args"] = net
+                    del json_data
                     if is_first_video:
-                        self.after(0, self._update_row_with_metadata, iid, json_data)
+                        self.after(0, self._update_row_with_metadata, iid, summary)
                         is_first_video = False
                     else:
-                        new_url = json_data.get("webpage_url", "")
-                        preset_args = self.queue_data.get(iid, {}).get('preset_args')
-                        self.after(0, self._add_url_to_queue, new_url, preset_args, metadata=json_data)
+                        new_url = summary.get("webpage_url") or ""
+                        item = self.queue_data.get(iid)
+                        preset_args = item.preset_args if item else None
+                        self.after(0, self._add_url_to_queue, new_url, preset_args, metadata=summary)
                 except json.JSONDecodeError:
                     continue 
             
@@ -1781,37 +2553,127 @@ class App(tb.Window):
     def _update_row_with_metadata(self, iid, data):
         if not self.tree.exists(iid): return
         
-        self.queue_data[iid]['json_data'] = data
-        self.queue_data[iid]['url'] = data.get('webpage_url', self.queue_data[iid]['url'])
+        item = self.queue_data[iid]
+        item.update(data)
         
-        title = data.get('title', 'N/A')
-        format_id = data.get('format_id', '')
-        format_note = data.get('format_note', data.get('resolution', ''))
-        ext = data.get('ext', '')
-        
-        filesize = data.get('filesize_approx')
-        if filesize:
-            if filesize > 1024*1024*1024:
-                filesize_str = f"~{filesize / (1024*1024*1024):.2f} GB"
-            elif filesize > 1024*1024:
-                filesize_str = f"~{filesize / (1024*1024):.2f} MB"
-            else:
-                filesize_str = f"~{filesize / 1024:.2f} KB"
-        else:
-            filesize_str = ""
+        title = item.title or 'N/A'
 
         self._update_row_value(iid, "Media title", title)
         self._update_row_value(iid, "Status", "Queued")
-        self._update_row_value(iid, "Format", format_id)
-        self._update_row_value(iid, "Format note", format_note)
-        self._update_row_value(iid, "Ext", ext)
-        self._update_row_value(iid, "Filesize", filesize_str)
+        if self.library and item.video_id:
+            existing = self.library.have(item.extractor_key or "", item.video_id)
+            if existing:
+                item.in_library = existing[0]["filepath"]
+                if self.cfg.get("library_skip_existing", False):
+                    self._update_row_value(iid, "Status", "In library")
+                else:
+                    item_num = self.tree.item(iid, "values")[0]
+                    self._show_temp_message(f"Queue item #{item_num} is already in the library: {existing[0]['filepath']}")
+        self._evaluate_format(iid)
+        self._schedule_totals()
+
+    def _evaluate_format(self, iid, cmd=None):
+        """Resolve the item's format selection against its formats list and show the result in its row."""
+        item = self.queue_data[iid]
+        if cmd is None:
+            cmd = build_yt_dlp_cmd(self.cfg, item.url, item.preset_args)
+        if item.format_override:
+            cmd = with_format(cmd, item.format_override)
+        if not item.formats:
+            # Nothing to evaluate against: show what yt-dlp reported for its default selection
+            item.choice = None
+            values = (item.format_id or '', item.format_note or '', item.ext or '', format_filesize(item.filesize_approx, exact=False))
+        else:
+            try:
+                item.choice = choose(cmd, item.formats, item.duration)
+            except (ValueError, re.error) as e:
+                item.choice = None
+                values = ("?", f"Cannot evaluate the format selector: {e}", "", "")
+            else:
+                choice = item.choice
+                if choice:
+                    values = (choice.format_id, choice.note, choice.ext or "", format_filesize(choice.size, choice.exact and not choice.approximate))
+                else:
+                    values = ("none", "No format matches the options", "", "")
+        for col, value in zip(("Format", "Format note", "Ext", "Filesize"), values):
+            self._update_row_value(iid, col, value)
+
+    def refresh_format_choices(self):
+        """Re-evaluate the format of every item not yet handed to the runner, after an option changed."""
+        cmds = {}
+        for iid, item in self.queue_data.items():
+            if item.task is not None and item.task.status not in ("stopped", "cancelled", "error"):
+                continue
+            key = tuple(item.preset_args or ())
+            if key not in cmds:
+                # Format selection does not depend on the URL, so one command per preset will do
+                cmds[key] = build_yt_dlp_cmd(self.cfg, "", item.preset_args)
+            self._evaluate_format(iid, cmds[key])
+        self._schedule_totals()
+
+    def _schedule_totals(self, event=None):
+        if not self._totals_pending:
+            self._totals_pending = True
+            self.after(100, self._update_totals)
+
+    def _size_total(self, iids):
+        """(items, bytes, items of unknown size, all sizes exact) over the unfinished items among iids."""
+        count, total, unknown, exact = 0, 0, 0, True
+        for iid in iids:
+            item = self.queue_data.get(iid)
+            if item is None or (item.task is not None and item.task.status == "done"):
+                continue
+            count += 1
+            if item.choice and item.choice.size:
+                total += item.choice.size
+                exact = exact and item.choice.exact and not item.choice.approximate
+            elif not item.formats and item.filesize_approx:
+                total += item.filesize_approx
+                exact = False
+            else:
+                unknown += 1
+        return count, total, unknown, exact
+
+    def _update_totals(self):
+        self._totals_pending = False
+        parts = []
+        for label, iids in (("Queue", self.queue_data.keys()), ("Selected", self.tree.selection())):
+            count, total, unknown, exact = self._size_total(iids)
+            if not count:
+                continue
+            text = f"{label}: {count} item{'s' if count != 1 else ''}, {format_filesize(total, exact) or '0 KB'}"
+            if unknown:
+                text += f" ({unknown} of unknown size)"
+            parts.append(text)
+        self.lbl_totals.config(text="   |   ".join(parts))
 
     def _update_row_with_error(self, iid, message):
         if not self.tree.exists(iid): return
         self._update_row_value(iid, "Media title", message)
         self._update_row_value(iid, "Status", "Error")
 
+    def _refresh_usage(self):
+        """Show the sampled CPU time, peak memory and disk traffic of each item's task."""
+        self.after(2000, self._refresh_usage)
+        if not any(self.cfg.get(k) for k in ("show_cpu_time_col", "show_peak_ram_col", "show_disk_traffic_col")):
+            return
+        columns = self.tree["columns"]
+        for iid, item in self.queue_data.items():
+            task = item.task
+            if task is None or not task.sampled_at or not self.tree.exists(iid):
+                continue
+            traffic = f"{format_filesize(task.read_bytes) or '0 KB'} / {format_filesize(task.write_bytes) or '0 KB'}"
+            usage = {"CPU time": format_cpu_time(task.cpu_time), "Peak RAM": format_filesize(task.peak_rss), "Disk traffic": traffic}
+            values = list(self.tree.item(iid, "values"))
+            changed = False
+            for col, text in usage.items():
+                i = columns.index(col)
+                if i < len(values) and values[i] != text:
+                    values[i] = text
+                    changed = True
+            if changed:
+                self.tree.item(iid, values=values)
+
     def _update_row_value(self, iid, col_name, new_value):
         if not self.tree.exists(iid): return
         
@@ -1863,44 +2725,254 @@ class App(tb.Window):
         selected_items = self.tree.selection()
         if not selected_items:
             return
+        removed_keys = set()
         for item_id in selected_items:
             if self.tree.exists(item_id):
-                if item_id in self.queue_data:
-                    del self.queue_data[item_id]
+                item = self.queue_data.pop(item_id, None)
+                if item and item.info_key:
+                    removed_keys.add(item.info_key)
                 self.tree.delete(item_id)
+        self._schedule_totals()
+        if removed_keys:
+            removed_keys -= {item.info_key for item in self.queue_data.values()}
+            for key in removed_keys:
+                self.info_cache.discard(key)
         self._update_queue_actions_menu()
 
-    def _start_download(self, event=None, items_to_download=None):
-        if items_to_download:
+    def _start_download(self, event=None, items_to_download=None, urgent=False):
+        if items_to_download is not None:
             selected_items = items_to_download
         else:
             selected_items = self.tree.selection()
 
-        if not selected_items:
+        if items_to_download is None and not selected_items:
             selected_items = [iid for iid in self.tree.get_children() if self.tree.item(iid, "values")[4] == "Queued"]
-            if not selected_items:
+            if not selected_items and not len(self.runner.pending):
                 Messagebox.show_warning("No items are queued for download.", "Start Download")
                 return
 
+        self._apply_runner_settings()
+        self.runner.start()
+
         for iid in selected_items:
             if self.tree.exists(iid) and iid in self.queue_data:
                 status = self.tree.item(iid, "values")[4]
-                if status == "Queued":
-                    item_data = self.queue_data[iid]
-                    url = item_data['url']
-                    preset_args = item_data.get('preset_args')
+                pending_task = self._pending_task(iid)
+                if pending_task:
+                    self.runner.resume(pending_task)
+                    self._update_row_value(iid, "Status", "Starting...")
+                elif status == "Queued" or (items_to_download is None and status in ("Stopped", "Cancelled", "In library")):
+                    item = self.queue_data[iid]
+                    url = item.url
+                    preset_args = item.preset_args
 
                     item_cfg = copy.deepcopy(self.cfg) if self.cfg.get("queue_item_has_own_options", True) else self.cfg
                     if preset_args:
                         item_cfg["download_folder"] = self.var_folder.get()
 
                     cmd = build_yt_dlp_cmd(item_cfg, url, preset_args)
+                    if item.format_override:
+                        cmd = with_format(cmd, item.format_override)
                     
-                    task = Task(label=url, cmd=cmd)
+                    task = Task(label=url, cmd=cmd, domain=self._task_domain(iid), url=url,
+                                max_retries=int(self.cfg.get("queue_retry", 2)),
+                                retry_sleep=float(self.cfg.get("queue_retry_sleep", 5)),
+                                info_json=lambda iid=iid, cmd=cmd: self._fresh_info_json(iid, cmd))
                     task.gui_id = iid
+                    task.disk_needs = self._disk_needs(item, cmd, item_cfg)
+                    item.task = task
+
+                    info_json = self._fresh_info_json(iid, cmd)
+                    split = split_postprocessing(cmd, url, info_json) if info_json and self.cfg.get("pipeline_split", False) else None
+                    if split:
+                        task.cmd = split[0]
+                        processing_stage(task, split[1])
+                    if info_json and self.cfg.get("queue_reuse_info_json", True):
+                        task.cmd = with_info_json(task.cmd, url, info_json)
                     
                     self._update_row_value(iid, "Status", "Starting...")
-                    self.runner.enqueue(task)
+                    self.runner.enqueue(task, urgent=urgent)
+
+        self._sync_runner_order()
+
+    def _apply_runner_settings(self):
+        self.runner.max_concurrent = max(1, int(self.cfg.get("queue_max_concurrent", 1)))
+        self.runner.scheduler.configure(
+            starts_per_minute=float(self.cfg.get("sched_domain_starts_per_min", 6)),
+            burst=int(self.cfg.get("sched_domain_burst", 2)),
+            max_per_domain=int(self.cfg.get("sched_domain_max_concurrent", 2)),
+        )
+        self.runner.governor.limit, self.runner.governor.hours = global_rate_limit(self.cfg)
+        self.runner.preempt = self.cfg.get("queue_preempt", False)
+        self.runner.pause_mode = self.cfg.get("queue_pause_mode", "suspend")
+        self.runner.release_on_postprocess = self.cfg.get("queue_start_on_lengthy", True)
+        self.runner.max_postprocessing = max(1, int(self.cfg.get("queue_max_postprocessing", 2)))
+        self.runner.cpu_workers = int(self.cfg.get("pipeline_cpu_workers", 0)) or os.cpu_count() or 1
+        if self.cfg.get("adaptive_fragments", False):
+            self.fragment_tuner.max_n = max(1, int(self.cfg.get("adaptive_fragments_max", 16)))
+            self.runner.fragment_tuner = self.fragment_tuner
+        else:
+            self.runner.fragment_tuner = None
+        self.runner.metrics = self.metrics if self.cfg.get("queue_metrics_export", True) else None
+        self.disk_budget.reserve = max(0, int(self.cfg.get("disk_reserve_mb", 1024))) * 1024 * 1024
+        self.runner.disk = self.disk_budget if self.cfg.get("disk_admission", True) else None
+        self.resource_monitor.max_rss = max(0, int(self.cfg.get("resource_max_ram_mb", 0))) * 1024 * 1024
+        self.resource_monitor.max_cpu = max(0.0, float(self.cfg.get("resource_max_cpu_cores", 0)))
+        accounting = self.cfg.get("resource_accounting", True) and procstats.AVAILABLE
+        self.runner.resources = self.resource_monitor if accounting else None
+        self.task_logs.keep_days = int(self.cfg.get("task_logs_keep_days", 30))
+        self.runner.log_store = self.task_logs if self.cfg.get("task_logs", True) else None
+        self.runner.results_dir = str(self.cfg.path.parent / "results") if self.library else None
+        if self.deduper:
+            self.deduper.mode = self.cfg.get("dedupe_mode", "report")
+        self.runner.wake()
+
+    def _fresh_info_json(self, iid, cmd=None):
+        """Path of the item's saved info JSON, unless it is stale or was extracted with other network options than cmd."""
+        item = self.queue_data.get(iid)
+        if not item or not item.has_info:
+            return None
+        if time.time() - item.fetched_at > INFO_JSON_MAX_AGE:
+            return None
+        if cmd is not None and tuple(network_args(cmd)) != item.fetch_args:
+            return None
+        path = item.info_path(self.info_cache)
+        return str(path) if path else None
+
+    def _send_to_job_store(self):
+        """Queue the selected items in the shared job store, for any node to download."""
+        sent = 0
+        for iid in self.tree.selection():
+            item = self.queue_data.get(iid)
+            if item is None or self.tree.set(iid, "Status") != "Queued":
+                continue
+            cmd = build_yt_dlp_cmd(self.cfg, item.url, item.preset_args)
+            if item.format_override:
+                cmd = with_format(cmd, item.format_override)
+            try:
+                args = job_args(cmd[1:], self.cfg.get("output_template", "%(title)s [%(id)s].%(ext)s"))
+                self.job_store.add(args, url=item.url, label=item.title or item.url, domain=self._task_domain(iid),
+                                   archive=archive_key(item.extractor_key, item.video_id))
+            except sqlite3.Error as e:
+                self._show_temp_message(f"Could not add to the shared queue: {e}")
+                return
+            self._update_row_value(iid, "Status", "Sent to shared queue")
+            sent += 1
+        if sent:
+            self._show_temp_message(f"{sent} item(s) sent to the shared queue")
+
+    def _disk_needs(self, item, cmd, cfg):
+        """Peak bytes the item needs per folder: the selected formats, twice over where ffmpeg
+        rewrites the file (merging, remuxing, embedding), plus 10% for estimate error."""
+        folder = cfg.get("download_folder", str(Path.home() / "Downloads"))
+        if item.choice and item.choice.size:
+            size = item.choice.size
+        else:
+            size = item.filesize_approx or 0
+        size *= 1.1
+        rewrites = (item.choice and "+" in item.choice.format_id) or any(arg in POSTPROCESS_FLAGS for arg in cmd)
+        peak = int(size * (2 if rewrites else 1))
+        scratch = cfg.get("scratch_folder", "").strip()
+        if scratch and Path(scratch).is_dir():
+            # The rewrites happen in the scratch folder; the download folder only receives the result
+            return {temp_dir(scratch): peak, folder: int(size)}
+        return {folder: peak}
+
+    def _cleanup_scratch(self):
+        scratch = self.cfg.get("scratch_folder", "").strip()
+        if not Path(scratch).is_dir():
+            self.after(0, self._append_to_console, f"[SCRATCH] The scratch folder {scratch} does not exist; writing directly to the download folder\n")
+            return
+        files, size = cleanup_orphans(scratch, float(self.cfg.get("scratch_orphan_hours", 24)) * 3600)
+        if files:
+            self.after(0, self._append_to_console, f"[SCRATCH] Removed {files} orphaned file(s), {size / (1024*1024):.1f} MB, from {temp_dir(scratch)}\n")
+
+    def _task_domain(self, iid):
+        item = self.queue_data.get(iid)
+        if not item:
+            return ""
+        return site_key(item.url)
+
+    def _pending_task(self, iid):
+        task = self._item_task(iid)
+        return task if task is not None and self.runner.is_queued(task) else None
+
+    def _item_task(self, iid):
+        item = self.queue_data.get(iid)
+        return item.task if item else None
+
+    def _renumber_rows(self):
+        for idx, iid in enumerate(self.tree.get_children(), start=1):
+            self._update_row_value(iid, "#", idx)
+            self.tree.item(iid, tags=('oddrow' if idx % 2 == 1 else 'evenrow',))
+
+    def _sync_runner_order(self):
+        order = [task for task in map(self._item_task, self.tree.get_children()) if task]
+        self.runner.reorder(order)
+
+    def _move_selected(self, delta):
+        selection = self.tree.selection()
+        children = list(self.tree.get_children())
+        moving = sorted(selection, key=children.index, reverse=delta > 0)
+        for iid in moving:
+            new_index = max(0, min(len(children) - 1, self.tree.index(iid) + delta))
+            self.tree.move(iid, "", new_index)
+        self._renumber_rows()
+        self._sync_runner_order()
+
+    def _move_selected_to_top(self):
+        children = list(self.tree.get_children())
+        for iid in sorted(self.tree.selection(), key=children.index, reverse=True):
+            self.tree.move(iid, "", 0)
+            task = self._pending_task(iid)
+            if task:
+                self.runner.bump(task)
+        self._renumber_rows()
+        self._sync_runner_order()
+
+    def _toggle_pause_selected(self):
+        for iid in self.tree.selection():
+            status = self.tree.item(iid, "values")[4]
+            task = self._item_task(iid)
+            if status.startswith("Paused"):
+                if task and task.status not in ("done", "error", "cancelled"):
+                    self.runner.resume(task)
+                    if self.runner.is_queued(task):
+                        self._update_row_value(iid, "Status", "Starting...")
+                else:
+                    self._update_row_value(iid, "Status", "Queued")
+            elif task and task.status not in ("done", "error", "cancelled"):
+                self.runner.pause(task)
+            elif status == "Queued":
+                self._update_row_value(iid, "Status", "Paused")
+
+    def _stop_selected(self):
+        start_next = self.cfg.get("queue_autostart_on_stop", False)
+        for iid in self.tree.selection():
+            task = self._item_task(iid)
+            if task and task.status not in ("done", "error", "cancelled"):
+                self.runner.cancel(task, start_next=start_next)
+
+    def _stop_queue(self):
+        self.runner.stop_all()
+
+    def _restart_queue(self):
+        self._apply_runner_settings()
+        self.runner.start()
+
+    def _clear_pending(self):
+        self.runner.clear()
+
+    def _start_selected_urgent(self):
+        selection = self.tree.selection()
+        self._apply_runner_settings()
+        for iid in selection:
+            task = self._pending_task(iid)
+            if task:
+                self.runner.set_paused(task, False)
+                self.runner.bump(task, urgent=True)
+                self._update_row_value(iid, "Status", "Starting...")
+        self._start_download(items_to_download=[iid for iid in selection if not self._pending_task(iid)], urgent=True)
 
     def _queue_finished(self):
         action = self.cfg.get("finish_action", "none")
@@ -1912,6 +2984,10 @@ class App(tb.Window):
         self.cfg[k] = v
         self.cfg.save()
 
+    def _save_format_pref(self, k, v):
+        self._save(k, v)
+        self.refresh_format_choices()
+
 def main():
     if is_windows():
         base = Path(os.environ.get("APPDATA", Path.home()))
@@ -0,0 +1,83 @@
+# fake_ytdlp.py
+# Stand-in for yt-dlp that prints realistic output at a set rate, without the network
+
+import argparse
+import json
+import random
+import sys
+import time
+
+def main():
+    p = argparse.ArgumentParser(description="Print yt-dlp-like output. Unknown (real yt-dlp) arguments are ignored.")
+    p.add_argument("--lines-per-sec", type=float, default=50, help="progress updates per second")
+    p.add_argument("--duration", type=float, default=5, help="seconds spent \"downloading\" each file")
+    p.add_argument("--files", type=int, default=2, help="files per item (e.g. video + audio)")
+    p.add_argument("--size-mib", type=float, default=50, help="size of each file")
+    p.add_argument("--cr", action="store_true", help="end progress updates with \\r like yt-dlp on a terminal")
+    p.add_argument("--verbose-lines", type=int, default=0, help="[debug] lines printed per progress update")
+    p.add_argument("--json-kb", type=int, default=0, help="print an info JSON of about this size first")
+    p.add_argument("--fragments", type=int, default=0, help="report (frag x/N) progress")
+    p.add_argument("--postprocess", type=float, default=0, help="seconds of [Merger]/[Metadata] work after downloading")
+    p.add_argument("--exit-code", type=int, default=0)
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--print-to-file", nargs=2, action="append", default=[], metavar=("TEMPLATE", "FILE"))
+    args, _ = p.parse_known_args()
+    rnd = random.Random(args.seed)
+    out = sys.stdout
+
+    if args.json_kb:
+        formats, size = [], 0
+        while size < args.json_kb * 1024:
+            fmt = {"format_id": str(len(formats)), "url": "https://example.invalid/" + "x" * 200,
+                   "ext": "mp4", "tbr": rnd.uniform(100, 9000), "filesize": rnd.randint(10**6, 10**9)}
+            formats.append(fmt)
+            size += len(json.dumps(fmt))
+        out.write(json.dumps({"id": "fake", "title": "Fake video", "formats": formats}) + "\n")
+
+    out.write("[youtube] Extracting URL: https://www.youtube.com/watch?v=fake\n")
+    out.write("[youtube] fake: Downloading webpage\n")
+    out.write(f"[info] fake: Downloading 1 format(s): {'+'.join(str(i) for i in range(args.files))}\n")
+    out.flush()
+
+    end = "\r" if args.cr else "\n"
+    total = args.size_mib * 1024 * 1024
+    steps = max(1, int(args.lines_per_sec * args.duration))
+    interval = args.duration / steps
+    for f in range(args.files):
+        out.write(f"[download] Destination: Fake video.f{f}.mp4\n")
+        start = time.monotonic()
+        for i in range(1, steps + 1):
+            pct = 100.0 * i / steps
+            speed = total / args.duration * rnd.uniform(0.8, 1.2) / 1024 / 1024
+            eta = max(0, int(args.duration - (time.monotonic() - start)))
+            frag = f" (frag {i * args.fragments // steps}/{args.fragments})" if args.fragments else ""
+            out.write(f"[download] {pct:5.1f}% of {args.size_mib:.2f}MiB at {speed:6.2f}MiB/s ETA 00:{eta:02d}{frag}{end}")
+            for _ in range(args.verbose_lines):
+                out.write(f"[debug] Fragment {i} headers: Range=bytes={i * 1024}-{(i + 1) * 1024 - 1}\n")
+            out.flush()
+            delay = start + i * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        out.write(f"\n[download] 100% of {args.size_mib:.2f}MiB in 00:{int(args.duration):02d}\n")
+
+    if args.postprocess:
+        out.write('[Merger] Merging formats into "Fake video.mp4"\n')
+        out.flush()
+        time.sleep(args.postprocess / 2)
+        out.write('[Metadata] Adding metadata to "Fake video.mp4"\n')
+        out.flush()
+        time.sleep(args.postprocess / 2)
+    if args.exit_code:
+        out.write("ERROR: fake failure\n")
+    else:
+        # Only the fields the app asks for; the template itself is not evaluated
+        for template, path in args.print_to_file:
+            if template.startswith("after_move:"):
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"id": f"fake{args.seed or 0}", "extractor_key": "Fake", "title": "Fake video",
+                                        "uploader": "Fake uploader", "filepath": "Fake video.mp4"}) + "\n")
+    out.flush()
+    sys.exit(args.exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# run_bench.py
+# Drive the Runner (or the whole App) with fake yt-dlp tasks and report throughput, UI lag, CPU and RSS
+#
+#   python bench/run_bench.py --tasks 8 --concurrent 4 --lines-per-sec 200
+#   xvfb-run python bench/run_bench.py --app --tasks 8 --concurrent 4 --cr --verbose-lines 3
+
+import argparse
+import json
+import os
+import queue as pyqueue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from runner import Runner, Task, DomainScheduler, BandwidthGovernor
+
+FAKE = Path(__file__).resolve().parent / "fake_ytdlp.py"
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def rss_bytes() -> int:
+    if psutil:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def children_cpu() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime
+
+class LagProbe:
+    """Measures how late periodic callbacks run on an event loop."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lags = []
+
+    def tick(self, expected: float):
+        self.lags.append(max(0.0, time.monotonic() - expected))
+
+    def report(self) -> dict:
+        if not self.lags:
+            return {"lag_avg_ms": None, "lag_p95_ms": None, "lag_max_ms": None}
+        lags = sorted(self.lags)
+        return {
+            "lag_avg_ms": round(statistics.mean(lags) * 1000, 2),
+            "lag_p95_ms": round(lags[int(len(lags) * 0.95) - 1 if len(lags) > 1 else 0] * 1000, 2),
+            "lag_max_ms": round(lags[-1] * 1000, 2),
+        }
+
+def fake_cmd(args, i: int):
+    cmd = [sys.executable, str(FAKE), "--lines-per-sec", str(args.lines_per_sec), "--duration", str(args.duration),
+           "--files", str(args.files), "--verbose-lines", str(args.verbose_lines), "--json-kb", str(args.json_kb),
+           "--postprocess", str(args.postprocess), "--fragments", str(args.fragments), "--seed", str(i)]
+    if args.cr:
+        cmd.append("--cr")
+    return cmd
+
+def make_tasks(args):
+    return [Task(f"fake {i + 1}", fake_cmd(args, i), domain=f"site{i % args.domains}.invalid") for i in range(args.tasks)]
+
+def configure(runner: Runner, args):
+    runner.max_concurrent = args.concurrent
+    runner.scheduler.configure(starts_per_minute=0, burst=1, max_per_domain=0)
+
+def bench_runner(args) -> dict:
+    """Runner only; a consumer thread stands in for the Tk event loop and its after(0) queue."""
+    events: "pyqueue.Queue" = pyqueue.Queue()
+    probe = LagProbe(args.heartbeat / 1000)
+    counts = {"lines": 0, "chars": 0, "task_events": 0}
+    console = []
+
+    def on_log(line):
+        events.put((console.append, line))
+
+    def on_task(task):
+        events.put((lambda t: counts.__setitem__("task_events", counts["task_events"] + 1), task))
+
+    runner = Runner(on_log=on_log, on_task=on_task, scheduler=DomainScheduler(), governor=BandwidthGovernor())
+    configure(runner, args)
+    tasks = make_tasks(args)
+    done = threading.Event()
+
+    def loop():
+        next_beat = time.monotonic() + probe.interval
+        while not done.is_set() or not events.empty():
+            timeout = max(0.0, next_beat - time.monotonic())
+            try:
+                fn, arg = events.get(timeout=timeout)
+                fn(arg)
+            except pyqueue.Empty:
+                pass
+            now = time.monotonic()
+            if now >= next_beat:
+                probe.tick(next_beat)
+                next_beat = now + probe.interval
+
+    consumer = threading.Thread(target=loop, daemon=True)
+    consumer.start()
+    for t in tasks:
+        runner.enqueue(t)
+    runner.start()
+    while any(t.status not in ("done", "error") for t in tasks):
+        time.sleep(0.05)
+    done.set()
+    consumer.join()
+    counts["lines"] = len(console)
+    counts["chars"] = sum(len(l) for l in console)
+    return dict(counts, **probe.report(), failed=sum(t.status == "error" for t in tasks))
+
+def bench_app(args) -> dict:
+    """The real App window; needs a display (use xvfb-run on headless machines)."""
+    from app import App, Config
+    from queueitem import QueueItem
+
+    tmp = Path(tempfile.mkdtemp(prefix="ytdlp-bench-"))
+    cfg = Config(tmp / "config.json")
+    cfg.update({"upd_check_on_start": False, "queue_max_concurrent": args.concurrent, "sched_domain_max_concurrent": 0,
+                "sched_domain_starts_per_min": 0, "queue_metrics_export": False})
+    app = App(cfg)
+    configure(app.runner, args)
+    probe = LagProbe(args.heartbeat / 1000)
+    counts = {"lines": 0}
+    on_log = app.runner.on_log
+
+    def counting_log(line):
+        counts["lines"] += 1
+        on_log(line)
+
+    app.runner.on_log = counting_log
+    tasks = make_tasks(args)
+    columns = app.tree["columns"]
+    for t in tasks:
+        known = {"#": 0, "Website": t.domain, "Media title": t.label, "Status": "Queued"}
+        values = [known.get(col, "") for col in columns]
+        t.gui_id = app.tree.insert("", "end", values=values)
+        app.queue_data[t.gui_id] = item = QueueItem(t.label)
+        item.task = t
+
+    def beat(expected):
+        probe.tick(expected)
+        if all(t.status in ("done", "error") for t in tasks):
+            app.after(200, app.destroy)
+            return
+        app.after(int(probe.interval * 1000), beat, time.monotonic() + probe.interval)
+
+    def begin():
+        for t in tasks:
+            app.runner.enqueue(t)
+        app.runner.start()
+        beat(time.monotonic())
+
+    app.after(500, begin)
+    app.mainloop()
+    return dict(counts, **probe.report(), failed=sum(t.status == "error" for t in tasks))
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark the download pipeline with fake yt-dlp processes.")
+    p.add_argument("--app", action="store_true", help="drive the real App window instead of the Runner alone")
+    p.add_argument("--tasks", type=int, default=8)
+    p.add_argument("--concurrent", type=int, default=4)
+    p.add_argument("--domains", type=int, default=4, help="spread tasks over this many fake websites")
+    p.add_argument("--lines-per-sec", type=float, default=100)
+    p.add_argument("--duration", type=float, default=3)
+    p.add_argument("--files", type=int, default=2)
+    p.add_argument("--verbose-lines", type=int, default=0)
+    p.add_argument("--json-kb", type=int, default=0)
+    p.add_argument("--fragments", type=int, default=0)
+    p.add_argument("--postprocess", type=float, default=0)
+    p.add_argument("--cr", action="store_true")
+    p.add_argument("--heartbeat", type=float, default=50, help="event-loop probe interval in ms")
+    p.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = p.parse_args()
+
+    cpu0, wall0 = time.process_time(), time.monotonic()
+    result = bench_app(args) if args.app else bench_runner(args)
+    wall = time.monotonic() - wall0
+    result.update({
+        "mode": "app" if args.app else "runner",
+        "wall_s": round(wall, 2),
+        "lines_per_s": round(result["lines"] / wall, 1) if wall else None,
+        "cpu_self_s": round(time.process_time() - cpu0, 2),
+        "cpu_children_s": round(children_cpu(), 2),
+        "rss_mib": round(rss_bytes() / 1024 / 1024, 1),
+    })
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:>16}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# dedupe.py
+# Background detection of duplicate downloads, optionally replaced by hardlinks or reflinks
+
+import hashlib
+import os
+import queue as pyqueue
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from library import MediaLibrary
+
+PARTIAL_BLOCK = 64 * 1024
+MODES = ("off", "report", "hardlink", "reflink")
+# Linux FICLONE ioctl (btrfs, XFS, bcachefs)
+_FICLONE = 0x40049409
+
+def partial_hash(path: str, size: int) -> str:
+    """Hash of the size and three 64 KiB blocks (start, middle, end); cheap and good at telling files apart."""
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - PARTIAL_BLOCK // 2), max(0, size - PARTIAL_BLOCK)}):
+            f.seek(offset)
+            h.update(f.read(PARTIAL_BLOCK))
+    return h.hexdigest()
+
+def full_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _reflink(src: str, dst: str):
+    import fcntl
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+
+class Deduper:
+    """Checks finished files against the library for duplicates, `workers` files at a time.
+
+    A file is compared with other files of the same video and with any file of
+    the same size and partial hash; only a matching full hash makes it a
+    duplicate. Duplicates are logged to `log_path` and, in hardlink/reflink
+    mode, the newer copy is replaced by a link to the older one. Same video
+    with different content is only reported. Each disk is read by one worker
+    at a time, so hashing does not thrash a drive that is also being written.
+    """
+
+    def __init__(self, library: MediaLibrary, log_path: Path, mode: str = "report", workers: int = 1, backlog: int = 1000):
+        self.library = library
+        self.log_path = log_path
+        self.mode = mode
+        self._queue: "pyqueue.Queue[str]" = pyqueue.Queue(maxsize=backlog)
+        self._disk_locks: Dict[int, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self.saved_bytes = 0
+        for _ in range(max(1, workers)):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, filepath: str) -> bool:
+        """Queue a file for checking; returns False if the backlog is full."""
+        if self.mode == "off":
+            return False
+        try:
+            self._queue.put_nowait(os.path.abspath(filepath))
+            return True
+        except pyqueue.Full:
+            return False
+
+    def _work(self):
+        while True:
+            path = self._queue.get()
+            try:
+                self.check(path)
+            except Exception as e:
+                self._log(f"ERROR checking {path}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _disk_lock(self, st: os.stat_result) -> threading.Lock:
+        with self._locks_lock:
+            return self._disk_locks.setdefault(st.st_dev, threading.Lock())
+
+    def _hashes(self, path: str, want_full: bool) -> Optional[dict]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        cached = self.library.get_hash(path, st.st_size, st.st_mtime_ns)
+        if cached and (cached["full"] or not want_full):
+            return dict(cached, st=st)
+        with self._disk_lock(st):
+            partial = cached["partial"] if cached else partial_hash(path, st.st_size)
+            full = full_hash(path) if want_full else None
+        self.library.set_hash(path, st.st_size, st.st_mtime_ns, partial, full)
+        return {"filepath": path, "size": st.st_size, "partial": partial, "full": full, "st": st}
+
+    def check(self, path: str):
+        mine = self._hashes(path, want_full=False)
+        if mine is None:
+            return
+        candidates = set(self.library.same_partial(mine["size"], mine["partial"]))
+        video = self.library.video_of_path(path)
+        same_video = set(self.library.paths_of_video(video["extractor"], video["video_id"])) if video else set()
+        candidates |= same_video
+        candidates.discard(path)
+
+        for other in sorted(candidates):
+            theirs = self._hashes(other, want_full=False)
+            if theirs is None:
+                continue
+            if mine["st"].st_dev == theirs["st"].st_dev and mine["st"].st_ino == theirs["st"].st_ino:
+                continue  # already linked
+            if theirs["size"] == mine["size"] and theirs["partial"] == mine["partial"]:
+                mine = self._hashes(path, want_full=True)
+                theirs = self._hashes(other, want_full=True)
+                if mine and theirs and mine["full"] == theirs["full"]:
+                    self._duplicate(keep=other, dup=path, size=mine["size"])
+                    return
+            if other in same_video:
+                self._log(f"SAME VIDEO, different file: {path} | {other}")
+
+    def _duplicate(self, keep: str, dup: str, size: int):
+        action = "reported"
+        if self.mode in ("hardlink", "reflink"):
+            tmp = f"{dup}.dedupe-tmp"
+            try:
+                if self.mode == "hardlink":
+                    os.link(keep, tmp)
+                else:
+                    _reflink(keep, tmp)
+                os.replace(tmp, dup)
+                self.saved_bytes += size
+                action = self.mode + "ed"
+            except (OSError, ImportError) as e:
+                action = f"not linked ({e})"
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+        self._log(f"DUPLICATE {size} bytes, {action}: {dup} == {keep}")
+
+    def _log(self, line: str):
+        try:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(f"{datetime.now().isoformat(timespec='seconds')} {line}\n")
+        except OSError as e:
+            print(f"Could not write {self.log_path}: {e}")
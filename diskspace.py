@@ -0,0 +1,100 @@
+# diskspace.py
+# Admission control on free disk space, so a full disk holds the queue back instead of failing it
+
+import os
+import shutil
+import time
+from typing import Dict, Optional, Tuple
+
+def _existing(path: str) -> str:
+    """The folder itself or, if it does not exist yet, its nearest existing parent (where yt-dlp will create it)."""
+    probe = os.path.abspath(path)
+    while not os.path.exists(probe) and os.path.dirname(probe) != probe:
+        probe = os.path.dirname(probe)
+    return probe
+
+class DiskBudget:
+    """Tracks the space running tasks have committed on each filesystem.
+
+    A task lists the folders it writes to with the bytes it needs there at its
+    peak (`disk_needs`, download plus merge/post-processing headroom). It may
+    start when, on every filesystem involved, the free space minus what running
+    tasks still have to write minus `reserve` covers its need. A task of unknown
+    size lists its folders with a need of 0, so it only waits while one of them
+    is below the reserve. Free space is re-read at most every `refresh` seconds.
+    """
+
+    def __init__(self, reserve: int = 1024 ** 3, refresh: float = 2.0):
+        self.reserve = reserve
+        self.refresh = refresh
+        # st_dev -> {task id: (task, bytes needed on that filesystem)}
+        self.committed: Dict[int, Dict[int, Tuple[object, int]]] = {}
+        self._devices: Dict[str, Optional[int]] = {}
+        self._free: Dict[int, Tuple[float, int]] = {}
+
+    def _device(self, path: str) -> Optional[int]:
+        if path not in self._devices:
+            try:
+                self._devices[path] = os.stat(_existing(path)).st_dev
+            except OSError:
+                self._devices[path] = None
+        return self._devices[path]
+
+    def free(self, path: str) -> Optional[int]:
+        dev = self._device(path)
+        if dev is None:
+            return None
+        now = time.monotonic()
+        cached = self._free.get(dev)
+        if cached and now - cached[0] < self.refresh:
+            return cached[1]
+        try:
+            free = shutil.disk_usage(_existing(path)).free
+        except OSError:
+            return None
+        self._free[dev] = (now, free)
+        return free
+
+    @staticmethod
+    def _written(task) -> float:
+        return task.metrics.bytes + task.metrics.file_bytes
+
+    def outstanding(self, dev: int) -> int:
+        """Bytes running tasks on a filesystem are still expected to write."""
+        total = 0
+        for task, need in self.committed.get(dev, {}).values():
+            all_needs = sum(task.disk_needs.values()) or 1
+            # Bytes already written are spread over the task's filesystems in proportion to their needs
+            total += max(0, int(need - self._written(task) * need / all_needs))
+        return total
+
+    def _needs_by_device(self, task) -> Dict[int, Tuple[str, int]]:
+        needs: Dict[int, Tuple[str, int]] = {}
+        for path, need in task.disk_needs.items():
+            dev = self._device(path)
+            if dev is not None:
+                prev = needs.get(dev, (path, 0))[1]
+                needs[dev] = (path, prev + int(need))
+        return needs
+
+    def check(self, task) -> Tuple[bool, Optional[str]]:
+        """Return (may_start, reason_if_not)."""
+        for dev, (path, need) in self._needs_by_device(task).items():
+            free = self.free(path)
+            if free is None:
+                continue
+            available = free - self.outstanding(dev) - self.reserve
+            if need > available:
+                return False, (f"needs {need / 1024 ** 3:.2f} GiB in {path}, "
+                               f"{max(0, available) / 1024 ** 3:.2f} GiB available above the reserve")
+        return True, None
+
+    def started(self, task):
+        for dev, (_, need) in self._needs_by_device(task).items():
+            self.committed.setdefault(dev, {})[id(task)] = (task, need)
+        self._free.clear()
+
+    def finished(self, task):
+        for tasks in self.committed.values():
+            tasks.pop(id(task), None)
+        self._free.clear()
@@ -0,0 +1,352 @@
+# formats.py
+# Offline evaluation of yt-dlp format selectors against an item's cached formats list
+
+import re
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+# Per-format fields kept on each queue item, in tuple order
+FORMAT_FIELDS = ("format_id", "ext", "vcodec", "acodec", "width", "height", "fps", "tbr", "abr", "vbr", "asr", "audio_channels",
+                 "filesize", "filesize_approx", "format_note", "protocol", "language")
+_INTERNED = ("ext", "vcodec", "acodec", "format_note", "protocol", "language")
+_ROUNDED = ("fps", "tbr", "abr", "vbr")
+
+NUMERIC_KEYS = {"width", "height", "fps", "tbr", "abr", "vbr", "asr", "filesize", "filesize_approx", "audio_channels"}
+# Short options that take a value and may have it attached (-f18)
+_SHORT_VALUE_OPTIONS = ("-f", "-S")
+_AUDIO_EXTS = ("m4a", "mp3", "ogg", "aac")
+_VIDEO_EXTS = ("mp4", "flv", "webm", "3gp")
+_MP4_FAMILY = {"mp3", "mp4", "m4a", "m4p", "m4b", "m4r", "m4v", "ismv", "isma", "mov"}
+_WEBM_FAMILY = {"webm", "weba"}
+
+_FILTER_RE = re.compile(r"^\s*(?P<key>[\w.-]+)\s*(?P<neg>!)?(?P<op><=|>=|<|>|=|\^=|\$=|\*=|~=)(?P<opt>\?)?\s*(?P<value>.*?)\s*$")
+_ATOM_RE = re.compile(r"^(?P<name>b|best|w|worst|bv|bestvideo|wv|worstvideo|ba|bestaudio|wa|worstaudio)(?P<star>\*)?(?:\.(?P<n>\d+))?$")
+_SIZE_UNITS = {"": 1, "b": 1, "k": 1000, "m": 1000 ** 2, "g": 1000 ** 3, "t": 1000 ** 4,
+               "ki": 1024, "mi": 1024 ** 2, "gi": 1024 ** 3, "ti": 1024 ** 4}
+_NUMBER_RE = re.compile(r"^(?P<num>\d+(?:\.\d+)?)\s*(?P<unit>[kmgt]i?)?b?$", re.I)
+
+def compact_formats(data: dict) -> Tuple[tuple, ...]:
+    """The formats of a --dump-json document as small tuples of FORMAT_FIELDS (storyboards dropped)."""
+    out = []
+    for f in data.get("formats") or ():
+        if not isinstance(f, dict) or (f.get("vcodec") == "none" and f.get("acodec") == "none"):
+            continue
+        row = []
+        for key in FORMAT_FIELDS:
+            value = f.get(key)
+            if key in _INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            elif key in _ROUNDED and isinstance(value, float):
+                value = round(value, 1)
+            row.append(value)
+        out.append(tuple(row))
+    return tuple(out)
+
+def split_option(arg: str) -> Tuple[str, Optional[str]]:
+    """(flag, attached value) of one argument: "--format=18" and "-f18" give ("--format", "18") and ("-f", "18")."""
+    if arg.startswith("--") and "=" in arg:
+        flag, value = arg.split("=", 1)
+        return flag, value
+    if arg[:2] in _SHORT_VALUE_OPTIONS and len(arg) > 2:
+        return arg[:2], arg[2:]
+    return arg, None
+
+def expand_formats(formats: Sequence[tuple]) -> List[dict]:
+    return [dict(zip(FORMAT_FIELDS, row)) for row in formats]
+
+def format_size(f: dict, duration: Optional[float]) -> Tuple[Optional[int], bool]:
+    """(bytes, exact) for one format: filesize, else filesize_approx, else bitrate x duration."""
+    if f.get("filesize"):
+        return int(f["filesize"]), True
+    if f.get("filesize_approx"):
+        return int(f["filesize_approx"]), False
+    if f.get("tbr") and duration:
+        return int(f["tbr"] * 1000 / 8 * duration), False
+    return None, False
+
+def _parse_number(value: str) -> Optional[float]:
+    m = _NUMBER_RE.match(value.strip())
+    if not m:
+        return None
+    return float(m.group("num")) * _SIZE_UNITS[(m.group("unit") or "").lower()]
+
+class _Filter:
+    def __init__(self, text: str):
+        m = _FILTER_RE.match(text)
+        if not m:
+            raise ValueError(f"invalid format filter [{text}]")
+        self.key, self.op, self.value = m.group("key"), m.group("op"), m.group("value")
+        if self.key not in FORMAT_FIELDS:
+            # Not kept on queue items, so it would never match
+            raise ValueError(f"filter on {self.key} cannot be evaluated before downloading")
+        self.negate = bool(m.group("neg"))
+        self.optional = bool(m.group("opt"))
+        self.number = None
+        if self.key in NUMERIC_KEYS or self.op in ("<", "<=", ">", ">="):
+            self.number = _parse_number(self.value)
+            if self.number is None:
+                raise ValueError(f"invalid number in format filter [{text}]")
+        elif self.op == "~=":
+            self.regex = re.compile(self.value)
+
+    def __call__(self, f: dict) -> bool:
+        actual = f.get(self.key)
+        if actual is None:
+            return self.optional
+        if self.number is not None:
+            try:
+                actual = float(actual)
+            except (TypeError, ValueError):
+                return self.optional
+            result = {"<": actual < self.number, "<=": actual <= self.number, ">": actual > self.number,
+                      ">=": actual >= self.number, "=": actual == self.number}[self.op]
+        else:
+            actual = str(actual)
+            if self.op == "=":
+                result = actual == self.value
+            elif self.op == "^=":
+                result = actual.startswith(self.value)
+            elif self.op == "$=":
+                result = actual.endswith(self.value)
+            elif self.op == "*=":
+                result = self.value in actual
+            else:
+                result = self.regex.search(actual) is not None
+        return result != self.negate
+
+def _tokenize(spec: str) -> List[str]:
+    tokens, i = [], 0
+    while i < len(spec):
+        c = spec[i]
+        if c.isspace():
+            i += 1
+        elif c in "/+,()":
+            tokens.append(c)
+            i += 1
+        elif c == "[":
+            end = spec.find("]", i)
+            if end < 0:
+                raise ValueError("unclosed [ in format selector")
+            tokens.append(spec[i:end + 1])
+            i = end + 1
+        else:
+            start = i
+            while i < len(spec) and spec[i] not in "/+,()[" and not spec[i].isspace():
+                i += 1
+            tokens.append(spec[start:i])
+    return tokens
+
+class _Parser:
+    """Recursive descent over ',' (all of), '/' (first that matches), '+' (merge), atoms with [filters]."""
+
+    def __init__(self, spec: str):
+        self.tokens = _tokenize(spec)
+        self.pos = 0
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse(self):
+        node = self._all()
+        if self._peek() is not None:
+            raise ValueError(f"unexpected {self._peek()!r} in format selector")
+        return node
+
+    def _all(self):
+        parts = [self._alternatives()]
+        while self._peek() == ",":
+            self.pos += 1
+            parts.append(self._alternatives())
+        return ("all", parts) if len(parts) > 1 else parts[0]
+
+    def _alternatives(self):
+        parts = [self._merge()]
+        while self._peek() == "/":
+            self.pos += 1
+            parts.append(self._merge())
+        return ("alt", parts) if len(parts) > 1 else parts[0]
+
+    def _merge(self):
+        parts = [self._item()]
+        while self._peek() == "+":
+            self.pos += 1
+            parts.append(self._item())
+        return ("merge", parts) if len(parts) > 1 else parts[0]
+
+    def _item(self):
+        tok = self._peek()
+        if tok is None or tok in ("/", "+", ",", ")"):
+            raise ValueError("format selector is incomplete")
+        self.pos += 1
+        if tok == "(":
+            node = self._all()
+            if self._peek() != ")":
+                raise ValueError("unclosed ( in format selector")
+            self.pos += 1
+        elif tok.startswith("["):
+            # A bare filter applies to "best"
+            self.pos -= 1
+            node = ("atom", "b")
+        else:
+            node = ("atom", tok)
+        filters = []
+        while self._peek() and self._peek().startswith("["):
+            filters.append(_Filter(self._peek()[1:-1]))
+            self.pos += 1
+        return ("filtered", node, filters) if filters else node
+
+def _select_atom(name: str, formats: List[dict]) -> List[tuple]:
+    if name in ("all", "mergeall"):
+        return [tuple(formats)] if name == "mergeall" and formats else [(f,) for f in formats]
+    m = _ATOM_RE.match(name)
+    if m:
+        kind = m.group("name")
+        worst = kind[0] == "w"
+        video = kind in ("bv", "bestvideo", "wv", "worstvideo")
+        audio = kind in ("ba", "bestaudio", "wa", "worstaudio")
+        star = bool(m.group("star"))
+        if video:
+            test = (lambda f: f.get("vcodec") != "none") if star else (lambda f: f.get("vcodec") != "none" and f.get("acodec") == "none")
+        elif audio:
+            test = (lambda f: f.get("acodec") != "none") if star else (lambda f: f.get("acodec") != "none" and f.get("vcodec") == "none")
+        else:
+            test = (lambda f: True) if star else (lambda f: f.get("vcodec") != "none" and f.get("acodec") != "none")
+        matches = [f for f in formats if test(f)]
+        if not worst:
+            matches.reverse()
+        n = int(m.group("n") or 1)
+        return [(matches[n - 1],)] if len(matches) >= n else []
+    if name in _AUDIO_EXTS:
+        matches = [f for f in formats if f.get("ext") == name and f.get("acodec") != "none"]
+    elif name in _VIDEO_EXTS:
+        matches = [f for f in formats if f.get("ext") == name and f.get("acodec") != "none" and f.get("vcodec") != "none"]
+    else:
+        matches = [f for f in formats if f.get("format_id") == name]
+    return [(matches[-1],)] if matches else []
+
+def _evaluate(node, formats: List[dict]) -> List[tuple]:
+    kind = node[0]
+    if kind == "atom":
+        return _select_atom(node[1], formats)
+    if kind == "filtered":
+        _, inner, filters = node
+        return _evaluate(inner, [f for f in formats if all(flt(f) for flt in filters)])
+    if kind == "alt":
+        for part in node[1]:
+            picked = _evaluate(part, formats)
+            if picked:
+                return picked
+        return []
+    if kind == "merge":
+        merged: List[dict] = []
+        for part in node[1]:
+            picked = _evaluate(part, formats)
+            if not picked:
+                return []
+            merged.extend(picked[0])
+        return [tuple(merged)]
+    return [pick for part in node[1] for pick in _evaluate(part, formats)]
+
+def select(spec: str, formats: List[dict]) -> List[tuple]:
+    """The formats yt-dlp would pick for `spec`, one tuple per download (several for ',' or 'all').
+
+    Relies on `formats` being in yt-dlp's own order, worst first, as --dump-json
+    writes them; a -S sort order is not re-applied.
+    """
+    return _evaluate(_Parser(spec).parse(), formats)
+
+class FormatPlan:
+    """What a yt-dlp command line asks for, as far as format selection and the final container go."""
+
+    def __init__(self, cmd: Sequence[str]):
+        self.spec: Optional[str] = None
+        self.sorted = False
+        self.extract_audio = False
+        self.keep_video = False
+        self.audio_format: Optional[str] = None
+        self.merge_format: Optional[str] = None
+        self.remux: Optional[str] = None
+        args = list(cmd)
+        for i, arg in enumerate(args):
+            arg, value = split_option(arg)
+            if value is None:
+                value = args[i + 1] if i + 1 < len(args) else None
+            if arg in ("-f", "--format"):
+                self.spec = value
+            elif arg in ("-S", "--format-sort"):
+                self.sorted = True
+            elif arg in ("-x", "--extract-audio"):
+                self.extract_audio = True
+            elif arg in ("-k", "--keep-video"):
+                self.keep_video = True
+            elif arg == "--audio-format":
+                self.audio_format = value
+            elif arg == "--merge-output-format":
+                self.merge_format = value
+            elif arg in ("--remux-video", "--recode-video"):
+                self.remux = value
+        if self.spec is None:
+            # yt-dlp's defaults, assuming ffmpeg is available for merging
+            self.spec = "bestaudio/best" if self.extract_audio and not self.keep_video else "bv*+ba/b"
+
+    def final_ext(self, pick: tuple) -> Optional[str]:
+        if self.extract_audio and self.audio_format and self.audio_format != "best":
+            return self.audio_format
+        exts = [f.get("ext") for f in pick]
+        if len(pick) > 1:
+            if self.merge_format:
+                ext = self.merge_format.split("/")[0]
+            elif set(exts) <= _MP4_FAMILY:
+                ext = exts[0]
+            elif set(exts) <= _WEBM_FAMILY:
+                ext = "webm"
+            else:
+                ext = "mkv"
+        else:
+            ext = exts[0] if exts else None
+        if self.remux and not self.extract_audio:
+            ext = _remux_target(self.remux, ext)
+        return ext
+
+def _remux_target(rules: str, ext: Optional[str]) -> Optional[str]:
+    for rule in rules.split("/"):
+        if ">" not in rule:
+            return rule.strip()
+        sources, target = rule.split(">", 1)
+        if ext in [s.strip() for s in sources.split(",")]:
+            return target.strip()
+    return ext
+
+class Choice:
+    """The format(s) a command would download for one item, with the expected size."""
+    __slots__ = ("format_id", "ext", "vcodec", "acodec", "resolution", "size", "exact", "approximate")
+
+    def __init__(self, picks: List[tuple], plan: FormatPlan, duration: Optional[float]):
+        fmts = [f for pick in picks for f in pick]
+        self.format_id = ",".join("+".join(str(f.get("format_id")) for f in pick) for pick in picks)
+        self.ext = ",".join(filter(None, (plan.final_ext(pick) for pick in picks))) or None
+        self.vcodec = next((f["vcodec"] for f in fmts if f.get("vcodec") not in (None, "none")), None)
+        self.acodec = next((f["acodec"] for f in fmts if f.get("acodec") not in (None, "none")), None)
+        video = next((f for f in fmts if f.get("vcodec") != "none" and f.get("height")), None)
+        if video:
+            fps = f"{video['fps']:g}" if video.get("fps") and video["fps"] > 30 else ""
+            self.resolution = f"{video['height']}p{fps}"
+        else:
+            self.resolution = "audio only" if self.acodec else None
+        sizes = [format_size(f, duration) for f in fmts]
+        known = [s for s, _ in sizes if s]
+        self.size: Optional[int] = sum(known) if known else None
+        self.exact = bool(sizes) and all(exact for _, exact in sizes)
+        # -S is not re-applied and audio conversion changes the size: the result is an estimate
+        self.approximate = plan.sorted or plan.extract_audio
+
+    @property
+    def note(self) -> str:
+        parts = [p for p in (self.resolution, self.vcodec, self.acodec) if p]
+        return ", ".join(parts)
+
+def choose(cmd: Sequence[str], formats: Sequence[tuple], duration: Optional[float]) -> Optional[Choice]:
+    """Evaluate the format selection of a yt-dlp command against compact formats; None if nothing matches."""
+    plan = FormatPlan(cmd)
+    picks = select(plan.spec, expand_formats(formats))
+    return Choice(picks, plan, duration) if picks else None
@@ -0,0 +1,98 @@
+# fragments.py
+# Adaptive --concurrent-fragments per website
+
+from typing import Dict, Optional
+
+class _DomainState:
+    __slots__ = ("n", "direction", "count", "cooldown", "scores", "good", "floor")
+
+    def __init__(self, n: int, floor: int):
+        self.n = n
+        # Last count that ran without throttling, and the count unmeasured probes may not go below
+        self.good = 0
+        self.floor = floor
+        self.direction = 1
+        self.count = 0
+        self.cooldown = 0
+        self.scores: Dict[int, float] = {}
+
+class FragmentTuner:
+    """Hill-climbs the fragment concurrency of each website on measured throughput.
+
+    Every finished fragmented download reports its average speed at the fragment
+    count it ran with. After `samples` reports at the current count the tuner tries
+    the next count in its direction (doubling or halving), and goes back if the count
+    it came from was more than 5% faster. Throttling (HTTP 429, failed fragments)
+    halves the count at once, but not below the last count that ran unthrottled,
+    and pauses upward probing; counts without a measured speed below that floor
+    are not tried, so the tuner climbs back instead of sinking to min_n.
+    Upward probing is also skipped while the whole link is saturated, since more
+    fragments cannot help then.
+    """
+
+    def __init__(self, initial: int = 5, min_n: int = 1, max_n: int = 32, samples: int = 2, alpha: float = 0.5):
+        self.initial = initial
+        self.min_n = min_n
+        self.max_n = max_n
+        self.samples = samples
+        self.alpha = alpha
+        self.states: Dict[str, _DomainState] = {}
+
+    def _state(self, domain: str) -> _DomainState:
+        st = self.states.get(domain)
+        if st is None:
+            st = self.states[domain] = _DomainState(max(self.min_n, min(self.max_n, self.initial)), self.min_n)
+        return st
+
+    def choose(self, domain: str) -> int:
+        return self._state(domain).n
+
+    def _step(self, n: int, direction: int) -> int:
+        n = n * 2 if direction > 0 else n // 2
+        return max(self.min_n, min(self.max_n, n))
+
+    def record(self, domain: str, n: int, speed: Optional[float], throttled: bool = False, saturated: bool = False):
+        st = self._state(domain)
+        if throttled:
+            # Measured again once probing resumes
+            st.scores.pop(n, None)
+            below = min(st.n, n)
+            st.floor = st.good if st.good and st.good < below else self.min_n
+            st.n = max(st.floor, below // 2)
+            st.direction = -1
+            st.count = 0
+            st.cooldown = 3
+            return
+        if not speed:
+            return
+        st.good = n
+        prev = st.scores.get(n)
+        st.scores[n] = speed if prev is None else self.alpha * speed + (1 - self.alpha) * prev
+        if n != st.n:
+            return
+        st.count += 1
+        if st.count < self.samples:
+            return
+        st.count = 0
+        if st.cooldown:
+            st.cooldown -= 1
+        back = self._step(n, -st.direction)
+        back_score = st.scores.get(back)
+        if back != n and back_score is not None and back_score > st.scores[n] * 1.05:
+            st.n = back
+            st.direction = -st.direction
+            return
+        if st.direction > 0 and (st.cooldown or saturated):
+            return
+        candidate = self._step(n, st.direction)
+        if candidate == n:
+            st.direction = -st.direction
+            return
+        cand_score = st.scores.get(candidate)
+        if cand_score is None and candidate < st.floor:
+            st.direction = -st.direction
+            return
+        if cand_score is None or cand_score > st.scores[n] * 1.05:
+            st.n = candidate
+        else:
+            st.direction = -st.direction
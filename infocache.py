@@ -0,0 +1,61 @@
+# infocache.py
+# On-disk cache of the info JSON fetched for queue items
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+class InfoJsonCache:
+    """Stores one `--dump-json` document per item so yt-dlp can reuse it via --load-info-json."""
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+
+    @staticmethod
+    def key_for(data: dict, url: str = "") -> str:
+        ident = f"{data.get('extractor_key', '')}-{data.get('id', '')}" if data.get('id') else url
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.folder / f"{key}.info.json"
+
+    def store(self, key: str, data: dict) -> Optional[Path]:
+        path = self.path(key)
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data), encoding="utf-8")
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Could not write info JSON cache {path}: {e}")
+            return None
+        return path
+
+    def load(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads(self.path(key).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def discard(self, key: str):
+        try:
+            self.path(key).unlink()
+        except OSError:
+            pass
+
+    def prune(self, max_age: float):
+        """Delete cache files older than max_age seconds."""
+        cutoff = time.time() - max_age
+        try:
+            entries = list(os.scandir(self.folder))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith(".info.json") and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
@@ -0,0 +1,400 @@
+# jobstore.py
+# Shared SQLite job queue that several GUI or headless instances claim downloads from, with leases
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from formats import split_option
+from runner import Runner, Task
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    label TEXT NOT NULL,
+    url TEXT,
+    args TEXT NOT NULL,
+    domain TEXT,
+    archive_key TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    returncode INTEGER,
+    error TEXT,
+    added_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS nodes (
+    name TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL,
+    running INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS archive (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    node TEXT,
+    added_at REAL NOT NULL
+);
+"""
+
+# Options naming files or credentials of one machine, and whether they take a value. Jobs are
+# stored without them; each node adds its own (download folder, ffmpeg, cookies) when it runs one.
+LOCAL_FLAGS = {
+    "-o": True, "--output": True, "-P": True, "--paths": True, "--cookies": True, "--cookies-from-browser": True,
+    "--ffmpeg-location": True, "--windows-filenames": False, "--batch-file": True, "-a": True,
+    "--config-locations": True, "--cache-dir": True,
+}
+
+def split_local(args: List[str]) -> Tuple[List[str], List[str]]:
+    """Split yt-dlp arguments into (portable, machine-local) ones, see LOCAL_FLAGS.
+
+    An output template is portable while it is relative.
+    """
+    portable, local, i = [], [], 0
+    while i < len(args):
+        flag, value = split_option(args[i])
+        n = 2 if LOCAL_FLAGS.get(flag) and value is None else 1
+        if n == 2 and i + 1 < len(args):
+            value = args[i + 1]
+        is_local = flag in LOCAL_FLAGS and not (flag in ("-o", "--output") and value and not os.path.isabs(value))
+        (local if is_local else portable).extend(args[i:i + n])
+        i += n
+    return portable, local
+
+def job_args(args: List[str], template: str) -> List[str]:
+    """Arguments to store for a job: the portable ones, writing to `template` under the node's folder."""
+    portable = split_local(args)[0]
+    if any(split_option(arg)[0] in ("-o", "--output") for arg in portable):
+        return portable
+    return portable + ["-o", template]
+
+def default_node_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def archive_key(extractor: Optional[str], video_id: Optional[str]) -> Optional[str]:
+    """A video's line in a yt-dlp --download-archive file."""
+    if not extractor or not video_id:
+        return None
+    return f"{extractor.lower()} {video_id}"
+
+class JobStore:
+    """Jobs, nodes and the shared download archive in one SQLite file.
+
+    A claimed job is leased to its node until lease_until; the node extends the
+    lease with heartbeats. Any node claiming work first puts jobs with expired
+    leases back in the queue, so jobs of a dead node are picked up again; a job
+    that lost its lease max_attempts times fails. The file can live on a shared
+    volume: it uses a rollback journal (WAL needs shared memory, which network
+    filesystems lack) and lease times are wall-clock, so node clocks must agree
+    to well within the lease.
+    """
+
+    def __init__(self, path: Path, node: Optional[str] = None, lease: float = 60.0):
+        self.path = path
+        self.node = node or default_node_name()
+        self.lease = lease
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=DELETE")
+        self._db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _tx(self):
+        """One immediate (write-locking) transaction; other nodes wait on the file lock."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def add(self, args: List[str], url: str = "", label: str = "", domain: str = "",
+            archive: Optional[str] = None, max_attempts: int = 3) -> int:
+        """Queue a download; args is the yt-dlp command line without the executable."""
+        with self._tx() as db:
+            cur = db.execute(
+                "INSERT INTO jobs (label, url, args, domain, archive_key, max_attempts, added_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (label or url, url, json.dumps(args), domain, archive, max_attempts, time.time()),
+            )
+            return cur.lastrowid
+
+    def claim(self, limit: int = 1) -> List[Dict]:
+        """Lease up to `limit` queued jobs to this node, oldest first."""
+        now = time.time()
+        claimed = []
+        with self._tx() as db:
+            db.execute("UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL, attempts = attempts + 1 "
+                       "WHERE status = 'leased' AND lease_until < ?", (now,))
+            db.execute("UPDATE jobs SET status = 'error', error = 'lease expired too often', finished_at = ? "
+                       "WHERE status = 'queued' AND attempts >= max_attempts", (now,))
+            while len(claimed) < limit:
+                rows = db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT ?", (limit - len(claimed),)).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    if row["archive_key"] and db.execute("SELECT 1 FROM archive WHERE key = ?", (row["archive_key"],)).fetchone():
+                        db.execute("UPDATE jobs SET status = 'skipped', finished_at = ? WHERE id = ?", (now, row["id"]))
+                        continue
+                    db.execute("UPDATE jobs SET status = 'leased', owner = ?, lease_until = ? WHERE id = ?",
+                               (self.node, now + self.lease, row["id"]))
+                    job = dict(row)
+                    job["args"] = json.loads(job["args"])
+                    claimed.append(job)
+            self._seen(db, now)
+        return claimed
+
+    def heartbeat(self, ids: Iterable[int]) -> List[int]:
+        """Extend the leases of this node's jobs; returns the ids it no longer holds."""
+        ids = list(ids)
+        now = time.time()
+        lost = []
+        with self._tx() as db:
+            for job_id in ids:
+                cur = db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                                 (now + self.lease, job_id, self.node))
+                if not cur.rowcount:
+                    lost.append(job_id)
+            self._seen(db, now, running=len(ids) - len(lost))
+        return lost
+
+    def finish(self, job_id: int, status: str, returncode: Optional[int] = None, error: Optional[str] = None,
+               archive: Iterable[str] = ()) -> bool:
+        """Record the outcome of a job this node ran, and add its videos to the shared archive.
+
+        A job whose lease expired is still recorded unless another node has claimed it since.
+        """
+        now = time.time()
+        with self._tx() as db:
+            cur = db.execute(
+                "UPDATE jobs SET status = ?, returncode = ?, error = ?, finished_at = ?, owner = ?, lease_until = NULL "
+                "WHERE id = ? AND (owner = ? OR (owner IS NULL AND status = 'queued'))",
+                (status, returncode, error, now, self.node, job_id, self.node),
+            )
+            db.executemany("INSERT OR IGNORE INTO archive (key, node, added_at) VALUES (?, ?, ?)",
+                           [(key, self.node, now) for key in archive])
+            return cur.rowcount > 0
+
+    def release(self, job_id: int):
+        """Give a job back to the queue without counting an attempt (e.g. the node is shutting down)."""
+        with self._tx() as db:
+            db.execute("UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL "
+                       "WHERE id = ? AND owner = ? AND status = 'leased'", (job_id, self.node))
+
+    def _seen(self, db, now: float, running: Optional[int] = None):
+        db.execute("INSERT INTO nodes (name, last_seen, running) VALUES (?, ?, ?) "
+                   "ON CONFLICT (name) DO UPDATE SET last_seen = excluded.last_seen, running = COALESCE(?, running)",
+                   (self.node, now, running or 0, running))
+
+    def archive_since(self, last_id: int) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute("SELECT id, key FROM archive WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+
+    def add_archive(self, keys: Iterable[str]):
+        now = time.time()
+        with self._tx() as db:
+            db.executemany("INSERT OR IGNORE INTO archive (key, node, added_at) VALUES (?, ?, ?)",
+                           [(key, self.node, now) for key in keys])
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {r[0]: r[1] for r in self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+    def nodes(self) -> List[Dict]:
+        with self._lock:
+            return [dict(r) for r in self._db.execute("SELECT * FROM nodes ORDER BY last_seen DESC")]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class ArchiveMirror:
+    """Node-local copy of the shared archive, handed to yt-dlp as --download-archive.
+
+    sync() uploads lines yt-dlp appended locally and appends entries other
+    nodes added to the store, so every node skips what any node downloaded.
+    Only the part of the file after the last complete line read is uploaded.
+    """
+
+    def __init__(self, store: JobStore, path: Path):
+        self.store = store
+        self.path = path
+        self._last_id = 0
+        self._offset = 0
+        self._known: set = set()
+        self._lock = threading.Lock()
+
+    def _read_new(self) -> List[str]:
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < self._offset:
+                    # Replaced or truncated: read it again from the start
+                    self._offset = 0
+                    self._known.clear()
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        lines = [line.strip() for line in data[:end].decode("utf-8", errors="replace").splitlines()]
+        return [line for line in lines if line and line not in self._known]
+
+    def sync(self):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            local = self._read_new()
+            if local:
+                self.store.add_archive(local)
+                self._known.update(local)
+            rows = self.store.archive_since(self._last_id)
+            new = [r["key"] for r in rows if r["key"] not in self._known]
+            if new:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.writelines(key + "\n" for key in new)
+                self._known.update(new)
+            if rows:
+                self._last_id = rows[-1]["id"]
+
+class NodeWorker:
+    """Feeds jobs claimed from a JobStore to a Runner and reports them back.
+
+    local_args (this node's folder, ffmpeg, cookies; see LOCAL_FLAGS) are added
+    to every job, whose output template is relative to them. Keeps about as
+    many jobs claimed as the runner has download slots; every lease/3 seconds
+    it renews their leases, cancels the ones it lost, and records finished
+    ones. Runner-level retries happen inside the lease.
+    """
+
+    def __init__(self, store: JobStore, runner: Runner, ytdlp: str = "yt-dlp", archive: Optional[ArchiveMirror] = None,
+                 max_retries: int = 2, retry_sleep: float = 5, local_args: Optional[List[str]] = None):
+        self.store = store
+        self.runner = runner
+        self.ytdlp = ytdlp
+        self.local_args = list(local_args or [])
+        self.archive = archive
+        self.max_retries = max_retries
+        self.retry_sleep = retry_sleep
+        self.tasks: Dict[int, Task] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.step()
+            except sqlite3.Error as e:
+                self.runner.on_log(f"[JOBS] {self.store.path}: {e}\n")
+            self._stop.wait(max(1.0, self.store.lease / 3))
+
+    def step(self):
+        for job_id in self.store.heartbeat(list(self.tasks)):
+            task = self.tasks.pop(job_id)
+            self.runner.on_log(f"[JOBS] Lost the lease of {task.label}; another node will run it\n")
+            self.runner.cancel(task)
+        for job_id, task in list(self.tasks.items()):
+            if task.status in ("done", "error", "cancelled"):
+                del self.tasks[job_id]
+                keys = [archive_key(r.get("extractor_key"), r.get("id")) for r in task.results]
+                error = task.error_class if task.status == "error" else None
+                self.store.finish(job_id, task.status, task.returncode, error, [k for k in keys if k])
+        if self.archive is not None:
+            self.archive.sync()
+        free = max(1, self.runner.max_concurrent) - len(self.tasks)
+        if free > 0 and self.runner.is_active:
+            for job in self.store.claim(free):
+                self.tasks[job["id"]] = task = self._task(job)
+                self.runner.enqueue(task)
+
+    def _task(self, job: Dict) -> Task:
+        args = split_local(job["args"])[0] + self.local_args
+        if "--encoding" not in args:
+            args += ["--encoding", "utf-8"]
+        if "--download-archive" in args:
+            i = args.index("--download-archive")
+            if self.archive is not None:
+                args[i + 1] = str(self.archive.path)
+            else:
+                del args[i:i + 2]
+        task = Task(label=f"[job {job['id']}] {job['label']}", cmd=[self.ytdlp] + args, domain=job["domain"] or "",
+                    url=job["url"] or "", max_retries=self.max_retries, retry_sleep=self.retry_sleep)
+        task.job_id = job["id"]
+        return task
+
+    def stop(self):
+        """Stop claiming and hand unfinished jobs back to the store."""
+        self._stop.set()
+        for job_id, task in list(self.tasks.items()):
+            if task.status not in ("done", "error"):
+                self.runner.cancel(task)
+                self.store.release(job_id)
+        self.tasks.clear()
+
+def _main(argv: List[str]):
+    p = argparse.ArgumentParser(description="Shared download queue: add jobs, run a headless node, or show the state.")
+    p.add_argument("store", type=Path, help="job store file (e.g. on a shared volume)")
+    sub = p.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="queue URLs; yt-dlp options follow -- (-o is a template relative to each node's folder)")
+    add.add_argument("urls", nargs="+")
+    add.add_argument("--max-attempts", type=int, default=3)
+    work = sub.add_parser("work", help="run jobs until interrupted; this node's own options (-P folder, --ffmpeg-location, --cookies) follow --")
+    work.add_argument("--node", default=None)
+    work.add_argument("--concurrent", type=int, default=2)
+    work.add_argument("--lease", type=float, default=60.0)
+    work.add_argument("--yt-dlp", dest="ytdlp", default="yt-dlp")
+    work.add_argument("--state", type=Path, default=None, help="folder for this node's results and archive copy")
+    sub.add_parser("status")
+    if "--" in argv:
+        i = argv.index("--")
+        argv, ytdlp_args = argv[:i], argv[i + 1:]
+    else:
+        ytdlp_args = []
+    args = p.parse_args(argv)
+
+    if args.command == "add":
+        store = JobStore(args.store)
+        portable, local = split_local(ytdlp_args)
+        if local:
+            print(f"Not stored, each node adds its own: {' '.join(local)}")
+        for url in args.urls:
+            print(f"job {store.add([url] + portable, url=url, max_attempts=args.max_attempts)}: {url}")
+    elif args.command == "status":
+        store = JobStore(args.store)
+        print(json.dumps({"jobs": store.counts(), "nodes": store.nodes()}, indent=2))
+    else:
+        store = JobStore(args.store, node=args.node, lease=args.lease)
+        state = args.state or Path.home() / ".cache" / "ytdlp-interface-node" / store.node
+        runner = Runner(on_log=lambda line: print(line, end="", flush=True), on_task=lambda task: None,
+                        max_concurrent=args.concurrent)
+        runner.results_dir = str(state / "results")
+        worker = NodeWorker(store, runner, ytdlp=args.ytdlp, archive=ArchiveMirror(store, state / "archive.txt"),
+                            local_args=ytdlp_args)
+        print(f"Node {store.node} working on {args.store}")
+        worker.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            worker.stop()
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
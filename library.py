@@ -0,0 +1,251 @@
+# library.py
+# SQLite index of downloaded media, with full-text search and "already have it" checks
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# Printed by yt-dlp once per finished file (--print-to-file after_move:...), one JSON object per line
+RESULT_TEMPLATE = ("%(.{id,extractor_key,webpage_url,title,uploader,channel,description,duration,"
+                   "upload_date,filesize,filesize_approx,filepath})j")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY,
+    extractor TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    url TEXT,
+    title TEXT,
+    uploader TEXT,
+    description TEXT,
+    duration REAL,
+    upload_date TEXT,
+    filepath TEXT NOT NULL,
+    filesize INTEGER,
+    added_at REAL NOT NULL,
+    UNIQUE (extractor, video_id, filepath)
+);
+CREATE INDEX IF NOT EXISTS media_video ON media (extractor, video_id);
+CREATE INDEX IF NOT EXISTS media_path ON media (filepath);
+CREATE TABLE IF NOT EXISTS hashes (
+    filepath TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    partial TEXT NOT NULL,
+    full TEXT
+);
+CREATE INDEX IF NOT EXISTS hashes_partial ON hashes (size, partial);
+CREATE TABLE IF NOT EXISTS sidecars (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    extractor TEXT,
+    video_id TEXT,
+    url TEXT,
+    title TEXT,
+    uploader TEXT,
+    channel TEXT,
+    upload_date TEXT,
+    release_date TEXT,
+    timestamp INTEGER,
+    duration REAL,
+    availability TEXT,
+    live_status TEXT,
+    view_count INTEGER,
+    comment_count INTEGER,
+    format_id TEXT,
+    ext TEXT,
+    width INTEGER,
+    height INTEGER,
+    formats TEXT,
+    ingested_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sidecars_video ON sidecars (extractor, video_id);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+    title, uploader, description, content='media', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS media_ai AFTER INSERT ON media BEGIN
+    INSERT INTO media_fts (rowid, title, uploader, description) VALUES (new.id, new.title, new.uploader, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS media_ad AFTER DELETE ON media BEGIN
+    INSERT INTO media_fts (media_fts, rowid, title, uploader, description) VALUES ('delete', old.id, old.title, old.uploader, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS media_au AFTER UPDATE ON media BEGIN
+    INSERT INTO media_fts (media_fts, rowid, title, uploader, description) VALUES ('delete', old.id, old.title, old.uploader, old.description);
+    INSERT INTO media_fts (rowid, title, uploader, description) VALUES (new.id, new.title, new.uploader, new.description);
+END;
+"""
+
+def parse_results(path: Path) -> List[dict]:
+    """Read the records a task's yt-dlp wrote with RESULT_TEMPLATE."""
+    records = []
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(data, dict) and data.get("filepath"):
+                    records.append(data)
+    except OSError:
+        pass
+    return records
+
+class MediaLibrary:
+    """Downloaded files keyed by (extractor, video id), so the same video is
+    recognised whatever preset or output template produced it.
+
+    Uses FTS5 for search when the sqlite3 build has it, LIKE otherwise.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            try:
+                self._db.executescript(_FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False
+
+    def add(self, records: Iterable[dict]) -> int:
+        rows = []
+        now = time.time()
+        for r in records:
+            filepath = r.get("filepath")
+            if not filepath or not r.get("id"):
+                continue
+            try:
+                size = os.path.getsize(filepath)
+            except OSError:
+                size = r.get("filesize") or r.get("filesize_approx")
+            rows.append((
+                r.get("extractor_key") or "", str(r["id"]), r.get("webpage_url"), r.get("title"),
+                r.get("uploader") or r.get("channel"), r.get("description"), r.get("duration"),
+                r.get("upload_date"), os.path.abspath(filepath), size, now,
+            ))
+        if not rows:
+            return 0
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO media (extractor, video_id, url, title, uploader, description, duration, upload_date, filepath, filesize, added_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (extractor, video_id, filepath) DO UPDATE SET "
+                "url=excluded.url, title=excluded.title, uploader=excluded.uploader, description=excluded.description, "
+                "duration=excluded.duration, upload_date=excluded.upload_date, filesize=excluded.filesize, added_at=excluded.added_at",
+                rows,
+            )
+        return len(rows)
+
+    def have(self, extractor: str, video_id: str, check_files: bool = True) -> List[Dict]:
+        """Library entries of a video; with check_files only those whose file still exists."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM media WHERE extractor = ? AND video_id = ? ORDER BY added_at DESC",
+                (extractor or "", str(video_id)),
+            ).fetchall()
+        found = [dict(r) for r in rows]
+        if check_files:
+            found = [r for r in found if os.path.exists(r["filepath"])]
+        return found
+
+    def search(self, query: str, limit: int = 200) -> List[Dict]:
+        query = query.strip()
+        if not query:
+            sql, args = "SELECT * FROM media ORDER BY added_at DESC LIMIT ?", (limit,)
+        elif self.fts:
+            # Each word is matched as a prefix; quoting keeps FTS syntax characters literal
+            terms = " ".join('"' + w.replace('"', '""') + '"*' for w in query.split())
+            sql = ("SELECT media.* FROM media_fts JOIN media ON media.id = media_fts.rowid "
+                   "WHERE media_fts MATCH ? ORDER BY bm25(media_fts) LIMIT ?")
+            args = (terms, limit)
+        else:
+            like = f"%{query}%"
+            sql = "SELECT * FROM media WHERE title LIKE ? OR uploader LIKE ? OR description LIKE ? ORDER BY added_at DESC LIMIT ?"
+            args = (like, like, like, limit)
+        with self._lock:
+            return [dict(r) for r in self._db.execute(sql, args).fetchall()]
+
+    def paths_of_video(self, extractor: str, video_id: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT filepath FROM media WHERE extractor = ? AND video_id = ?", (extractor or "", str(video_id))).fetchall()
+        return [r[0] for r in rows]
+
+    def video_of_path(self, filepath: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM media WHERE filepath = ?", (filepath,)).fetchone()
+        return dict(row) if row else None
+
+    def get_hash(self, filepath: str, size: int, mtime_ns: int) -> Optional[Dict]:
+        """Cached hashes of a file, if it has not changed since they were taken."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM hashes WHERE filepath = ? AND size = ? AND mtime_ns = ?", (filepath, size, mtime_ns)).fetchone()
+        return dict(row) if row else None
+
+    def set_hash(self, filepath: str, size: int, mtime_ns: int, partial: str, full: Optional[str] = None):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO hashes (filepath, size, mtime_ns, partial, full) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (filepath) DO UPDATE SET size=excluded.size, mtime_ns=excluded.mtime_ns, "
+                "partial=excluded.partial, full=excluded.full",
+                (filepath, size, mtime_ns, partial, full),
+            )
+
+    def same_partial(self, size: int, partial: str) -> List[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT filepath FROM hashes WHERE size = ? AND partial = ?", (size, partial)).fetchall()
+        return [r[0] for r in rows]
+
+    def sidecar_mtimes(self, folder: str) -> Dict[str, int]:
+        """Indexed sidecars under folder and their mtimes, for incremental rescans."""
+        prefix = os.path.join(folder, "")
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, mtime_ns FROM sidecars WHERE substr(path, 1, ?) = ?", (len(prefix), prefix),
+            ).fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    def upsert_sidecars(self, rows: Iterable) -> int:
+        """Store (path, mtime_ns, size, fields) tuples from sidecars.extract_fields()."""
+        now = time.time()
+        values = []
+        for path, mtime_ns, size, d in rows:
+            formats = d.get("requested_formats")
+            values.append((
+                path, mtime_ns, size, d.get("extractor_key"), d.get("id"), d.get("webpage_url"), d.get("title"),
+                d.get("uploader"), d.get("channel"), d.get("upload_date"), d.get("release_date"), d.get("timestamp"),
+                d.get("duration"), d.get("availability"), d.get("live_status"), d.get("view_count"),
+                d.get("comment_count"), d.get("format_id"), d.get("ext"), d.get("width"), d.get("height"),
+                json.dumps(formats) if formats else None, now,
+            ))
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO sidecars (path, mtime_ns, size, extractor, video_id, url, title, uploader, channel, "
+                "upload_date, release_date, timestamp, duration, availability, live_status, view_count, comment_count, "
+                "format_id, ext, width, height, formats, ingested_at) VALUES (" + ", ".join("?" * 23) + ")",
+                values,
+            )
+        return len(values)
+
+    def remove_sidecars(self, paths: List[str]):
+        if not paths:
+            return
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM sidecars WHERE path = ?", [(p,) for p in paths])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
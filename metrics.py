@@ -0,0 +1,190 @@
+# metrics.py
+# Per-task phase timings and throughput, exported as JSON and Prometheus text
+
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Phase marks in the order a task normally reaches them
+MARKS = ("queued", "started", "extracted", "downloaded", "processed", "finished")
+
+class TaskMetrics:
+    """Timeline and transfer numbers of one queue item.
+
+    Both halves of a split item share one instance, so the item reports a
+    single timeline from queueing to the end of its processing stage.
+    """
+
+    def __init__(self):
+        self.marks: Dict[str, float] = {}
+        self.bytes = 0.0
+        self.file_bytes = 0.0
+        self.speed_sum = 0.0
+        self.speed_count = 0
+        self.peak_speed = 0.0
+        self.retries = 0
+
+    def mark(self, name: str, when: Optional[float] = None):
+        """Record the first time a phase is reached; later calls are ignored."""
+        self.marks.setdefault(name, time.time() if when is None else when)
+
+    def progress(self, total: Optional[float], percent: float, speed: Optional[float]):
+        if total:
+            self.file_bytes = total * min(percent, 100.0) / 100
+        if speed and percent < 100:
+            self.speed_sum += speed
+            self.speed_count += 1
+            self.peak_speed = max(self.peak_speed, speed)
+
+    def next_file(self):
+        self.bytes += self.file_bytes
+        self.file_bytes = 0.0
+
+    def avg_speed(self) -> Optional[float]:
+        start, end = self.marks.get("extracted"), self.marks.get("downloaded")
+        if start and end and end > start and self.bytes:
+            return self.bytes / (end - start)
+        return self.speed_sum / self.speed_count if self.speed_count else None
+
+    def as_dict(self) -> dict:
+        return {
+            "marks": dict(self.marks),
+            "bytes": int(self.bytes),
+            "avg_speed": self.avg_speed(),
+            "peak_speed": self.peak_speed or None,
+            "retries": self.retries,
+        }
+
+class MetricsRecorder:
+    """Collects finished items and rewrites metrics.json / metrics.prom in `folder`.
+
+    Writes are coalesced to at most one every `interval` seconds; the last
+    change is always flushed by a trailing timer.
+    """
+
+    def __init__(self, folder: Path, keep: int = 500, interval: float = 2.0):
+        self.folder = folder
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._records: "deque[dict]" = deque(maxlen=keep)
+        self._status = Counter()
+        self._failures = Counter()
+        self._retries = Counter()
+        self._bytes = 0.0
+        self._wait_sum = 0.0
+        self._wait_count = 0
+        self._gauges: Dict[str, int] = {}
+        self._started = time.time()
+        self._last_write = 0.0
+        self._timer: Optional[threading.Timer] = None
+
+    def finished(self, label: str, domain: str, status: str, error_class: Optional[str], metrics: TaskMetrics):
+        metrics.next_file()
+        metrics.mark("finished")
+        record = {"label": label, "domain": domain, "status": status, "error_class": error_class}
+        record.update(metrics.as_dict())
+        with self._lock:
+            self._records.append(record)
+            self._status[status] += 1
+            if status == "error":
+                self._failures[error_class or "other"] += 1
+            self._bytes += metrics.bytes
+            wait = self._queue_wait(metrics.marks)
+            if wait is not None:
+                self._wait_sum += wait
+                self._wait_count += 1
+        self.changed()
+
+    def retried(self, error_class: Optional[str]):
+        with self._lock:
+            self._retries[error_class or "other"] += 1
+        self.changed()
+
+    def set_gauges(self, **gauges: int):
+        with self._lock:
+            self._gauges.update(gauges)
+        self.changed()
+
+    @staticmethod
+    def _queue_wait(marks: Dict[str, float]) -> Optional[float]:
+        if "queued" in marks and "started" in marks:
+            return max(0.0, marks["started"] - marks["queued"])
+        return None
+
+    def summary(self) -> dict:
+        now = time.time()
+        with self._lock:
+            records = list(self._records)
+            finished = sum(self._status.values())
+            summary = {
+                "updated": now,
+                "since": self._started,
+                "finished": dict(self._status),
+                "failures_by_class": dict(self._failures),
+                "failure_rate_by_class": {k: v / finished for k, v in self._failures.items()} if finished else {},
+                "retries_by_class": dict(self._retries),
+                "bytes_total": int(self._bytes),
+                "queue_wait_avg": self._wait_sum / self._wait_count if self._wait_count else None,
+                "gauges": dict(self._gauges),
+            }
+        last_hour = [r for r in records if r["marks"].get("finished", 0) >= now - 3600]
+        summary["items_last_hour"] = sum(1 for r in last_hour if r["status"] == "done")
+        hours = max((now - self._started) / 3600, 1 / 60)
+        summary["items_per_hour"] = summary["finished"].get("done", 0) / hours
+        waits = [w for w in (self._queue_wait(r["marks"]) for r in last_hour) if w is not None]
+        summary["queue_wait_max_last_hour"] = max(waits) if waits else None
+        return summary
+
+    def changed(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            delay = max(0.0, self._last_write + self.interval - time.monotonic())
+            self._timer = threading.Timer(delay, self.write)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def write(self):
+        with self._lock:
+            self._timer = None
+            self._last_write = time.monotonic()
+            records = list(self._records)
+        summary = self.summary()
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            self._replace(self.folder / "metrics.json", json.dumps({"summary": summary, "tasks": records}, indent=2))
+            self._replace(self.folder / "metrics.prom", self._prometheus(summary))
+        except OSError as e:
+            print(f"Could not write metrics to {self.folder}: {e}")
+
+    @staticmethod
+    def _replace(path: Path, text: str):
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _prometheus(summary: dict) -> str:
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str, values: Dict[str, float], label: str = ""):
+            lines.append(f"# HELP ytdlp_{name} {help_text}")
+            lines.append(f"# TYPE ytdlp_{name} {kind}")
+            for key, value in values.items():
+                labels = f'{{{label}="{key}"}}' if label else ""
+                lines.append(f"ytdlp_{name}{labels} {value}")
+
+        metric("items_finished_total", "counter", "Queue items finished, by final status.", summary["finished"], "status")
+        metric("item_failures_total", "counter", "Failed queue items, by error class.", summary["failures_by_class"], "class")
+        metric("item_retries_total", "counter", "Automatic retries, by error class.", summary["retries_by_class"], "class")
+        metric("item_failure_ratio", "gauge", "Share of finished items that failed, by error class.", summary["failure_rate_by_class"], "class")
+        metric("bytes_downloaded_total", "counter", "Bytes downloaded by finished items.", {"": summary["bytes_total"]})
+        metric("items_per_hour", "gauge", "Items completed per hour since start.", {"": round(summary["items_per_hour"], 3)})
+        if summary["queue_wait_avg"] is not None:
+            metric("queue_wait_seconds_avg", "gauge", "Average time from queueing to first start.", {"": round(summary["queue_wait_avg"], 3)})
+        metric("queue_tasks", "gauge", "Tasks currently in each state.", summary["gauges"], "state")
+        return "\n".join(lines) + "\n"
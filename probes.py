@@ -0,0 +1,87 @@
+# probes.py
+# Cached "--version" probes for the external binaries (yt-dlp, ffmpeg)
+
+import json
+import os
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+class ProbeCache:
+    """Remembers the answer of a binary's version flag until the binary changes.
+
+    Entries are keyed by the resolved executable path and validated against the
+    file's size and mtime, so a probe only runs again after an update or a path change.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if isinstance(data, dict):
+                self._entries = data
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def resolve(exe: str) -> Optional[Tuple[str, int, int]]:
+        found = shutil.which(exe)
+        if not found:
+            return None
+        try:
+            real = os.path.realpath(found)
+            st = os.stat(real)
+        except OSError:
+            return None
+        return real, st.st_size, st.st_mtime_ns
+
+    def version(self, exe: str, flag: str, parse: Callable[[str], Optional[str]], timeout: float = 10) -> Optional[str]:
+        key = self.resolve(exe)
+        if key is None:
+            return None
+        real, size, mtime = key
+        cache_key = f"{real}|{flag}"
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry and entry.get("size") == size and entry.get("mtime") == mtime:
+                return entry.get("version")
+
+        try:
+            proc = subprocess.run([real, flag], capture_output=True, text=True, errors="replace", timeout=timeout, creationflags=NO_WINDOW)
+        except Exception:
+            return None
+        if proc.returncode != 0:
+            return None
+        value = parse(proc.stdout)
+        if value:
+            with self._lock:
+                self._entries[cache_key] = {"size": size, "mtime": mtime, "version": value}
+            self._save()
+        return value
+
+    def invalidate(self, exe: str):
+        key = self.resolve(exe)
+        if key is None:
+            return
+        prefix = f"{key[0]}|"
+        with self._lock:
+            for k in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[k]
+        self._save()
+
+    def _save(self):
+        with self._lock:
+            data = json.dumps(self._entries, indent=2)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(data, encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Could not save probe cache to {self.path}: {e}")
@@ -0,0 +1,152 @@
+# procstats.py
+# CPU, memory and disk I/O of each task's process tree (yt-dlp and its ffmpeg children), read from /proc
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+# Only Linux has /proc/<pid>/stat and /io; elsewhere nothing is sampled
+AVAILABLE = os.path.exists("/proc/self/stat")
+_TICKS = os.sysconf("SC_CLK_TCK") if AVAILABLE else 100
+_PAGE = os.sysconf("SC_PAGE_SIZE") if AVAILABLE else 4096
+
+def _stat_fields(pid: int) -> Optional[List[str]]:
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read().decode("ascii", "replace")
+    except OSError:
+        return None
+    # The command name is in parentheses and may contain spaces; fields resume after the last ')'
+    return data[data.rfind(")") + 2:].split()
+
+def children_map() -> Dict[int, List[int]]:
+    """Parent pid -> child pids of every process, from one pass over /proc."""
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        fields = _stat_fields(int(name))
+        if fields:
+            children.setdefault(int(fields[1]), []).append(int(name))
+    return children
+
+def process_tree(pid: int, children: Dict[int, List[int]]) -> List[int]:
+    tree, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        tree.append(p)
+        stack.extend(children.get(p, ()))
+    return tree
+
+def cpu_seconds(pids: List[int]) -> float:
+    """CPU time of the given processes (and the children they have waited for)."""
+    total = 0.0
+    for pid in pids:
+        fields = _stat_fields(pid)
+        if fields:
+            total += sum(int(v) for v in fields[11:15]) / _TICKS
+    return total
+
+def read_process(pid: int) -> Optional[Tuple[str, float, int, int, int]]:
+    """(start time, CPU seconds, RSS bytes, bytes read, bytes written) of one process.
+
+    CPU and I/O include the children it has already waited for, as the kernel
+    adds those when it reaps them. Read/written are storage I/O from
+    /proc/<pid>/io (0 where it is not readable).
+    """
+    fields = _stat_fields(pid)
+    if not fields:
+        return None
+    # Fields after the name: utime=11, stime=12, cutime=13, cstime=14, starttime=19, rss=21 (0-based, counting from state)
+    cpu = sum(int(v) for v in fields[11:15]) / _TICKS
+    rss = int(fields[21]) * _PAGE
+    read = written = 0
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "read_bytes":
+                    read = int(value)
+                elif key == "write_bytes":
+                    written = int(value)
+    except (OSError, ValueError):
+        pass
+    return fields[19], cpu, rss, read, written
+
+class ResourceMonitor:
+    """Samples the process trees of running tasks every `interval` seconds.
+
+    A reaped child's CPU time and I/O move into its parent's counters, so the
+    sum over the live tree covers finished ffmpeg runs too; the last reading of
+    each earlier attempt is kept, so totals span retries and restarts. What a
+    process does after the last sample before it exits is not counted.
+    max_rss (bytes, 0 = off): the runner ends a task whose tree exceeds it.
+    max_cpu (cores, 0 = off): a tree using more is held to it by a CpuThrottle.
+    """
+
+    def __init__(self, interval: float = 2.0, max_rss: int = 0, max_cpu: float = 0):
+        self.interval = interval
+        self.max_rss = max_rss
+        self.max_cpu = max_cpu
+        self.last = 0.0
+
+    def sample(self, tasks: list, now: float) -> List[Tuple[object, str, str]]:
+        """Update the usage fields of tasks; returns (task, "memory" or "cpu", reason) for each cap hit."""
+        self.last = now
+        hits = []
+        children = children_map()
+        for task in tasks:
+            if not task.process or task.process.poll() is not None:
+                continue
+            rss = 0
+            cpu, read, written = 0.0, 0, 0
+            attempt = None
+            task.proc_pids = process_tree(task.process.pid, children)
+            for pid in task.proc_pids:
+                usage = read_process(pid)
+                if usage is None:
+                    continue
+                attempt = attempt or (pid, usage[0])
+                rss += usage[2]
+                cpu, read, written = cpu + usage[1], read + usage[3], written + usage[4]
+            if attempt is None:
+                continue
+            task.proc_seen[attempt] = (cpu, read, written)
+            cpu_before = task.cpu_time
+            task.rss = rss
+            task.peak_rss = max(task.peak_rss, rss)
+            task.cpu_time = sum(v[0] for v in task.proc_seen.values())
+            task.read_bytes = sum(v[1] for v in task.proc_seen.values())
+            task.write_bytes = sum(v[2] for v in task.proc_seen.values())
+            if task.sampled_at:
+                task.cpu_cores = (task.cpu_time - cpu_before) / max(0.001, now - task.sampled_at)
+            task.sampled_at = now
+            if self.max_rss and rss > self.max_rss:
+                hits.append((task, "memory", f"{rss / 1024 ** 2:.0f} MiB of memory, over the {self.max_rss / 1024 ** 2:.0f} MiB cap"))
+            elif self.max_cpu and task.cpu_cores > self.max_cpu and task.cpu_throttle is None:
+                hits.append((task, "cpu", f"{task.cpu_cores:.1f} cores, over the {self.max_cpu:g} core cap; throttling"))
+        return hits
+
+class CpuThrottle:
+    """Holds a process tree to `cores` by letting it run for only `share` of each period.
+
+    The runner stops the tree (SIGSTOP) for the rest of the period. After each
+    period the share is scaled by cap / measured use, so a tree that runs at R
+    cores while allowed settles at a share of cores / R.
+    """
+
+    def __init__(self, cores: float):
+        self.cores = cores
+        self.share = 1.0
+        self._cpu: Optional[float] = None
+        self._at = 0.0
+
+    def update(self, cpu: float, now: float):
+        """Adjust the share from the tree's total CPU seconds, read once per period."""
+        elapsed = now - self._at
+        if self._cpu is not None and elapsed > 0:
+            used = (cpu - self._cpu) / elapsed
+            if used > 0:
+                self.share = min(1.0, max(0.02, self.share * self.cores / used))
+            elif self.share < 1.0:
+                self.share = min(1.0, self.share * 2)
+        self._cpu, self._at = cpu, now
@@ -0,0 +1,170 @@
+# profiling.py
+# Opt-in cProfile capture of UI handlers, tracemalloc snapshots and an event-loop lag monitor
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+ENV_VAR = "YTDLP_PYINTERFACE_PROFILE"
+
+def profiling_requested(cfg) -> bool:
+    return os.environ.get(ENV_VAR, "").strip() not in ("", "0") or bool(cfg.get("debug_profiling", False))
+
+class _HandlerStats:
+    __slots__ = ("calls", "total", "worst")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+class Profiler:
+    """Profiles wrapped methods and watches the Tk main loop for stalls.
+
+    Each outermost wrapped call runs under its own cProfile.Profile, merged into
+    one pstats.Stats per handler when the call returns, so nothing is kept per
+    thread; dump() writes one .pstats file per handler plus a text summary. Only the outermost
+    wrapped call on a thread is profiled (inner ones are timed), and a call that
+    finds another profiler active (Python 3.12+ allows one) is only timed too.
+    Output goes to `folder`.
+    """
+
+    def __init__(self, folder: Path, lag_threshold_ms: float = 200, heartbeat_ms: int = 100):
+        self.folder = folder
+        self.lag_threshold = lag_threshold_ms / 1000
+        self.heartbeat = heartbeat_ms / 1000
+        self._lock = threading.Lock()
+        self._merged: Dict[str, pstats.Stats] = {}
+        self._stats: Dict[str, _HandlerStats] = {}
+        self._local = threading.local()
+        self._main = threading.main_thread()
+        # Slowest handler that ran on the main thread since the last heartbeat
+        self._slowest: Optional[Tuple[float, str]] = None
+        self.lag_count = 0
+
+    def wrap(self, obj, name: str):
+        """Replace obj.name with a profiled version of itself."""
+        func = getattr(obj, name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = self._begin()
+            on_main = threading.current_thread() is self._main
+            start = time.perf_counter()
+            if profile is not None:
+                try:
+                    profile.enable()
+                except ValueError:
+                    profile = None
+                    self._local.profiling = False
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                    self._local.profiling = False
+                elapsed = time.perf_counter() - start
+                if profile is not None:
+                    self._collect(name, profile)
+                with self._lock:
+                    st = self._stats.setdefault(name, _HandlerStats())
+                    st.calls += 1
+                    st.total += elapsed
+                    st.worst = max(st.worst, elapsed)
+                    if on_main and (self._slowest is None or elapsed > self._slowest[0]):
+                        self._slowest = (elapsed, name)
+
+        setattr(obj, name, wrapper)
+
+    def _begin(self) -> Optional[cProfile.Profile]:
+        """A new profile for an outermost call on this thread, None for a nested one."""
+        if getattr(self._local, "profiling", False):
+            return None
+        self._local.profiling = True
+        return cProfile.Profile()
+
+    def _collect(self, name: str, profile: cProfile.Profile):
+        try:
+            stats = pstats.Stats(profile)
+        except TypeError:  # profile never collected anything
+            return
+        with self._lock:
+            merged = self._merged.get(name)
+            if merged is None:
+                self._merged[name] = stats
+            else:
+                merged.add(stats)
+
+    def start_lag_monitor(self, root):
+        """Schedule a heartbeat on root and log every beat that comes in later than the threshold."""
+        def beat(expected):
+            now = time.monotonic()
+            lag = now - expected
+            with self._lock:
+                slowest, self._slowest = self._slowest, None
+            if lag > self.lag_threshold:
+                self.lag_count += 1
+                culprit = f"{slowest[1]} ({slowest[0] * 1000:.0f} ms)" if slowest else "unprofiled code"
+                self._append("lag.log", f"{datetime.now().isoformat(timespec='milliseconds')} main loop {lag * 1000:.0f} ms late; slowest handler: {culprit}\n")
+            root.after(int(self.heartbeat * 1000), beat, time.monotonic() + self.heartbeat)
+
+        root.after(int(self.heartbeat * 1000), beat, time.monotonic() + self.heartbeat)
+
+    def snapshot_memory(self) -> Optional[Path]:
+        """Save a tracemalloc snapshot and its top allocations; the first call starts tracing."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            self._append("memory.log", f"{datetime.now().isoformat(timespec='seconds')} tracemalloc started; take another snapshot to see allocations\n")
+            return None
+        snap = tracemalloc.take_snapshot()
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = self.folder / f"tracemalloc-{stamp}.snap"
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            snap.dump(str(path))
+        except OSError as e:
+            print(f"Could not save tracemalloc snapshot: {e}")
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"{datetime.now().isoformat(timespec='seconds')} snapshot {path.name}: {current / 1024 / 1024:.1f} MiB traced, peak {peak / 1024 / 1024:.1f} MiB"]
+        lines += [f"  {stat}" for stat in snap.statistics("lineno")[:25]]
+        self._append("memory.log", "\n".join(lines) + "\n")
+        return path
+
+    def dump(self):
+        """Write merged .pstats per handler and a summary.txt sorted by total time."""
+        with self._lock:
+            merged_stats = dict(self._merged)
+            stats = {name: (s.calls, s.total, s.worst) for name, s in self._stats.items()}
+        out = io.StringIO()
+        out.write(f"Profile written {datetime.now().isoformat(timespec='seconds')}, main loop stalls: {self.lag_count}\n\n")
+        out.write(f"{'handler':<24}{'calls':>10}{'total s':>12}{'avg ms':>10}{'worst ms':>10}\n")
+        for name, (calls, total, worst) in sorted(stats.items(), key=lambda kv: -kv[1][1]):
+            out.write(f"{name:<24}{calls:>10}{total:>12.3f}{total / calls * 1000:>10.2f}{worst * 1000:>10.1f}\n")
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            for name, merged in merged_stats.items():
+                with self._lock:
+                    merged.dump_stats(str(self.folder / f"{name.strip('_')}.pstats"))
+                    out.write(f"\n=== {name} ===\n")
+                    merged.stream = out
+                    merged.sort_stats("cumulative").print_stats(15)
+            (self.folder / "summary.txt").write_text(out.getvalue(), encoding="utf-8")
+        except OSError as e:
+            print(f"Could not write profile to {self.folder}: {e}")
+
+    def _append(self, filename: str, text: str):
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            with open(self.folder / filename, "a", encoding="utf-8") as f:
+                f.write(text)
+        except OSError as e:
+            print(f"Could not write {filename}: {e}")
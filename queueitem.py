@@ -0,0 +1,80 @@
+# queueitem.py
+# Compact per-item queue state; the full info JSON lives in the InfoJsonCache
+
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from formats import compact_formats
+from infocache import InfoJsonCache
+
+# Fields of the --dump-json document the queue view and command builder use
+SUMMARY_FIELDS = ("webpage_url", "id", "extractor_key", "title", "format_id", "format_note", "resolution", "ext", "filesize_approx", "duration")
+
+def summarize(data: dict, url: str, cache: InfoJsonCache) -> dict:
+    """Spill data to the cache and return the few fields a QueueItem keeps (call off the UI thread)."""
+    summary = {k: data.get(k) for k in SUMMARY_FIELDS}
+    summary["formats"] = compact_formats(data)
+    key = InfoJsonCache.key_for(data, url)
+    summary["info_key"] = key if cache.store(key, data) else None
+    summary["fetched_at"] = time.time()
+    return summary
+
+class QueueItem:
+    __slots__ = ("url", "preset_args", "video_id", "extractor_key", "title", "format_id", "format_note", "ext",
+                 "filesize_approx", "duration", "formats", "choice", "format_override", "info_key", "fetched_at", "fetch_args", "task", "logs",
+                 "in_library")
+
+    def __init__(self, url: str, preset_args: Optional[List[str]] = None):
+        self.url = url
+        self.preset_args = preset_args
+        self.video_id: Optional[str] = None
+        self.extractor_key: Optional[str] = None
+        self.title: Optional[str] = None
+        self.format_id: Optional[str] = None
+        self.format_note: Optional[str] = None
+        self.ext: Optional[str] = None
+        self.filesize_approx: Optional[int] = None
+        self.duration: Optional[float] = None
+        # Compact formats list (see formats.compact_formats) and the one the current options select
+        self.formats: tuple = ()
+        self.choice = None
+        # Format selector picked in the formats window, replacing the one built from the options
+        self.format_override: Optional[str] = None
+        # Key of the full info JSON in the InfoJsonCache, once fetched
+        self.info_key: Optional[str] = None
+        self.fetched_at = 0.0
+        # Network options (app.network_args) the info JSON was extracted with
+        self.fetch_args: tuple = ()
+        self.task = None
+        self.logs: list = []
+        self.in_library: Optional[str] = None
+
+    @property
+    def has_info(self) -> bool:
+        return self.info_key is not None
+
+    def update(self, summary: dict):
+        self.url = summary.get("webpage_url") or self.url
+        self.video_id = summary.get("id")
+        self.extractor_key = summary.get("extractor_key")
+        self.title = summary.get("title")
+        self.format_id = summary.get("format_id")
+        self.format_note = summary.get("format_note") or summary.get("resolution")
+        self.ext = summary.get("ext")
+        self.filesize_approx = summary.get("filesize_approx")
+        self.duration = summary.get("duration")
+        self.formats = summary.get("formats") or ()
+        self.info_key = summary.get("info_key")
+        self.fetched_at = summary.get("fetched_at") or time.time()
+        self.fetch_args = tuple(summary.get("fetch_args") or ())
+
+    def info_path(self, cache: InfoJsonCache) -> Optional[Path]:
+        if self.info_key is None:
+            return None
+        path = cache.path(self.info_key)
+        return path if path.exists() else None
+
+    def load_info(self, cache: InfoJsonCache) -> Optional[dict]:
+        """The full info JSON, read from the cache on demand."""
+        return cache.load(self.info_key) if self.info_key else None
@@ -0,0 +1,60 @@
+# retry.py
+# Failure classification and backoff policy for queue retries
+
+import random
+import re
+from typing import Iterable, Optional
+
+HTTP_429 = "http-429"
+HTTP_403 = "http-403"
+NETWORK = "network"
+FRAGMENT = "fragment"
+UNAVAILABLE = "unavailable"
+FFMPEG = "ffmpeg"
+OTHER = "other"
+# Set by the runner, not classified from output: the process tree went over the memory cap
+MEMORY = "memory-limit"
+
+# Checked in order: permanent causes first, so "Private video ... HTTP Error 403"
+# is not mistaken for a transient 403.
+_PATTERNS = [
+    (UNAVAILABLE, re.compile(
+        r"video unavailable|private video|this video is private|members[- ]only|has been removed|"
+        r"account associated with this video has been terminated|not available in your country|"
+        r"sign in to confirm your age|copyright claim|this live event will begin|premieres in|"
+        r"unsupported url|is not a valid url|no video formats found|requested format is not available",
+        re.I)),
+    (FFMPEG, re.compile(r"postprocessing:|ffmpeg exited with code|conversion failed|ffprobe and ffmpeg not found|\[Merger\].*error", re.I)),
+    (HTTP_429, re.compile(r"HTTP Error 429|too many requests", re.I)),
+    (HTTP_403, re.compile(r"HTTP Error 403|403: forbidden", re.I)),
+    (FRAGMENT, re.compile(r"fragment|giving up after|did not get any data blocks", re.I)),
+    (NETWORK, re.compile(
+        r"connection reset|\[errno 104\]|\[errno 110\]|\[winerror 10054\]|timed out|connection aborted|"
+        r"remote end closed connection|incompleteread|temporary failure in name resolution|getaddrinfo failed|"
+        r"eof occurred in violation of protocol|network is unreachable|connection refused|HTTP Error 50[0234]",
+        re.I)),
+]
+
+TRANSIENT = {HTTP_429, HTTP_403, NETWORK, FRAGMENT}
+
+# 429 means the site wants us to back off for a while, not for a few seconds.
+_BASE_FACTOR = {HTTP_429: 12}
+MAX_DELAY = 15 * 60
+
+def classify_failure(lines: Iterable[str]) -> str:
+    """Classify a failed run from the tail of its output, preferring ERROR lines."""
+    lines = list(lines)
+    errors = [l for l in lines if "ERROR" in l]
+    for candidates in (errors, lines):
+        for cls, pattern in _PATTERNS:
+            if any(pattern.search(l) for l in candidates):
+                return cls
+    return OTHER
+
+def is_transient(error_class: Optional[str]) -> bool:
+    return error_class in TRANSIENT
+
+def backoff_delay(error_class: str, attempt: int, base: float) -> float:
+    """Exponential backoff with jitter: base * factor * 2^(attempt-1), +/-50%, capped."""
+    delay = max(1.0, base) * _BASE_FACTOR.get(error_class, 1) * (2 ** max(0, attempt - 1))
+    return min(MAX_DELAY, delay) * random.uniform(0.5, 1.5)
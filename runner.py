@@ -1,69 +1,1009 @@
-import subprocess, threading, queue
-from typing import List, Optional, Callable
+import codecs, os, re, signal, subprocess, threading, time, uuid
+from collections import deque
+from datetime import datetime, time as dtime
+from typing import Dict, Iterator, List, Optional, Callable, Tuple
+
+import retry
+from fragments import FragmentTuner
+from metrics import MetricsRecorder, TaskMetrics
+from tasklog import TaskLog, TaskLogStore
+from library import RESULT_TEMPLATE, parse_results
+from diskspace import DiskBudget
+from procstats import CpuThrottle, ResourceMonitor, cpu_seconds
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+_PROGRESS_RE = re.compile(
+    r"\[download\]\s+(?P<pct>[\d.]+)%\s+of\s+~?\s*(?P<total>[\d.]+\s*[KMGT]?i?B)"
+    r"(?:\s+in\s+\S+)?(?:\s+at\s+(?P<speed>[\d.]+\s*[KMGT]?i?B)/s)?"
+)
+
+# Output prefixes of yt-dlp post-processors that run ffmpeg (merge, embed, cut, convert)
+_POSTPROCESS_RE = re.compile(
+    r"^\[(Merger|EmbedThumbnail|EmbedSubtitle|FFmpegMetadata|Metadata|ModifyChapters|ExtractAudio|"
+    r"VideoRemuxer|VideoConvertor|SplitChapters|FixupM3u8|FixupM4a|FixupStretched|FixupDuplicateMoov|"
+    r"FixupTimestamp|ThumbnailsConvertor|SubtitlesConvertor)\]"
+)
+_DOWNLOAD_START_RE = re.compile(r"^\[download\] Destination:")
+_FRAGMENT_RE = re.compile(r"\(frag \d+/\d+\)")
+_FRAGMENT_ERROR_RE = re.compile(r"HTTP Error 429|Retrying fragment|fragment \d+ not found|Got error:", re.I)
+
+_EOL_RE = re.compile(rb"\r\n|\r|\n")
+
+def iter_output(stream, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """Yield a child's output line by line as it arrives, splitting on \\r as well as \\n.
+
+    Reads raw bytes (whatever is available, up to chunk_size) into one reused
+    buffer and decodes with replacement, so undecodable bytes cannot stop the
+    reader. Of several \\r progress frames that arrived in one read only the
+    newest is yielded. Empty lines are skipped; yielded lines end with "\\n".
+    Output is read as UTF-8, so yt-dlp is run with --encoding utf-8.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buf = bytearray()
+    skip_lf = False
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if skip_lf and chunk[:1] == b"\n":
+            chunk = chunk[1:]
+        buf += chunk
+        frame = None
+        start = 0
+        for m in _EOL_RE.finditer(buf):
+            segment = buf[start:m.start()]
+            start = m.end()
+            if not segment:
+                continue
+            if m.group() == b"\r":
+                frame = segment
+                continue
+            if frame is not None:
+                yield decoder.decode(bytes(frame)) + "\n"
+                frame = None
+            yield decoder.decode(bytes(segment)) + "\n"
+        if frame is not None:
+            yield decoder.decode(bytes(frame)) + "\n"
+        skip_lf = buf[start - 1:start] == b"\r" if start else False
+        del buf[:start]
+    tail = decoder.decode(bytes(buf), final=True)
+    if tail.strip():
+        yield tail + "\n"
+
+def parse_size(text: str) -> Optional[float]:
+    m = re.match(r"([\d.]+)\s*([KMGT]?)i?B", text.strip())
+    if not m:
+        return None
+    return float(m.group(1)) * _SIZE_UNITS[m.group(2)]
+
+def parse_progress(line: str) -> Optional[Tuple[float, Optional[float], Optional[float]]]:
+    """Parse a yt-dlp "[download] x% of y at z/s" line into (percent, total_bytes, speed)."""
+    m = _PROGRESS_RE.search(line)
+    if not m:
+        return None
+    speed = parse_size(m.group("speed")) if m.group("speed") else None
+    return float(m.group("pct")), parse_size(m.group("total")), speed
+
+def set_option(cmd: List[str], flag: str, value: Optional[str]) -> List[str]:
+    """Return a copy of cmd with flag set to value (or removed when value is None)."""
+    out = list(cmd)
+    while flag in out:
+        i = out.index(flag)
+        del out[i:i + 2]
+    if value is not None:
+        out += [flag, value]
+    return out
+
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 1
+
+# Statuses of tasks that go back into the queue when their slot is released
+REQUEUE_STATUSES = ("retrying", "preempted", "stopped", "paused")
+
+def processing_stage(task: "Task", cmd: List[str]) -> "Task":
+    """Create the CPU-pool half of a split item; it runs cmd once task has downloaded."""
+    stage = Task(f"{task.label} (processing)", cmd, cwd=task.cwd, domain=task.domain,
+                 max_retries=task.max_retries, retry_sleep=task.retry_sleep)
+    stage.stage = 2
+    stage.phase = "postprocess"
+    stage.metrics = task.metrics
+    task.stage = 1
+    task.next_stage = stage
+    return stage
+
+def get_option(cmd: List[str], flag: str) -> Optional[str]:
+    """Value of the last occurrence of flag in cmd, or None."""
+    for i in range(len(cmd) - 2, -1, -1):
+        if cmd[i] == flag:
+            return cmd[i + 1]
+    return None
+
+def restartable(cmd: List[str]) -> bool:
+    """Whether a run can be restarted to change its options; a batch file would be re-run from the top."""
+    return "--batch-file" not in cmd and "-a" not in cmd
+
+def resume_cmd(cmd: List[str]) -> List[str]:
+    """Return cmd set up to continue an interrupted download from its .part file."""
+    return [("--continue" if a == "--no-continue" else a) for a in cmd]
 
 class Task:
-    def __init__(self, label: str, cmd: List[str], cwd: Optional[str] = None):
+    def __init__(self, label: str, cmd: List[str], cwd: Optional[str] = None, domain: str = "",
+                 url: str = "", max_retries: int = 0, retry_sleep: float = 5,
+                 info_json: Optional[Callable[[], Optional[str]]] = None):
         self.label = label
         self.cmd = cmd
         self.cwd = cwd
+        self.domain = domain
+        self.url = url
+        self.max_retries = max_retries
+        self.retry_sleep = retry_sleep
+        # Called on retry; returns the path of the already-fetched info JSON (or None if stale)
+        self.info_json = info_json
+        self.attempts = 0
+        self.error_class: Optional[str] = None
+        self.not_before = 0.0
+        self.output_tail: "deque[str]" = deque(maxlen=40)
+        self.priority = PRIORITY_NORMAL
+        self.paused = False
+        self.started_at = 0.0
+        self.suspended = False
+        # "download" while fetching media, "postprocess" once ffmpeg work has begun
+        self.phase = "download"
+        # Whether the current run printed a post-processor line; unlike phase, independent of slot release
+        self.postprocessed = False
+        # 0: one process does everything; 1: download-only half of a split item; 2: its processing half
+        self.stage = 0
+        self.next_stage: Optional["Task"] = None
+        self.fragments: Optional[int] = None
+        self.fragmented = False
+        self.fragment_errors = 0
+        # Speed totals of self.metrics when the current run started; the run's average is the difference
+        self.run_speed_from = (0.0, 0)
+        self.metrics = TaskMetrics()
+        self.log: Optional[TaskLog] = None
+        # File yt-dlp writes the final path and id of each finished file to, and its parsed records
+        self.result_file: Optional[str] = None
+        self.results: List[dict] = []
+        # Folder -> bytes this task needs there at its peak (see diskspace.DiskBudget)
+        self.disk_needs: Dict[str, int] = {}
+        # Why the disk budget is holding the task back, while it is
+        self.disk_held: Optional[str] = None
+        # Usage of the whole process tree, over all attempts (see procstats.ResourceMonitor);
+        # proc_seen holds the last (CPU seconds, bytes read, bytes written) of each attempt's tree
+        self.rss = 0
+        self.peak_rss = 0
+        self.cpu_time = 0.0
+        self.cpu_cores = 0.0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.sampled_at = 0.0
+        self.proc_pids: List[int] = []
+        # Set once the tree went over the CPU cap; cpu_stopped while the throttle has it stopped
+        self.cpu_throttle: Optional[CpuThrottle] = None
+        self.cpu_stopped = False
+        self.proc_seen: Dict[Tuple[int, str], Tuple[float, int, int]] = {}
+        # Why the runner stopped the process: "restart", "preempt", "stop", "pause", "cancel" or "limit"
+        self._interrupt: Optional[str] = None
         self.process: Optional[subprocess.Popen] = None
         self.status = "queued"
         self.returncode: Optional[int] = None
+        self.percent = 0.0
+        self.speed: Optional[float] = None
+        self.last_progress = 0.0
+        self.rate_limit: Optional[int] = None
+        # The task's own --limit-rate, put back when the shared limit no longer applies
+        self.own_rate_limit: Optional[str] = None
+        self.rate_applied_at = 0.0
+
+class TaskQueue:
+    """Pending tasks in start order: by priority (lower first), then by position."""
+
+    def __init__(self):
+        self._items: List[Task] = []
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, task):
+        return task in self._items
+
+    def put(self, task: Task, front: bool = False):
+        """Insert at the end (or front) of the task's priority group."""
+        if front:
+            idx = next((i for i, t in enumerate(self._items) if t.priority >= task.priority), len(self._items))
+        else:
+            idx = next((i for i, t in enumerate(self._items) if t.priority > task.priority), len(self._items))
+        self._items.insert(idx, task)
+
+    def remove(self, task: Task):
+        self._items.remove(task)
+
+    def move(self, task: Task, delta: int):
+        """Move task delta places within its priority group."""
+        i = self._items.index(task)
+        group = [j for j, t in enumerate(self._items) if t.priority == task.priority]
+        pos = group.index(i)
+        new = group[max(0, min(len(group) - 1, pos + delta))]
+        self._items.insert(new, self._items.pop(i))
+
+    def reorder(self, order: List[Task]):
+        """Sort to follow order (e.g. the queue view); tasks not in it keep their place at the end."""
+        rank = {id(t): i for i, t in enumerate(order)}
+        self._items.sort(key=lambda t: (t.priority, rank.get(id(t), len(rank))))
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        if self.rate <= 0 or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        if self.rate > 0:
+            self.tokens -= 1
+
+class DomainScheduler:
+    """Per-domain admission: a token bucket for start rate plus a concurrency cap.
+
+    A limit of 0 means unlimited. Tasks with an empty domain are never held back.
+    """
+
+    def __init__(self, starts_per_minute: float = 0, burst: int = 1, max_per_domain: int = 0):
+        self.starts_per_minute = starts_per_minute
+        self.burst = burst
+        self.max_per_domain = max_per_domain
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.active: Dict[str, int] = {}
+        self.held_until: Dict[str, float] = {}
+
+    def configure(self, starts_per_minute: float, burst: int, max_per_domain: int):
+        if (starts_per_minute, burst) != (self.starts_per_minute, self.burst):
+            self.buckets.clear()
+        self.starts_per_minute = starts_per_minute
+        self.burst = burst
+        self.max_per_domain = max_per_domain
+
+    def _bucket(self, domain: str) -> TokenBucket:
+        bucket = self.buckets.get(domain)
+        if bucket is None:
+            bucket = self.buckets[domain] = TokenBucket(self.starts_per_minute / 60.0, self.burst)
+        return bucket
+
+    def check(self, domain: str, now: float) -> Tuple[bool, float]:
+        """Return (may_start, seconds_to_wait_if_not)."""
+        if not domain:
+            return True, 0.0
+        held = self.held_until.get(domain, 0.0) - now
+        if held > 0:
+            return False, held
+        if self.max_per_domain and self.active.get(domain, 0) >= self.max_per_domain:
+            return False, 0.0
+        wait = self._bucket(domain).wait_time(now)
+        return wait <= 0, wait
+
+    def cap_only(self, domain: str, now: float) -> bool:
+        """Whether domain is held back by its concurrency cap alone, so stopping one of its tasks lets the next start."""
+        if not domain or not self.max_per_domain or self.active.get(domain, 0) < self.max_per_domain:
+            return False
+        return self.held_until.get(domain, 0.0) <= now and self._bucket(domain).wait_time(now) <= 0
+
+    def started(self, domain: str, now: float):
+        if not domain:
+            return
+        self._bucket(domain).take(now)
+        self.active[domain] = self.active.get(domain, 0) + 1
+
+    def finished(self, domain: str):
+        if domain and self.active.get(domain):
+            self.active[domain] -= 1
+
+    def release(self, domain: str):
+        """Give back a running task's per-domain slot without finishing it (it went to post-processing)."""
+        self.finished(domain)
+
+    def reacquire(self, domain: str):
+        """Take a slot again for a task that returned to downloading; consumes no token."""
+        if domain:
+            self.active[domain] = self.active.get(domain, 0) + 1
+
+    def hold(self, domain: str, until: float):
+        """Start nothing for domain before the monotonic time until (e.g. after HTTP 429)."""
+        if domain:
+            self.held_until[domain] = max(self.held_until.get(domain, 0.0), until)
+
+class BandwidthGovernor:
+    """Splits one aggregate rate limit (bytes/s) across the running tasks.
+
+    Tasks that stopped reporting progress count as stalled and get no share, so
+    the busy ones can use the whole link. yt-dlp cannot change --limit-rate at
+    runtime, so a task is restarted (continuing its .part file) when its share
+    changes. Lowering is applied at once to keep the cap hard; raising waits for
+    min_interval and a relative change above tolerance to avoid restart churn.
+    """
+
+    def __init__(self, limit: int = 0, stall_after: float = 20.0, min_interval: float = 30.0, tolerance: float = 0.25):
+        self.limit = limit
+        self.hours: Optional[Tuple[dtime, dtime]] = None
+        self.stall_after = stall_after
+        self.min_interval = min_interval
+        self.tolerance = tolerance
+
+    def current_limit(self) -> int:
+        if not self.limit:
+            return 0
+        if self.hours:
+            start, end = self.hours
+            now = datetime.now().time()
+            inside = start <= now < end if start <= end else (now >= start or now < end)
+            if not inside:
+                return 0
+        return self.limit
+
+    def is_active(self, task: Task, now: float) -> bool:
+        return not task.suspended and task.phase == "download" and task.percent < 100 and now - (task.last_progress or task.rate_applied_at) < self.stall_after
+
+    def share_for_new(self, running: List[Task], now: float) -> Optional[int]:
+        limit = self.current_limit()
+        if not limit:
+            return None
+        active = sum(1 for t in running if self.is_active(t, now)) + 1
+        return max(1024, limit // active)
+
+    def rebalance(self, running: List[Task], now: float) -> List[Tuple[Task, Optional[int]]]:
+        """Return the (task, new_limit) pairs that should be restarted."""
+        limit = self.current_limit()
+        active = [t for t in running if t.process and self.is_active(t, now)]
+        changes = []
+        if not limit:
+            return [(t, None) for t in active if t.rate_limit and now - t.rate_applied_at >= self.min_interval]
+        if not active:
+            return changes
+        share = max(1024, limit // len(active))
+        for t in active:
+            if t.rate_limit is None or t.rate_limit > share * (1 + 0.01):
+                changes.append((t, share))
+            elif share > t.rate_limit * (1 + self.tolerance) and now - t.rate_applied_at >= self.min_interval:
+                changes.append((t, share))
+        return changes
 
 class Runner:
-    def __init__(self, on_log: Callable[[str], None], on_task: Callable[[Task], None]):
+    def __init__(self, on_log: Callable[[str], None], on_task: Callable[[Task], None],
+                 max_concurrent: int = 1, scheduler: Optional[DomainScheduler] = None,
+                 governor: Optional[BandwidthGovernor] = None):
         self.on_log = on_log
         self.on_task = on_task
-        self.q: "queue.Queue[Task]" = queue.Queue()
-        self._stop = threading.Event()
-        self.current: Optional[Task] = None
+        self.max_concurrent = max_concurrent
+        self.scheduler = scheduler or DomainScheduler()
+        self.governor = governor or BandwidthGovernor()
+        self.pending = TaskQueue()
+        # Processing halves of split items wait here for a CPU slot
+        self.cpu_pending = TaskQueue()
+        self.cpu_workers = os.cpu_count() or 1
+        # When set, picks --concurrent-fragments for each new download
+        self.fragment_tuner: Optional[FragmentTuner] = None
+        # When set, receives the timeline of every finished task
+        self.metrics: Optional[MetricsRecorder] = None
+        # When set, every task's output is also written to its own log file
+        self.log_store: Optional[TaskLogStore] = None
+        # When set, tasks report their final files (see library.RESULT_TEMPLATE) through this folder
+        self.results_dir: Optional[str] = None
+        # When set, downloads only start while their disk_needs fit in free space
+        self.disk: Optional[DiskBudget] = None
+        self._disk_notices: List[Task] = []
+        # When set, samples the process tree of running tasks and enforces its caps
+        self.resources: Optional[ResourceMonitor] = None
+        self.running: List[Task] = []
+        self.preempt = False
+        # "Start next item on lengthy processing": post-processing tasks give their download slot back
+        self.release_on_postprocess = False
+        self.max_postprocessing = 2
+        # "suspend" pauses a running child in place (SIGSTOP); "stop" ends it and resumes from the .part file later
+        self.pause_mode = "suspend"
+        self._cv = threading.Condition()
+        # Serializes SIGSTOP/SIGCONT of the CPU throttle with pausing in place
+        self._signal_lock = threading.Lock()
+        self._throttling = False
+        self._active = threading.Event()
+        self._active.set()
         threading.Thread(target=self._loop, daemon=True).start()
 
-    def enqueue(self, task: Task):
-        self.q.put(task)
+    @property
+    def is_active(self) -> bool:
+        return self._active.is_set()
+
+    def _queue_of(self, task: Task) -> Optional[TaskQueue]:
+        if task in self.pending:
+            return self.pending
+        if task in self.cpu_pending:
+            return self.cpu_pending
+        return None
+
+    def is_queued(self, task: Task) -> bool:
+        with self._cv:
+            return self._queue_of(task) is not None
+
+    def enqueue(self, task: Task, urgent: bool = False):
+        with self._cv:
+            if urgent:
+                task.priority = PRIORITY_URGENT
+            task.metrics.mark("queued")
+            self.pending.put(task)
+            self._cv.notify()
         self.on_log(f"[QUEUE] {task.label}\n")
+        self._update_gauges()
+
+    def move(self, task: Task, delta: int):
+        with self._cv:
+            if task in self.pending:
+                self.pending.move(task, delta)
+
+    def bump(self, task: Task, urgent: bool = False):
+        """Move a pending task to the front, optionally raising it to urgent priority."""
+        with self._cv:
+            if task not in self.pending:
+                return
+            self.pending.remove(task)
+            if urgent:
+                task.priority = PRIORITY_URGENT
+            self.pending.put(task, front=True)
+            self._cv.notify()
+
+    def reorder(self, order: List[Task]):
+        with self._cv:
+            self.pending.reorder(order)
+            self._cv.notify()
+
+    def set_paused(self, task: Task, paused: bool):
+        """Hold a pending task in place (it keeps its position but is skipped)."""
+        with self._cv:
+            task.paused = paused
+            self._cv.notify()
+
+    def wake(self):
+        """Re-evaluate the queue, e.g. after the limits were changed."""
+        with self._cv:
+            self._cv.notify()
+
+    def start(self):
+        """(Re)start dispatching queued tasks."""
+        self._active.set()
+        self.wake()
+
+    def hold(self):
+        """Stop starting new tasks; running ones carry on."""
+        self._active.clear()
 
     def stop_all(self):
-        self._stop.set()
-        if self.current and self.current.process:
-            try: self.current.process.terminate()
+        """Stop the pool: nothing new starts and running tasks go back to the queue.
+
+        Stopped tasks keep their place and resume from their .part files on start().
+        """
+        self._active.clear()
+        with self._cv:
+            running = list(self.running)
+            pending = list(self.pending) + list(self.cpu_pending)
+            self._cv.notify()
+        for task in running:
+            self._interrupt_task(task, "stop")
+        for task in pending:
+            if task.status != "stopped":
+                task.status = "stopped"
+                self.on_task(task)
+
+    def clear(self):
+        """Drop every queued (not running) task."""
+        with self._cv:
+            dropped = list(self.pending) + list(self.cpu_pending)
+            for task in dropped:
+                self._queue_of(task).remove(task)
+        for task in dropped:
+            task.status = "cancelled"
+            self.on_task(task)
+
+    def cancel(self, task: Task, start_next: bool = True):
+        """Cancel one task. With start_next False the pool is held, like the queue_autostart_on_stop setting."""
+        with self._cv:
+            queue = self._queue_of(task)
+            queued = queue is not None
+            if queued:
+                queue.remove(task)
+            running = task in self.running
+        if not start_next:
+            self.hold()
+        if queued:
+            task.status = "cancelled"
+            self.on_task(task)
+            self.on_log(f"[CANCEL] {task.label}\n")
+        elif running:
+            self._interrupt_task(task, "cancel")
+        self.wake()
+
+    def pause(self, task: Task):
+        with self._cv:
+            if self._queue_of(task):
+                task.paused = True
+                task.status = "paused"
+                queued = True
+            else:
+                queued = False
+            running = task in self.running
+        if queued:
+            self.on_task(task)
+        elif running and not task.suspended:
+            with self._signal_lock:
+                suspended = self.pause_mode == "suspend" and self._signal(task, getattr(signal, "SIGSTOP", None))
+                task.suspended = suspended
+            if suspended:
+                task.status = "paused"
+                self.on_task(task)
+                self.on_log(f"[PAUSE] {task.label}\n")
+            else:
+                self._interrupt_task(task, "pause")
+
+    def resume(self, task: Task):
+        if task.suspended:
+            if self._signal(task, getattr(signal, "SIGCONT", None)):
+                task.suspended = False
+                task.last_progress = time.monotonic()
+                task.status = "running"
+                self.on_task(task)
+                self.on_log(f"[RESUME] {task.label}\n")
+            return
+        with self._cv:
+            if self._queue_of(task):
+                task.paused = False
+                self._cv.notify()
+
+    def _signal(self, task: Task, sig) -> bool:
+        """Send sig to the task's process group (POSIX only)."""
+        if sig is None or os.name != "posix" or not task.process or task.process.poll() is not None:
+            return False
+        try:
+            os.killpg(task.process.pid, sig)
+            return True
+        except OSError:
+            return False
+
+    def _interrupt_task(self, task: Task, reason: str):
+        if not task.process or task.process.poll() is not None:
+            return
+        task._interrupt = reason
+        if task.suspended:
+            self._signal(task, getattr(signal, "SIGCONT", None))
+            task.suspended = False
+        if not self._signal(task, signal.SIGTERM):
+            try: task.process.terminate()
             except Exception: pass
 
+    def _next_task(self) -> Tuple[Optional[Task], Optional[float]]:
+        """Pick the first pending task whose domain may start now.
+
+        Called with the condition held. Tasks of a rate-limited domain are skipped,
+        so work for other domains keeps flowing. Returns (task, None) or (None, wait).
+        """
+        if not self._active.is_set():
+            return None, None
+        if self._postprocessing() < max(1, self.cpu_workers):
+            for task in self.cpu_pending:
+                if not task.paused and task.not_before <= time.monotonic():
+                    return task, None
+        if self._downloading() >= max(1, self.max_concurrent):
+            return None, None
+        now = time.monotonic()
+        wait = None
+        for task in self.pending:
+            if task.paused:
+                continue
+            if task.not_before > now:
+                task_wait = task.not_before - now
+                if wait is None or task_wait < wait:
+                    wait = task_wait
+                continue
+            ok, task_wait = self.scheduler.check(task.domain, now)
+            if ok and self.disk is not None and task.disk_needs:
+                ok, reason = self.disk.check(task)
+                if not ok:
+                    if task.disk_held is None:
+                        self._disk_notices.append(task)
+                    task.disk_held = reason
+                    # Free space can change outside the queue; look again shortly
+                    task_wait = self.disk.refresh
+            if ok:
+                self.scheduler.started(task.domain, now)
+                if self.disk is not None and task.disk_needs:
+                    self.disk.started(task)
+                task.disk_held = None
+                return task, None
+            if task_wait and (wait is None or task_wait < wait):
+                wait = task_wait
+        return None, wait
+
+    def _downloading(self) -> int:
+        return sum(1 for t in self.running if t.phase == "download")
+
+    def _postprocessing(self) -> int:
+        return sum(1 for t in self.running if t.phase == "postprocess")
+
+    def _set_phase(self, task: Task, phase: str):
+        with self._cv:
+            if task.phase == phase or task.stage == 2:
+                return
+            if phase == "postprocess":
+                if not self.release_on_postprocess or self._postprocessing() >= max(1, self.max_postprocessing):
+                    return
+                self.scheduler.release(task.domain)
+            else:
+                self.scheduler.reacquire(task.domain)
+            task.phase = phase
+            self._cv.notify()
+        self.on_task(task)
+
+    def _preempt_for_urgent(self):
+        """Called with the condition held: make room for a waiting urgent task.
+
+        Only an urgent task that could start in the freed slot counts: its domain
+        must admit it (or be blocked by its own concurrency cap alone, in which
+        case the victim is taken from that domain) and its disk need must fit.
+        The lowest-priority, most recently started running task is stopped and
+        put back at the front of its group; it resumes from its .part file later.
+        """
+        if not self.preempt or not self._active.is_set() or self._downloading() < max(1, self.max_concurrent):
+            return
+        if any(t._interrupt == "preempt" for t in self.running):
+            return
+        now = time.monotonic()
+        victims = [t for t in self.running if t.priority > PRIORITY_URGENT and t.phase == "download" and t.process and t.process.poll() is None]
+        for urgent in self.pending:
+            if urgent.priority != PRIORITY_URGENT or urgent.paused or urgent.not_before > now:
+                continue
+            if self.disk is not None and urgent.disk_needs and not self.disk.check(urgent)[0]:
+                continue
+            if self.scheduler.check(urgent.domain, now)[0]:
+                break
+            if self.scheduler.cap_only(urgent.domain, now):
+                victims = [t for t in victims if t.domain == urgent.domain]
+                break
+        else:
+            return
+        if not victims:
+            return
+        victim = max(victims, key=lambda t: (t.priority, t.started_at))
+        self.on_log(f"[PREEMPT] {victim.label}\n")
+        self._interrupt_task(victim, "preempt")
+
     def _loop(self):
-        while not self._stop.is_set():
+        while True:
+            self._rebalance()
+            self._sample_resources()
+            with self._cv:
+                self._preempt_for_urgent()
+                task, wait = self._next_task()
+                notices, self._disk_notices = self._disk_notices, []
+                if task is None and not notices:
+                    self._cv.wait(timeout=min(wait, 1.0) if wait else 1.0)
+                    continue
+                if task is not None:
+                    self._queue_of(task).remove(task)
+                    task.started_at = time.monotonic()
+                    task.metrics.mark("started")
+                    if task.stage != 2:
+                        if self.governor.current_limit() or task.rate_limit is not None:
+                            self._apply_rate(task, self.governor.share_for_new(self.running, time.monotonic()))
+                        self._apply_fragments(task)
+                    if task.stage != 1:
+                        self._request_results(task)
+                    self.running.append(task)
+            for held in notices:
+                self.on_log(f"[DISK] Holding {held.label}: {held.disk_held}\n")
+                self.on_task(held)
+            if task is not None:
+                threading.Thread(target=self._run_slot, args=(task,), daemon=True).start()
+
+    def _apply_rate(self, task: Task, limit: Optional[int]):
+        if task.rate_limit is None:
+            task.own_rate_limit = get_option(task.cmd, "--limit-rate")
+        task.rate_limit = limit
+        task.rate_applied_at = time.monotonic()
+        task.cmd = set_option(task.cmd, "--limit-rate", str(limit) if limit else task.own_rate_limit)
+
+    def _apply_fragments(self, task: Task):
+        if self.fragment_tuner is None:
+            return
+        task.fragments = self.fragment_tuner.choose(task.domain)
+        task.cmd = set_option(task.cmd, "--concurrent-fragments", str(task.fragments))
+
+    def _request_results(self, task: Task):
+        if self.results_dir is None or task.result_file:
+            return
+        os.makedirs(self.results_dir, exist_ok=True)
+        task.result_file = os.path.join(self.results_dir, f"{uuid.uuid4().hex}.jsonl")
+        task.cmd = task.cmd + ["--print-to-file", f"after_move:{RESULT_TEMPLATE}", task.result_file]
+
+    def _collect_results(self, task: Task):
+        if not task.result_file:
+            return
+        if task.status == "done":
+            task.results = parse_results(task.result_file)
+            for r in task.results:
+                r["filepath"] = os.path.join(task.cwd or os.getcwd(), r["filepath"])
+        if task.status in ("done", "error", "cancelled"):
             try:
-                task = self.q.get(timeout=0.2)
-            except queue.Empty:
+                os.unlink(task.result_file)
+            except OSError:
+                pass
+
+    def _record_fragments(self, task: Task):
+        """Report a finished download's throughput at its fragment count to the tuner."""
+        if self.fragment_tuner is None or task.fragments is None or task.stage == 2:
+            return
+        throttled = task.error_class in (retry.HTTP_429, retry.FRAGMENT) or task.fragment_errors >= 3
+        if not (task.fragmented or throttled):
+            return
+        m = task.metrics
+        count = m.speed_count - task.run_speed_from[1]
+        avg = (m.speed_sum - task.run_speed_from[0]) / count if count else None
+        with self._cv:
+            aggregate = sum(t.speed or 0 for t in self.running)
+        limit = self.governor.current_limit()
+        saturated = bool(limit) and aggregate >= 0.9 * limit
+        self.fragment_tuner.record(task.domain, task.fragments, avg, throttled=throttled, saturated=saturated)
+
+    def _update_gauges(self):
+        if self.metrics is None:
+            return
+        with self._cv:
+            gauges = {
+                "downloading": self._downloading(),
+                "processing": self._postprocessing(),
+                "queued": len(self.pending) + len(self.cpu_pending),
+                "disk_held": sum(1 for t in self.pending if t.disk_held),
+            }
+        self.metrics.set_gauges(**gauges)
+
+    def _report(self, task: Task):
+        """Close the task's timeline once it will not run again."""
+        m = task.metrics
+        if task.status in ("done", "downloaded"):
+            m.mark("downloaded")
+            if task.stage == 2 or (task.postprocessed and task.status == "done"):
+                m.mark("processed")
+        if self.metrics is not None and task.status in ("done", "error", "cancelled"):
+            self.metrics.finished(task.label, task.domain, task.status, task.error_class, m)
+
+    def _rebalance(self):
+        with self._cv:
+            changes = self.governor.rebalance(self.running, time.monotonic())
+        for task, limit in changes:
+            if task._interrupt or task.process.poll() is not None or not restartable(task.cmd):
                 continue
-            self.current = task
+            self.on_log(f"[RATE] {task.label} -> {f'{limit / 1024:.0f} KiB/s' if limit else 'unlimited'} (restarting)\n")
+            self._apply_rate(task, limit)
+            task.cmd = resume_cmd(task.cmd)
+            self._interrupt_task(task, "restart")
+
+    def _sample_resources(self):
+        monitor = self.resources
+        now = time.monotonic()
+        if monitor is None or now - monitor.last < monitor.interval:
+            return
+        with self._cv:
+            running = list(self.running)
+        for task in running:
+            if task.cpu_throttle is not None:
+                if monitor.max_cpu:
+                    task.cpu_throttle.cores = monitor.max_cpu
+                else:
+                    task.cpu_throttle = None
+        for task, kind, reason in monitor.sample(running, now):
+            if task._interrupt:
+                continue
+            self.on_log(f"[LIMIT] {task.label}: {reason}\n")
+            if kind == "memory":
+                task.error_class = retry.MEMORY
+                self._interrupt_task(task, "limit")
+            elif getattr(signal, "SIGSTOP", None) is not None:
+                task.cpu_throttle = CpuThrottle(monitor.max_cpu)
+                if not self._throttling:
+                    self._throttling = True
+                    threading.Thread(target=self._throttle_loop, daemon=True).start()
+
+    def _throttle_loop(self, period: float = 0.1):
+        """Stop each throttled task for the part of every period beyond its CPU share."""
+        while True:
+            with self._cv:
+                tasks = [t for t in self.running if t.cpu_throttle is not None and not t.suspended and not t._interrupt
+                         and t.process and t.process.poll() is None]
+            if not tasks:
+                time.sleep(0.5)
+                continue
+            start = time.monotonic()
+            for task in sorted(tasks, key=lambda t: t.cpu_throttle.share):
+                throttle = task.cpu_throttle
+                if throttle is None or throttle.share >= 1.0:
+                    continue
+                time.sleep(max(0.0, start + throttle.share * period - time.monotonic()))
+                with self._signal_lock:
+                    if not task.suspended and self._signal(task, signal.SIGSTOP):
+                        task.cpu_stopped = True
+            time.sleep(max(0.0, start + period - time.monotonic()))
+            for task in tasks:
+                with self._signal_lock:
+                    if task.cpu_stopped:
+                        task.cpu_stopped = False
+                        if not task.suspended:
+                            self._signal(task, signal.SIGCONT)
+                throttle = task.cpu_throttle
+                if throttle is not None:
+                    throttle.update(cpu_seconds(task.proc_pids), time.monotonic())
+
+    def _on_line(self, task: Task, line: str):
+        task.output_tail.append(line)
+        progress = parse_progress(line)
+        if progress:
+            task.percent, total, task.speed = progress
+            task.last_progress = time.monotonic()
+            task.metrics.mark("extracted")
+            task.metrics.progress(total, task.percent, task.speed)
+            if not task.fragmented and _FRAGMENT_RE.search(line):
+                task.fragmented = True
+        elif _FRAGMENT_ERROR_RE.search(line):
+            task.fragment_errors += 1
+        elif _POSTPROCESS_RE.match(line):
+            task.postprocessed = True
+            task.metrics.mark("downloaded")
+            self._set_phase(task, "postprocess")
+        elif _DOWNLOAD_START_RE.match(line):
+            task.metrics.mark("extracted")
+            task.metrics.next_file()
+            self._set_phase(task, "download")
+
+    def _run_slot(self, task: Task):
+        try:
             self._run_task(task)
-            self.current = None
+        finally:
+            with self._cv:
+                if task in self.running:
+                    self.running.remove(task)
+                if self.disk is not None:
+                    self.disk.finished(task)
+                if task.phase == "download":
+                    self.scheduler.finished(task.domain)
+                task.phase = "postprocess" if task.stage == 2 else "download"
+                queue = self.cpu_pending if task.stage == 2 else self.pending
+                if task.status in REQUEUE_STATUSES:
+                    queue.put(task, front=task.status != "retrying")
+                next_stage = task.next_stage if task.status == "downloaded" else None
+                self._cv.notify()
+            if next_stage:
+                next_stage.gui_id = getattr(task, "gui_id", None)
+                self.on_task(next_stage)
+                with self._cv:
+                    self.cpu_pending.put(next_stage)
+                    self._cv.notify()
+            self._update_gauges()
+
+    def _schedule_retry(self, task: Task) -> bool:
+        """Classify a failed run and, if it is transient and retries are left, set it up to run again.
+
+        Retries read the saved info JSON while it is fresh; after an HTTP 403
+        (expired format URLs) or once it is stale they extract from the URL again.
+        """
+        task.error_class = retry.classify_failure(task.output_tail)
+        if not retry.is_transient(task.error_class) or task.attempts >= task.max_retries:
+            return False
+        task.attempts += 1
+        task.metrics.retries += 1
+        if self.metrics is not None:
+            self.metrics.retried(task.error_class)
+        delay = retry.backoff_delay(task.error_class, task.attempts, task.retry_sleep)
+        now = time.monotonic()
+        task.not_before = now + delay
+        if task.error_class == retry.HTTP_429:
+            self.scheduler.hold(task.domain, task.not_before)
+
+        cmd = resume_cmd(task.cmd)
+        info_path = task.info_json() if task.info_json and task.error_class != retry.HTTP_403 else None
+        if "--load-info-json" in cmd and task.url:
+            i = cmd.index("--load-info-json")
+            cmd[i:i + 2] = ["--load-info-json", info_path] if info_path else [task.url]
+        elif info_path and task.url in cmd:
+            i = cmd.index(task.url)
+            cmd[i:i + 1] = ["--load-info-json", info_path]
+        task.cmd = cmd
+        task.status = "retrying"
+        task.percent = 0.0
+        task.output_tail.clear()
+        self.on_log(f"[RETRY] {task.label} ({task.error_class}) attempt {task.attempts}/{task.max_retries} in {delay:.0f}s\n")
+        return True
+
+    def _finish_interrupted(self, task: Task, reason: str):
+        """Set the status of a task whose process the runner stopped on purpose."""
+        if reason == "cancel":
+            task.status = "cancelled"
+            return
+        if reason == "limit":
+            # Over a resource cap it would only hit it again, so no retry
+            task.status = "error"
+            return
+        task.status = {"preempt": "preempted", "stop": "stopped", "pause": "paused"}[reason]
+        task.paused = reason == "pause"
+        task.percent = 0.0
+        task.cmd = resume_cmd(task.cmd)
 
     def _run_task(self, task: Task):
+        if self.log_store is not None and task.log is None:
+            task.log = self.log_store.create(task.label)
+        if task.log:
+            task.log.write(f"[RUN] {datetime.now().isoformat(timespec='seconds')} {subprocess.list2cmdline(task.cmd)}\n")
         task.status = "running"
+        task.fragmented = False
+        task.postprocessed = False
+        task.fragment_errors = 0
+        task.run_speed_from = (task.metrics.speed_sum, task.metrics.speed_count)
         self.on_task(task)
         self.on_log(f"[RUN] {task.label}\n")
         try:
-            task.process = subprocess.Popen(
-                task.cmd,
-                cwd=task.cwd or None,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-            )
-            assert task.process.stdout is not None
-            for line in task.process.stdout:
-                self.on_log(line)
-                if self._stop.is_set():
-                    break
-            task.process.wait()
+            while True:
+                task._interrupt = None
+                task.process = subprocess.Popen(
+                    task.cmd,
+                    cwd=task.cwd or None,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    bufsize=0,
+                    start_new_session=os.name == "posix",
+                )
+                assert task.process.stdout is not None
+                for line in iter_output(task.process.stdout):
+                    self.on_log(line)
+                    if task.log:
+                        task.log.write(line)
+                    self._on_line(task, line)
+                task.process.wait()
+                if task._interrupt == "restart":
+                    task.percent = 0.0
+                    # Not stalled while it extracts again
+                    task.last_progress = time.monotonic()
+                    continue
+                break
             task.returncode = task.process.returncode
-            task.status = "done" if task.returncode == 0 else "error"
+            reason, task._interrupt = task._interrupt, None
+            if reason and task.returncode != 0:
+                self._finish_interrupted(task, reason)
+            else:
+                task.status = "done" if task.returncode == 0 else "error"
+                if task.status == "done" and task.next_stage:
+                    task.status = "downloaded"
+                if task.status == "error":
+                    self._schedule_retry(task)
         except Exception as e:
             self.on_log(f"[ERROR] {e}\n")
             task.status = "error"
             task.returncode = -1
         finally:
+            task.suspended = False
+            if task.status in ("done", "downloaded", "error", "retrying"):
+                self._record_fragments(task)
+            self._report(task)
+            self._collect_results(task)
             self.on_task(task)
             self.on_log(f"[END] {task.label} (status={task.status}, code={task.returncode})\n")
+            if task.log:
+                task.log.write(f"[END] {datetime.now().isoformat(timespec='seconds')} status={task.status}, code={task.returncode}\n")
+                task.log.close(finished=task.status in ("done", "downloaded", "error", "cancelled"))
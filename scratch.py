@@ -0,0 +1,46 @@
+# scratch.py
+# Fast local folder for partial files, fragments and merges; only finished files reach the download folder
+
+import os
+import time
+from typing import List, Tuple
+
+# Created inside the configured scratch folder, so cleanup never touches anything else there
+SUBFOLDER = "ytdlp-interface-temp"
+
+def temp_dir(scratch: str) -> str:
+    return os.path.join(scratch, SUBFOLDER)
+
+def paths_args(home: str, scratch: str) -> List[str]:
+    """yt-dlp options writing intermediate files under scratch and moving finished ones to home.
+
+    The output template must be relative for these to apply.
+    """
+    return ["-P", f"home:{home}", "-P", f"temp:{temp_dir(scratch)}"]
+
+def cleanup_orphans(scratch: str, max_age: float = 24 * 3600) -> Tuple[int, int]:
+    """Delete files in the scratch subfolder untouched for max_age seconds; returns (files, bytes).
+
+    A running download keeps its files fresh, so anything older was left by a
+    crashed or abandoned run (possibly of another instance sharing the folder).
+    """
+    root = temp_dir(scratch)
+    cutoff = time.time() - max_age
+    files = size = 0
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+                if st.st_mtime < cutoff:
+                    os.unlink(path)
+                    files += 1
+                    size += st.st_size
+            except OSError:
+                continue
+        if dirpath != root:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+    return files, size
@@ -0,0 +1,205 @@
+# sidecars.py
+# Streaming ingestion of --write-info-json sidecars into the library database
+
+import json
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, TextIO
+
+from library import MediaLibrary
+
+# Top-level fields kept from each sidecar; everything else (formats, comments, subtitles...) is skipped unparsed
+FIELDS = (
+    "id", "extractor_key", "webpage_url", "title", "uploader", "uploader_id", "channel", "channel_id",
+    "upload_date", "release_date", "timestamp", "duration", "availability", "live_status", "view_count",
+    "like_count", "comment_count", "format_id", "ext", "width", "height", "fps", "vcodec", "acodec",
+    "filesize", "filesize_approx", "requested_formats",
+)
+_FORMAT_FIELDS = ("format_id", "ext", "vcodec", "acodec", "width", "height", "fps", "tbr", "filesize", "filesize_approx")
+
+_CHUNK = 64 * 1024
+_WS = " \t\r\n"
+_STRUCTURAL_RE = re.compile(r'["\[\]{}]')
+# Body of a JSON string up to its closing quote (or the end of the buffer)
+_STRING_BODY_RE = re.compile(r'[^"\\]*(?:\\[\s\S][^"\\]*)*')
+
+class _Stream:
+    """Character stream over a file with a small sliding buffer."""
+
+    def __init__(self, f: TextIO):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.keep_from: Optional[int] = None
+
+    def _fill(self) -> bool:
+        data = self.f.read(_CHUNK)
+        if not data:
+            return False
+        start = self.pos if self.keep_from is None else self.keep_from
+        if start:
+            # Drop what was consumed, unless a value being captured still needs it
+            self.buf = self.buf[start:]
+            self.pos -= start
+            if self.keep_from is not None:
+                self.keep_from = 0
+        self.buf += data
+        return True
+
+    def peek(self) -> str:
+        while self.pos >= len(self.buf):
+            if not self._fill():
+                raise ValueError("unexpected end of file")
+        return self.buf[self.pos]
+
+    def skip_ws(self) -> str:
+        while True:
+            c = self.peek()
+            if c not in _WS:
+                return c
+            self.pos += 1
+
+    def expect(self, c: str):
+        if self.skip_ws() != c:
+            raise ValueError(f"expected {c!r} at {self.pos}")
+        self.pos += 1
+
+    def skip_value(self):
+        """Move past one JSON value without building it."""
+        c = self.skip_ws()
+        if c == '"':
+            self._skip_string()
+            return
+        if c not in "[{":
+            while self.peek() not in ",]}" + _WS:
+                self.pos += 1
+            return
+        depth = 0
+        while True:
+            m = _STRUCTURAL_RE.search(self.buf, self.pos)
+            if m is None:
+                self.pos = len(self.buf)
+                self.peek()
+                continue
+            c = m.group()
+            self.pos = m.start()
+            if c == '"':
+                self._skip_string()
+                continue
+            self.pos += 1
+            if c in "[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def _skip_string(self):
+        self.pos += 1
+        while True:
+            self.pos = _STRING_BODY_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) and self.buf[self.pos] == '"':
+                self.pos += 1
+                return
+            # End of buffer, possibly on a backslash whose escaped character is in the next chunk
+            if not self._fill():
+                raise ValueError("unterminated string")
+
+    def read_value(self):
+        self.skip_ws()
+        self.keep_from = self.pos
+        try:
+            self.skip_value()
+            return json.loads(self.buf[self.keep_from:self.pos])
+        finally:
+            self.keep_from = None
+
+def extract_fields(path: str, fields=FIELDS) -> Dict:
+    """Stream a sidecar and return only `fields` of its top-level object; memory stays flat for huge files."""
+    wanted = set(fields)
+    out: Dict = {}
+    with open(path, encoding="utf-8", errors="replace") as f:
+        s = _Stream(f)
+        s.expect("{")
+        if s.skip_ws() == "}":
+            return out
+        while True:
+            key = s.read_value()
+            s.expect(":")
+            if key in wanted:
+                out[key] = s.read_value()
+            else:
+                s.skip_value()
+            c = s.skip_ws()
+            s.pos += 1
+            if c == "}":
+                break
+            if c != ",":
+                raise ValueError(f"unexpected {c!r} in {path}")
+    formats = out.get("requested_formats")
+    if isinstance(formats, list):
+        out["requested_formats"] = [{k: fmt.get(k) for k in _FORMAT_FIELDS if fmt.get(k) is not None}
+                                    for fmt in formats if isinstance(fmt, dict)]
+    return out
+
+def iter_sidecars(folder: str) -> Iterator[os.DirEntry]:
+    stack = [folder]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".info.json"):
+                        yield entry
+        except OSError:
+            continue
+
+def ingest_files(library: MediaLibrary, paths: List[str]) -> int:
+    """Parse and store the given sidecars."""
+    rows = []
+    count = 0
+    for path in paths:
+        try:
+            st = os.stat(path)
+            data = extract_fields(path)
+        except (OSError, ValueError):
+            continue
+        rows.append((path, st.st_mtime_ns, st.st_size, data))
+        if len(rows) >= 200:
+            count += library.upsert_sidecars(rows)
+            rows = []
+    if rows:
+        count += library.upsert_sidecars(rows)
+    return count
+
+def scan_folder(library: MediaLibrary, folder: str, progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """Incrementally index every *.info.json under folder; returns the number of (re)parsed files."""
+    folder = os.path.abspath(folder)
+    known = library.sidecar_mtimes(folder)
+    seen = set()
+    changed = []
+    for entry in iter_sidecars(folder):
+        seen.add(entry.path)
+        try:
+            if known.get(entry.path) != entry.stat().st_mtime_ns:
+                changed.append(entry.path)
+        except OSError:
+            continue
+    library.remove_sidecars([p for p in known if p not in seen])
+    count = 0
+    for i in range(0, len(changed), 200):
+        count += ingest_files(library, changed[i:i + 200])
+        if progress:
+            progress(min(i + 200, len(changed)), len(changed))
+    return count
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: python sidecars.py LIBRARY.sqlite3 FOLDER [FOLDER...]")
+        sys.exit(2)
+    lib = MediaLibrary(Path(sys.argv[1]))
+    for folder in sys.argv[2:]:
+        print(f"{folder}: {scan_folder(lib, folder)} sidecar(s) indexed")
@@ -0,0 +1,161 @@
+# tasklog.py
+# One rotating, gzip-compressed log file per queue task
+
+import gzip
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+class TaskLog:
+    """Buffered writer for one task's output.
+
+    When the file grows past max_bytes it is rotated to <name>.1.gz (older parts
+    shift up, at most `backups` are kept). close(finished=True) compresses the
+    current file too, so finished logs only exist as .gz.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab", buffering=64 * 1024)
+        self._size = self._file.tell()
+
+    def write(self, text: str):
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open()
+                data = text.encode("utf-8", errors="replace")
+                self._file.write(data)
+                self._size += len(data)
+                if self._size >= self.max_bytes:
+                    self._rotate()
+            except OSError as e:
+                print(f"Could not write task log {self.path}: {e}")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            src = self._part(i)
+            if src.exists():
+                os.replace(src, self._part(i + 1))
+        if self.backups:
+            _compress(self.path, self._part(1))
+        else:
+            self.path.unlink()
+        self._open()
+
+    def _part(self, i: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{i}.gz")
+
+    def close(self, finished: bool = False):
+        """Flush and close; a finished log is compressed to <name>.gz."""
+        with self._lock:
+            try:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                if finished and self.path.exists():
+                    _compress(self.path, self.path.with_name(self.path.name + ".gz"))
+            except OSError as e:
+                print(f"Could not close task log {self.path}: {e}")
+
+    def parts(self) -> List[Path]:
+        """Existing files of this log, oldest first."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+        older = [self._part(i) for i in range(self.backups, 0, -1)]
+        current = [self.path, self.path.with_name(self.path.name + ".gz")]
+        return [p for p in older + current if p.exists()]
+
+def _compress(src: Path, dst: Path):
+    tmp = dst.with_name(dst.name + ".tmp")
+    with open(src, "rb") as fin, gzip.open(tmp, "wb", compresslevel=6) as fout:
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+    os.replace(tmp, dst)
+    src.unlink()
+
+def read_tail(parts: List[Path], max_bytes: int) -> str:
+    """Return about the last max_bytes of a log, reading compressed parts only when needed."""
+    chunks: List[bytes] = []
+    need = max_bytes
+    for path in reversed(parts):
+        if need <= 0:
+            break
+        try:
+            if path.suffix == ".gz":
+                with gzip.open(path, "rb") as f:
+                    data = b""
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        data = (data + block)[-need:]
+            else:
+                with open(path, "rb") as f:
+                    f.seek(0, os.SEEK_END)
+                    f.seek(max(0, f.tell() - need))
+                    data = f.read()
+        except OSError:
+            continue
+        chunks.append(data)
+        need -= len(data)
+    return b"".join(reversed(chunks)).decode("utf-8", errors="replace")
+
+class TaskLogStore:
+    """Creates task logs in `folder` and deletes those older than keep_days."""
+
+    def __init__(self, folder: Path, max_bytes: int = 4 * 1024 * 1024, backups: int = 3, keep_days: int = 30):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.keep_days = keep_days
+
+    def create(self, label: str) -> TaskLog:
+        slug = re.sub(r"[^\w.-]+", "_", label).strip("_")[:60] or "task"
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{slug}.log"
+        path = self.folder / name
+        n = 1
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            pass
+        while True:
+            # Creating the file claims the name, so two tasks started in the same second get different files
+            try:
+                if not path.with_name(path.name + ".gz").exists():
+                    open(path, "x").close()
+                    break
+            except FileExistsError:
+                pass
+            except OSError:
+                break
+            n += 1
+            path = self.folder / f"{name[:-4]}-{n}.log"
+        return TaskLog(path, self.max_bytes, self.backups)
+
+    def prune(self):
+        if not self.keep_days:
+            return
+        cutoff = time.time() - self.keep_days * 86400
+        try:
+            entries = list(os.scandir(self.folder))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith((".log", ".gz")) and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass